@@ -0,0 +1,118 @@
+"""
+Engine parity check for md2html.py.
+
+Converts example.md and a set of edge cases (raw HTML code blocks, tilde
+fences, documents that start with a code block) with the 'soup' and 'tree'
+engines, under every combination of the stages the engines apply, and exits
+with status 1 if their body markup differs, so it can guard the 'tree'
+engine's output in CI.
+
+Usage:
+    python benchmarks/parity.py [FILE ...]
+"""
+import os
+import sys
+import difflib
+import argparse
+import itertools
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stages applied by the engines themselves; the others act on the document around the body
+ENGINE_STAGES = ('highlight', 'copy_buttons', 'images')
+
+CASES = {
+    'raw-html-code': (
+        '# Raw HTML\n\n'
+        '<pre><code class="language-py">x = 1\n</code></pre>\n\n'
+        '<pre><code>raw</code></pre>\n\n'
+        '<pre class="x"><code>a &lt; b &amp; c</code></pre>\n\n'
+        '<pre><code>has <b>bold</b> inside</code></pre>\n\n'
+        '<pre><code class="language-python other language-js">y = 2</code></pre>\n\n'
+        '<pre><span><code class="language-py">a=1</code></span></pre>\n\n'
+        '<pre><code>a</code><code>b</code></pre>\n\n'
+        '<pre>\n<code>x</code>tail</pre>\n\n'
+        '<pre>no code</pre>\n'
+    ),
+    'raw-html-nested': (
+        'Intro\n\n'
+        '<div>text\n<pre><code>x</code></pre></div>\n\n'
+        '<div><pre><code class="language-js">let a = 1;</code></pre></div>\n\n'
+        '<div>\n<pre><code>x</code></pre>\n</div>\n\n'
+        '<div>text <pre><code>x</code></pre>after</div>\n\n'
+        '<p>x</p><pre><code>z</code></pre>\n\n'
+        '<div><img src="a.png"><pre><code><img src="b.png"></code></pre></div>\n'
+    ),
+    'raw-html-first': '<pre><code class="language-py">first = True</code></pre>\n\nAfter\n',
+    'tilde-fences': (
+        '~~~\nfirst block\n~~~\n\n'
+        '~~~~\nfour tildes\n~~~~\n\n'
+        '~~~ {.python}\nx = 1\n~~~\n\n'
+        '~~~python\n\n\ntwo blank lines first\n~~~\n\n'
+        '~~~\n```\nnested backticks\n```\n~~~\n\n'
+        '~~~\n~~~\n\n'
+        '- item\n\n    ~~~\n    in list\n    ~~~\n\n'
+        '> ~~~\n> in quote\n> ~~~\n'
+    ),
+    'fence-first': '```python\nprint("first")\n```\n\nText\n',
+    'indented-first': '    indented code first\n\nText\n',
+}
+
+
+def load_documents(paths: List[str]) -> Dict[str, str]:
+    """Return the built-in cases, example.md and any extra files, by name."""
+    documents = dict(CASES)
+    for path in [os.path.join(REPO_DIR, 'example.md')] + paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            documents[os.path.relpath(path)] = f.read()
+    return documents
+
+
+def compare_engines(md_text: str, disabled_stages: frozenset) -> List[str]:
+    """
+    Convert one document with both engines.
+
+    Returns:
+        Unified diff of the soup (first) and tree bodies; empty if they are identical
+    """
+    import md2html
+
+    options = md2html.OutputOptions(disabled_stages=disabled_stages)
+    bodies = [md2html.extract_body_content(md2html.convert_md_to_html(md_text, engine=engine, options=options),
+                                           engine)
+              for engine in ('soup', 'tree')]
+    if bodies[0] == bodies[1]:
+        return []
+    return list(difflib.unified_diff(bodies[0].splitlines(), bodies[1].splitlines(), 'soup', 'tree',
+                                     lineterm='', n=1))
+
+
+def main() -> None:
+    """Compare the engines on every document and stage combination."""
+    parser = argparse.ArgumentParser(description="Check that the md2html engines produce the same markup.")
+    parser.add_argument("files", nargs='*', help="Extra Markdown files to check.")
+    parser.add_argument("--max-lines", type=int, default=20,
+                        help="Diff lines to print per mismatch. Default is 20.")
+    args = parser.parse_args()
+
+    failed = 0
+    checked = 0
+    for name, md_text in load_documents(args.files).items():
+        for count in range(len(ENGINE_STAGES) + 1):
+            for stages in itertools.combinations(ENGINE_STAGES, count):
+                checked += 1
+                diff = compare_engines(md_text, frozenset(stages))
+                if diff:
+                    failed += 1
+                    print(f"FAIL: {name} with {', '.join(stages) or 'no stages'} disabled")
+                    for line in diff[:args.max_lines]:
+                        print(f"    {line}")
+    print(f"{checked - failed} of {checked} document/stage combinations identical")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
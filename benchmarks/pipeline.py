@@ -0,0 +1,296 @@
+"""
+Conversion pipeline benchmark for md2html.py.
+
+Generates synthetic corpora (code-heavy, table-heavy, footnote-heavy, one
+huge file, many tiny files) next to example.md and converts each of them in
+a fresh process, reporting per-stage timings, throughput and peak RSS.
+
+Stages are those of --profile (md2html.PROFILE_STAGES): files are read with
+read_markdown_file, converted with a Converter and written with
+write_html_file, and the timings come from the installed Profiler. As in
+the --profile report, 'highlight' is included in 'markdown' (tree engine) or
+'soup' (soup engine) and 'theme_css' in 'head'; the total is wall time. The
+highlighting snippet cache is cleared for every run.
+
+Usage:
+    python benchmarks/pipeline.py [--engine soup tree] [--corpus code tables] [--scale 0.5]
+    python benchmarks/pipeline.py --save-baseline baseline.json
+    python benchmarks/pipeline.py --compare baseline.json [--threshold 0.25]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import md2html
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = md2html.PROFILE_STAGES
+CODE_LANGUAGES = ('python', 'javascript', 'bash', 'sql', 'go', 'rust', 'json', 'yaml')
+WORDS = ('markdown', 'render', 'document', 'table', 'stream', 'cache', 'output', 'theme', 'parser',
+         'section', 'anchor', 'footnote', 'highlight', 'convert', 'browser', 'style', 'value', 'index')
+
+
+def _sentence(rng: random.Random, words: int = 12) -> str:
+    """Return a pseudo-random sentence."""
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def generate_code_heavy(rng: random.Random, size: int) -> str:
+    """Sections that are mostly fenced code blocks in rotating languages."""
+    parts = ['# Code heavy\n']
+    index = 0
+    while sum(map(len, parts)) < size:
+        language = CODE_LANGUAGES[index % len(CODE_LANGUAGES)]
+        lines = [f'value_{index}_{line} = compute("{rng.choice(WORDS)}", {rng.randint(0, 999)})  # {line}'
+                 for line in range(rng.randint(5, 30))]
+        parts.append(f'\n## Example {index}\n\n{_sentence(rng)}\n\n```{language}\n' + '\n'.join(lines) + '\n```\n')
+        index += 1
+    return ''.join(parts)
+
+
+def generate_table_heavy(rng: random.Random, size: int) -> str:
+    """Many medium-sized tables with inline formatting in their cells."""
+    parts = ['# Table heavy\n']
+    index = 0
+    while sum(map(len, parts)) < size:
+        rows = [f'| {" | ".join(f"**{rng.choice(WORDS)}** `{rng.randint(0, 99)}`" for _ in range(6))} |'
+                for _ in range(rng.randint(5, 20))]
+        parts.append(f'\n## Table {index}\n\n| A | B | C | D | E | F |\n|---|:-:|--:|---|---|---|\n'
+                     + '\n'.join(rows) + '\n')
+        index += 1
+    return ''.join(parts)
+
+
+def generate_footnote_heavy(rng: random.Random, size: int) -> str:
+    """Paragraphs citing many footnotes, with the definitions at the end."""
+    paragraphs = ['# Footnote heavy\n']
+    definitions = []
+    index = 0
+    while sum(map(len, paragraphs)) + sum(map(len, definitions)) < size:
+        paragraphs.append(f'\n{_sentence(rng)} See note[^n{index}] and [^n{index + 1}]. {_sentence(rng)}\n')
+        definitions.append(f'\n[^n{index}]: {_sentence(rng, 8)}\n')
+        definitions.append(f'\n[^n{index + 1}]: *{_sentence(rng, 6)}*\n')
+        index += 2
+    return ''.join(paragraphs + definitions)
+
+
+def generate_mixed(rng: random.Random, size: int) -> str:
+    """Prose, lists, code and tables, as in a long manual."""
+    parts = ['# Manual\n\n[TOC]\n']
+    generators = (generate_code_heavy, generate_table_heavy, generate_footnote_heavy)
+    index = 0
+    while sum(map(len, parts)) < size:
+        parts.append(f'\n## Chapter {index}\n\n{_sentence(rng, 30)}\n\n- {_sentence(rng)}\n- {_sentence(rng)}\n')
+        section = generators[index % len(generators)](rng, 4000)
+        parts.append(section.split('\n', 1)[1].replace('[^n', f'[^c{index}n'))
+        index += 1
+    return ''.join(parts)
+
+
+def build_corpora(directory: str, scale: float) -> Dict[str, List[str]]:
+    """
+    Write every corpus into a directory.
+
+    Args:
+        directory: Directory to create the corpus files in
+        scale: Size multiplier for the generated corpora
+
+    Returns:
+        Mapping of corpus name to its Markdown file paths
+    """
+    rng = random.Random(2024)
+    corpora = {'example': [os.path.join(REPO_DIR, 'example.md')]}
+    single = {
+        'code': (generate_code_heavy, 200_000),
+        'tables': (generate_table_heavy, 200_000),
+        'footnotes': (generate_footnote_heavy, 200_000),
+        'huge': (generate_mixed, 2_000_000),
+    }
+    for name, (generator, size) in single.items():
+        path = os.path.join(directory, f'{name}.md')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(generator(rng, int(size * scale)))
+        corpora[name] = [path]
+
+    tiny_directory = os.path.join(directory, 'tiny')
+    os.makedirs(tiny_directory, exist_ok=True)
+    corpora['tiny'] = []
+    for index in range(max(1, int(500 * scale))):
+        path = os.path.join(tiny_directory, f'page{index}.md')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f'# Page {index}\n\n{_sentence(rng)}\n\n- {_sentence(rng, 5)}\n- `{rng.choice(WORDS)}`\n')
+        corpora['tiny'].append(path)
+    return corpora
+
+
+def run_once(paths: List[str], engine: str, output_dir: str) -> Tuple[Dict[str, float], float]:
+    """
+    Convert files once with profiling enabled.
+
+    Returns:
+        Tuple of (mapping of stage name to seconds, total wall time in seconds)
+    """
+    converter = md2html.Converter(engine=engine)
+    md2html.highlight_code.cache_clear()
+    profiler = md2html.enable_profiling()
+    try:
+        start = time.perf_counter()
+        for index, path in enumerate(paths):
+            md_text = md2html.read_markdown_file(path)
+            output_path = os.path.join(output_dir, f'{index}.html')
+            md2html.write_html_file(output_path, converter.convert(md_text, document_path=output_path))
+        total = time.perf_counter() - start
+    finally:
+        md2html.disable_profiling()
+    stages = profiler.report()['stages']
+    return {stage: stages[stage]['seconds'] if stage in stages else 0.0 for stage in STAGES}, total
+
+
+def run_corpus(paths: List[str], engine: str, repeat: int) -> dict:
+    """
+    Benchmark one corpus with one engine (run in a dedicated process).
+
+    Returns:
+        Result with median per-stage milliseconds, total, MB/s and peak RSS
+    """
+    import resource
+
+    input_bytes = sum(os.path.getsize(path) for path in paths)
+    runs = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        # Untimed warm-up so imports, lexer loading and regex compilation are not counted
+        run_once(paths[:1], engine, output_dir)
+        for _ in range(repeat):
+            runs.append(run_once(paths, engine, output_dir))
+    stages = {stage: round(statistics.median(timings[stage] for timings, _ in runs) * 1000, 3) for stage in STAGES}
+    total = statistics.median(total for _, total in runs)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+    return {
+        'files': len(paths),
+        'input_mb': round(input_bytes / 1e6, 3),
+        'stages_ms': stages,
+        'total_ms': round(total * 1000, 3),
+        'mb_per_s': round(input_bytes / 1e6 / total, 3) if total else None,
+        'peak_rss_mb': round(peak_rss_mb, 1),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_ms: float) -> List[str]:
+    """
+    Compare results with a stored baseline.
+
+    A stage (or the total) regresses when it is more than threshold slower
+    than the baseline and also slower by more than min_ms, which keeps noise
+    in very fast stages from failing the comparison.
+
+    Returns:
+        Human-readable description of every regression
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        pairs = [(stage, result['stages_ms'][stage], base['stages_ms'].get(stage)) for stage in STAGES]
+        pairs.append(('total', result['total_ms'], base['total_ms']))
+        for stage, current, previous in pairs:
+            if previous is None:
+                continue
+            if current > previous * (1 + threshold) and current - previous > min_ms:
+                regressions.append(f"{key} {stage}: {previous:.1f} ms -> {current:.1f} ms "
+                                   f"(+{(current / previous - 1) * 100 if previous else float('inf'):.0f}%)")
+    return regressions
+
+
+def print_table(results: dict) -> None:
+    """Print results as an aligned table."""
+    header = f"{'corpus/engine':<18}{'files':>6}{'MB':>8}" + ''.join(f'{stage:>12}' for stage in STAGES)
+    header += f"{'total':>10}{'MB/s':>8}{'RSS MB':>8}"
+    print(header)
+    print('-' * len(header))
+    for key, result in results.items():
+        row = f"{key:<18}{result['files']:>6}{result['input_mb']:>8.2f}"
+        row += ''.join(f"{result['stages_ms'][stage]:>12.1f}" for stage in STAGES)
+        row += f"{result['total_ms']:>10.1f}{result['mb_per_s'] or 0:>8.2f}{result['peak_rss_mb']:>8.1f}"
+        print(row)
+    print("(stage and total times are medians in milliseconds)")
+
+
+def main() -> None:
+    """Build the corpora, benchmark each in its own process and report or compare."""
+    parser = argparse.ArgumentParser(description="Benchmark the md2html conversion pipeline.")
+    parser.add_argument("--engine", nargs='+', choices=('soup', 'tree'), default=['soup', 'tree'],
+                        help="Engines to benchmark. Default is both.")
+    parser.add_argument("--corpus", nargs='+', choices=('example', 'code', 'tables', 'footnotes', 'huge', 'tiny'),
+                        help="Corpora to benchmark. Default is all.")
+    parser.add_argument("--scale", type=float, default=1.0, help="Corpus size multiplier. Default is 1.0.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per corpus; medians are reported. Default is 3.")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    parser.add_argument("--save-baseline", help="Write the results as a baseline JSON file.")
+    parser.add_argument("--compare", help="Compare against a baseline JSON file and exit 1 on regressions.")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed slowdown per stage for --compare, as a fraction. Default is 0.25.")
+    parser.add_argument("--min-ms", type=float, default=2.0,
+                        help="Ignore slowdowns smaller than this many milliseconds. Default is 2.")
+    parser.add_argument("--run-one", nargs=2, metavar=('ENGINE', 'PATHS_FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        engine, paths_file = args.run_one
+        with open(paths_file, 'r', encoding='utf-8') as f:
+            paths = json.load(f)
+        print(json.dumps(run_corpus(paths, engine, args.repeat)))
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        corpora = build_corpora(corpus_dir, args.scale)
+        for name, paths in corpora.items():
+            if args.corpus and name not in args.corpus:
+                continue
+            paths_file = os.path.join(corpus_dir, f'{name}.json')
+            with open(paths_file, 'w', encoding='utf-8') as f:
+                json.dump(paths, f)
+            for engine in args.engine:
+                # A fresh process per corpus keeps caches and peak RSS independent
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--repeat', str(args.repeat),
+                                         '--run-one', engine, paths_file],
+                                        stdout=subprocess.PIPE, text=True, check=True).stdout
+                results[f'{name}/{engine}'] = json.loads(output.strip().splitlines()[-1])
+                print(f"  {name}/{engine} done", file=sys.stderr)
+
+    print_table(results)
+    report = {'python': sys.version.split()[0], 'scale': args.scale, 'results': results}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale:
+            print(f"Warning: baseline was recorded with --scale {baseline.get('scale')}")
+        regressions = compare(results, baseline.get('results', {}), args.threshold, args.min_ms)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Startup benchmark for md2html.py.
+
+Runs the converter's fast CLI paths (--help and a missing input file) under
+``python -X importtime`` and reports wall time and the slowest imports. Exits
+with status 1 if a heavy dependency is imported on those paths or the median
+import time exceeds the budget, so it can guard cold start in CI.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--budget-ms 80] [--top 10]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'md2html.py')
+
+# Modules that must not be loaded just to print help or report a missing file
+HEAVY_MODULES = ('markdown', 'bs4', 'lxml', 'pygments.lexers', 'pygments.formatters', 'concurrent.futures')
+
+SCENARIOS = {
+    'help': ['--help'],
+    'missing-input': ['-i', 'does-not-exist.md', '-d', os.devnull],
+}
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_importtime(stderr: str) -> Tuple[int, Dict[str, int]]:
+    """
+    Parse ``-X importtime`` output.
+
+    Args:
+        stderr: Standard error of the profiled process
+
+    Returns:
+        Tuple of (total import time in microseconds, cumulative time per module)
+    """
+    total = 0
+    modules = {}
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        cumulative = int(match.group(2))
+        modules[match.group(4)] = cumulative
+        # Top-level imports are indented by exactly one space
+        if len(match.group(3)) == 1:
+            total += cumulative
+    return total, modules
+
+
+def run_scenario(arguments: List[str]) -> Tuple[float, int, Dict[str, int]]:
+    """
+    Run md2html.py once with import profiling.
+
+    Args:
+        arguments: Command-line arguments for md2html.py
+
+    Returns:
+        Tuple of (wall time in seconds, total import time in microseconds, per-module times)
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', SCRIPT] + arguments,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    total, modules = parse_importtime(result.stderr)
+    return elapsed, total, modules
+
+
+def main() -> None:
+    """Run every scenario and report startup time and heavy imports."""
+    parser = argparse.ArgumentParser(description="Benchmark md2html.py cold start.")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per scenario. Default is 5.")
+    parser.add_argument("--budget-ms", type=float, default=80.0,
+                        help="Maximum median import time in milliseconds. Default is 80.")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list. Default is 10.")
+    args = parser.parse_args()
+
+    failed = False
+    for name, arguments in SCENARIOS.items():
+        walls = []
+        imports = []
+        modules = {}
+        for _ in range(args.runs):
+            elapsed, total, modules = run_scenario(arguments)
+            walls.append(elapsed * 1000)
+            imports.append(total / 1000)
+
+        median_import = statistics.median(imports)
+        print(f"{name}: wall {statistics.median(walls):.1f} ms, imports {median_import:.1f} ms "
+              f"(median of {args.runs})")
+        for module, cumulative in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {cumulative / 1000:8.1f} ms  {module}")
+
+        heavy = [prefix for prefix in HEAVY_MODULES
+                 if any(module == prefix or module.startswith(prefix + '.') for module in modules)]
+        if heavy:
+            failed = True
+            print(f"  FAIL: heavy modules imported: {', '.join(heavy)}")
+        if median_import > args.budget_ms:
+            failed = True
+            print(f"  FAIL: import time {median_import:.1f} ms exceeds budget of {args.budget_ms:.1f} ms")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,72 @@
-
 import os
+import re
+import sys
+import glob
+import json
+import time
+import stat
+import hashlib
+import base64
+import codecs
 import argparse
-import markdown
-from typing import Optional
-from bs4 import BeautifulSoup
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import HtmlFormatter
+import textwrap
+import functools
+import contextlib
+import itertools
+import threading
+import xml.etree.ElementTree as etree
+from collections import OrderedDict, deque
+from html import unescape
+from html.parser import HTMLParser
+from typing import (TYPE_CHECKING, AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, List, NamedTuple,
+                    Optional, TextIO, Tuple, Union)
+
+# markdown, bs4/lxml, pygments and concurrent.futures are imported where they are
+# first needed, so --help, argument errors and missing inputs return without loading them
+if TYPE_CHECKING:
+    import markdown
+    from pygments.formatters import HtmlFormatter
+
+# md2html_markdown imports its helpers from this module. When this file runs as a script
+# (or as a spawned worker's main module), that import must find this copy instead of loading a second one
+sys.modules.setdefault('md2html', sys.modules[__name__])
+
+# Bump whenever a change alters generated HTML so incremental builds regenerate outputs
+__version__ = '1.1.0'
+
+MANIFEST_FILENAME = '.md2html-manifest.json'
+
+MARKDOWN_EXTENSIONS = ['fenced_code', 'tables', 'toc', 'footnotes', 'attr_list', 'md_in_html']
+
+# Pygments styles used for code blocks in light and dark mode
+PYGMENTS_LIGHT_STYLE = 'default'
+PYGMENTS_DARK_STYLE = 'monokai'
+
+# Number of highlighted snippets kept by highlight_code's LRU cache
+HIGHLIGHT_CACHE_SIZE = 4096
+
+# Distinct code blocks a document needs before --highlight_jobs hands them to a process pool
+PARALLEL_HIGHLIGHT_MIN_BLOCKS = 16
+
+# Size bound of the on-disk highlight cache kept in --cache_dir, and its file name
+HIGHLIGHT_DISK_CACHE_BYTES = 64 << 20
+HIGHLIGHT_DISK_CACHE_FILE = 'highlight-cache.sqlite3'
+# Cache hits a process collects in memory before writing their recency in one transaction
+HIGHLIGHT_DISK_CACHE_PENDING_KEYS = 4096
+
+# Rendering engines: 'soup' post-processes the markdown output with BeautifulSoup,
+# 'tree' does the same rewrites on the markdown library's own ElementTree in one pass
+ENGINES = ('soup', 'tree')
+
+# Built-in processing stages, each of which can be turned off with disabled_stages
+# (Converter) or --disable_stage; a disabled stage is skipped entirely:
+#   highlight        Pygments highlighting of code blocks, and the Pygments theme CSS
+#   copy_buttons     language label and copy button above code blocks, and copyCode()
+#   images           loading="lazy" and placeholder alt text on images
+#   heading_anchors  heading anchor links, added by the page script or at build time
+#   math             MathJax loading, by the page script or at build time
+#   theme_toggle     dark mode toggle button, toggleTheme() and initTheme()
+PIPELINE_STAGES = ('highlight', 'copy_buttons', 'images', 'heading_anchors', 'math', 'theme_toggle')
 
 
 def print_logo() -> None:
@@ -28,13 +88,623 @@ def print_logo() -> None:
     print("--------------------------------------------------")
 
 
-def convert_md_to_html(md_text: str, light_mode: bool = True) -> str:
+# Process-wide Pygments registry: language alias -> lexer (None if unknown), style -> formatter
+_lexer_cache = {}
+_formatter_cache = {}
+# Warm process pools for highlight_blocks, keyed by worker count
+_highlight_pools = {}
+# Persistent highlight cache installed by enable_highlight_cache, if any
+_highlight_disk_cache = None
+
+
+def pygments_style(light_mode: bool) -> str:
+    """Return the Pygments style used for code blocks in the given mode."""
+    return PYGMENTS_LIGHT_STYLE if light_mode else PYGMENTS_DARK_STYLE
+
+
+def get_lexer(language: str):
+    """
+    Get a cached Pygments lexer for a language alias.
+
+    Unknown aliases are remembered too, so a missing lexer only costs one
+    failed lookup per process.
+
+    Args:
+        language: Language alias such as 'python' or 'js'
+
+    Returns:
+        Lexer for the language, or the plain text lexer if it is unknown
+    """
+    try:
+        lexer = _lexer_cache[language]
+    except KeyError:
+        from pygments.lexers import get_lexer_by_name
+        try:
+            lexer = get_lexer_by_name(language, stripall=True)
+        except Exception:
+            lexer = None
+        _lexer_cache[language] = lexer
+    if lexer is None:
+        # Fallback to plain text if lexer not found
+        return get_lexer('text')
+    return lexer
+
+
+def get_formatter(style: str) -> 'HtmlFormatter':
+    """
+    Get a cached inline (nowrap) HtmlFormatter for a Pygments style.
+
+    Args:
+        style: Pygments style name
+
+    Returns:
+        Formatter producing highlighted spans without a surrounding <pre>
+    """
+    formatter = _formatter_cache.get(style)
+    if formatter is None:
+        from pygments.formatters import HtmlFormatter
+        formatter = _formatter_cache[style] = HtmlFormatter(style=style, nowrap=True)
+    return formatter
+
+
+@functools.lru_cache(maxsize=HIGHLIGHT_CACHE_SIZE)
+def highlight_code(code: str, language: str, style: str) -> str:
+    """
+    Highlight a code snippet, caching results for identical snippets.
+
+    Use highlight_code.cache_info() for hit/miss statistics and
+    highlight_code.cache_clear() to empty the cache.
+
+    Args:
+        code: Raw code text
+        language: Language alias; unknown languages are highlighted as plain text
+        style: Pygments style name
+
+    Returns:
+        Highlighted HTML spans (no surrounding <pre> or <code>)
+    """
+    from pygments import highlight
+    return highlight(code, get_lexer(language), get_formatter(style))
+
+
+class HighlightCache:
+    """
+    On-disk cache of highlighted code fragments, shared across runs and processes.
+
+    Fragments live in a SQLite database keyed by a hash of (code, language,
+    Pygments style, Pygments version). The cache is bounded to max_bytes of
+    fragments: when a write takes it over, the least recently used entries are
+    evicted down to 90% of the bound. The database runs in WAL mode and every
+    process opens its own connection, so concurrent batch workers can share
+    one file; within a process each thread gets its own connection. Cache
+    errors never fail a conversion; lookups simply miss.
+
+    Lookups only read the database, so workers whose blocks are all cached
+    never wait on each other for the write lock. The recency of the fragments
+    they found and the hit/miss counters are collected in memory and written
+    with the next put_many, by flush(), or when the process exits. stats()
+    reports the totals of every process that used the file.
+    """
+
+    def __init__(self, path: str, max_bytes: int = HIGHLIGHT_DISK_CACHE_BYTES) -> None:
+        """
+        Args:
+            path: Database file; its directory is created on first use
+            max_bytes: Upper bound for the total size of cached fragments
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        # Connections inherited across a fork; kept referenced so the child never closes them
+        self._inherited = []
+        self._version = None
+        # Lookups not yet written to the database: keys of the fragments found, and hit/miss counts
+        self._pending_lock = threading.Lock()
+        self._pending_pid = None
+        self._touched = set()
+        self._counts = {'hits': 0, 'misses': 0}
+
+    def _connect(self):
+        """Return this thread's connection, opening a new one after a fork."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            if self._local.pid == os.getpid():
+                return connection
+            self._inherited.append(connection)
+        import sqlite3
+        from pygments import __version__ as pygments_version
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS fragments '
+                           '(key TEXT PRIMARY KEY, html TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS fragments_last_used ON fragments (last_used)')
+        connection.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        self._version = pygments_version
+        return connection
+
+    def _key(self, code: str, language: str, style: str) -> str:
+        return hash_content('\0'.join([style, self._version, language, code]))
+
+    def _record_lookups(self, hit_keys: List[str], misses: int) -> bool:
+        """Remember lookups for the next write; returns True once enough are pending to flush."""
+        with self._pending_lock:
+            if self._pending_pid != os.getpid():
+                # First lookup in this process: lookups copied from a parent are the parent's to write
+                from multiprocessing import util
+                self._pending_pid = os.getpid()
+                self._touched = set()
+                self._counts = {'hits': 0, 'misses': 0}
+                # Runs at exit in pool workers too, where atexit handlers do not
+                util.Finalize(self, self.flush, exitpriority=0)
+            self._touched.update(hit_keys)
+            self._counts['hits'] += len(hit_keys)
+            self._counts['misses'] += misses
+            return len(self._touched) >= HIGHLIGHT_DISK_CACHE_PENDING_KEYS
+
+    def _write_pending(self, connection) -> None:
+        """Write the pending lookups inside the caller's write transaction."""
+        with self._pending_lock:
+            if self._pending_pid != os.getpid():
+                return
+            touched, counts = list(self._touched), self._counts
+            self._touched = set()
+            self._counts = {'hits': 0, 'misses': 0}
+        now = time.time()
+        for i in range(0, len(touched), 500):
+            batch = touched[i:i + 500]
+            connection.execute(f'UPDATE fragments SET last_used = ? WHERE key IN ({",".join("?" * len(batch))})',
+                               [now] + batch)
+        self._add_counters(connection, **counts)
+
+    def flush(self) -> None:
+        """Write the recency updates and counters of this process's lookups."""
+        import sqlite3
+        with self._pending_lock:
+            if self._pending_pid != os.getpid() or not (self._touched or any(self._counts.values())):
+                return
+        try:
+            connection = self._connect()
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                self._write_pending(connection)
+        except sqlite3.Error:
+            pass
+
+    def get_many(self, blocks: List[Tuple[str, str]], style: str) -> dict:
+        """
+        Look up highlighted fragments; the ones found are marked as recently used on the next write.
+
+        Args:
+            blocks: Distinct (code, language) pairs
+            style: Pygments style name
+
+        Returns:
+            Dictionary mapping each cached (code, language) pair to its highlighted HTML
+        """
+        import sqlite3
+        try:
+            connection = self._connect()
+            keys = {self._key(code, language, style): (code, language) for code, language in blocks}
+            found = {}
+            key_list = list(keys)
+            # Stay below SQLite's limit on bound parameters
+            for i in range(0, len(key_list), 500):
+                batch = key_list[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                for key, html in connection.execute(
+                        f'SELECT key, html FROM fragments WHERE key IN ({placeholders})', batch):
+                    found[keys[key]] = html
+        except sqlite3.Error:
+            return {}
+        hit_keys = [key for key, block in keys.items() if block in found]
+        if self._record_lookups(hit_keys, len(blocks) - len(found)):
+            self.flush()
+        return found
+
+    def put_many(self, fragments: Iterable[Tuple[Tuple[str, str], str]], style: str) -> None:
+        """
+        Store highlighted fragments, evicting the least recently used ones if over the size bound.
+
+        Args:
+            fragments: ((code, language), highlighted HTML) pairs
+            style: Pygments style name
+        """
+        import sqlite3
+        try:
+            connection = self._connect()
+            now = time.time()
+            rows = [(self._key(code, language, style), html, _utf8_size(html), now)
+                    for (code, language), html in fragments]
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.executemany('INSERT OR REPLACE INTO fragments VALUES (?, ?, ?, ?)', rows)
+                self._write_pending(connection)
+                self._evict(connection)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, connection) -> None:
+        """Delete least recently used fragments until the cache is back under 90% of max_bytes."""
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM fragments').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 9 // 10
+        evicted = []
+        for key, size in connection.execute('SELECT key, size FROM fragments ORDER BY last_used'):
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        connection.executemany('DELETE FROM fragments WHERE key = ?', evicted)
+        self._add_counters(connection, evictions=len(evicted))
+
+    @staticmethod
+    def _add_counters(connection, **counts: int) -> None:
+        for name, count in counts.items():
+            if count:
+                connection.execute('INSERT INTO counters VALUES (?, ?) '
+                                   'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value', (name, count))
+
+    def stats(self) -> dict:
+        """
+        Report cache totals.
+
+        Returns:
+            Dictionary with hits, misses and evictions (cumulative over every run
+            that used this file), plus the current number of entries and bytes
+        """
+        import sqlite3
+        self.flush()
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'entries': 0, 'bytes': 0}
+        try:
+            connection = self._connect()
+            stats.update(connection.execute('SELECT name, value FROM counters'))
+            stats['entries'], stats['bytes'] = connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM fragments').fetchone()
+        except sqlite3.Error:
+            pass
+        return stats
+
+    def close(self) -> None:
+        """Write pending lookups and close this thread's connection; call it before forking worker processes."""
+        self.flush()
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+
+
+def enable_highlight_cache(cache_dir: str, max_bytes: int = HIGHLIGHT_DISK_CACHE_BYTES) -> HighlightCache:
+    """
+    Keep highlighted code blocks in a persistent cache under cache_dir.
+
+    Args:
+        cache_dir: Directory for the cache database (see HIGHLIGHT_DISK_CACHE_FILE)
+        max_bytes: Upper bound for the total size of cached fragments
+
+    Returns:
+        The installed HighlightCache
+    """
+    global _highlight_disk_cache
+    _highlight_disk_cache = HighlightCache(os.path.join(cache_dir, HIGHLIGHT_DISK_CACHE_FILE), max_bytes)
+    return _highlight_disk_cache
+
+
+def disable_highlight_cache() -> Optional[HighlightCache]:
+    """Stop using the persistent highlight cache and return the one that was installed, if any."""
+    global _highlight_disk_cache
+    cache, _highlight_disk_cache = _highlight_disk_cache, None
+    if cache is not None:
+        cache.close()
+    return cache
+
+
+# Pipeline stages reported by --profile, in pipeline order
+PROFILE_STAGES = ('read', 'markdown', 'soup', 'highlight', 'theme_css', 'head', 'extract', 'join', 'minify',
+                  'write', 'precompress')
+
+
+class Profiler:
+    """
+    Per-stage instrumentation for the conversion pipeline.
+
+    Stages record wall time, call count and bytes in/out; code blocks are
+    counted per language. 'highlight' is nested inside 'markdown' (tree
+    engine) or 'soup' (soup engine), and 'theme_css' inside 'head'.
+
+    Install one with enable_profiling(); stages are instrumented with
+    _profile_stage, which costs a global lookup and a no-op context manager
+    while none is installed.
+    """
+
+    def __init__(self, callback=None) -> None:
+        """
+        Args:
+            callback: Optional callable invoked as callback(stage, seconds, bytes_in, bytes_out)
+                for every recorded stage, e.g. to forward timings to a metrics system
+        """
+        self.callback = callback
+        self.stages = {}
+        self.code_blocks = {}
+        # Files may be read on other threads (see read_markdown_files)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, bytes_in: int = 0, bytes_out: int = 0) -> None:
+        """Record one execution of a pipeline stage."""
+        with self._lock:
+            totals = self.stages.get(stage)
+            if totals is None:
+                totals = self.stages[stage] = {'calls': 0, 'seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0}
+            totals['calls'] += 1
+            totals['seconds'] += seconds
+            totals['bytes_in'] += bytes_in
+            totals['bytes_out'] += bytes_out
+        if self.callback is not None:
+            self.callback(stage, seconds, bytes_in, bytes_out)
+
+    def count_code_block(self, language: str) -> None:
+        """Count one highlighted code block."""
+        self.code_blocks[language] = self.code_blocks.get(language, 0) + 1
+
+    def report(self) -> dict:
+        """
+        Summarize everything recorded so far.
+
+        Returns:
+            JSON-serializable dictionary with 'stages' (in pipeline order) and 'code_blocks'
+        """
+        order = {stage: index for index, stage in enumerate(PROFILE_STAGES)}
+        stages = {stage: dict(totals) for stage, totals in
+                  sorted(self.stages.items(), key=lambda item: order.get(item[0], len(order)))}
+        return {'stages': stages, 'code_blocks': dict(sorted(self.code_blocks.items()))}
+
+    def format_table(self) -> str:
+        """Format the report as a plain-text table."""
+        lines = [f"{'stage':<12}{'calls':>8}{'total ms':>12}{'mean ms':>10}{'in KB':>10}{'out KB':>10}"]
+        lines.append('-' * len(lines[0]))
+        for stage, totals in self.report()['stages'].items():
+            lines.append(f"{stage:<12}{totals['calls']:>8}{totals['seconds'] * 1000:>12.2f}"
+                         f"{totals['seconds'] * 1000 / totals['calls']:>10.3f}"
+                         f"{totals['bytes_in'] / 1024:>10.1f}{totals['bytes_out'] / 1024:>10.1f}")
+        if self.code_blocks:
+            blocks = ', '.join(f"{language}: {count}" for language, count in sorted(self.code_blocks.items()))
+            lines.append(f"code blocks: {sum(self.code_blocks.values())} ({blocks})")
+        return '\n'.join(lines)
+
+
+# Installed by enable_profiling; None when profiling is off
+_profiler: Optional[Profiler] = None
+
+
+def enable_profiling(callback=None) -> Profiler:
+    """
+    Start collecting pipeline timings for this process.
+
+    Args:
+        callback: Optional per-stage callback, see Profiler
+
+    Returns:
+        The installed Profiler; read its report() when done
+    """
+    global _profiler
+    _profiler = Profiler(callback)
+    return _profiler
+
+
+def disable_profiling() -> Optional[Profiler]:
+    """Stop collecting pipeline timings and return the Profiler that was installed, if any."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def _utf8_size(text: str) -> int:
+    """Size of text in bytes once encoded, as reported by the profiler."""
+    return len(text.encode('utf-8'))
+
+
+def _byte_count(value: Union[int, str, Iterable]) -> int:
+    """Size in bytes of a measured value: a byte count, a text, or an iterable of either."""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        return _utf8_size(value)
+    return sum(_byte_count(item) for item in value)
+
+
+class _StageTiming:
+    """Context manager recording one execution of a pipeline stage (see _profile_stage)."""
+
+    __slots__ = ('profiler', 'stage', 'start', 'sizes', 'languages')
+
+    def __init__(self, profiler: Profiler, stage: str) -> None:
+        self.profiler = profiler
+        self.stage = stage
+        self.sizes = (0, 0)
+        self.languages = ()
+
+    def __enter__(self) -> '_StageTiming':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        seconds = time.perf_counter() - self.start
+        # Stages that fail are not recorded
+        if exc_type is not None:
+            return
+        self.profiler.record(self.stage, seconds, _byte_count(self.sizes[0]), _byte_count(self.sizes[1]))
+        for language in self.languages:
+            self.profiler.count_code_block(language)
+
+    def measure(self, bytes_in: Union[int, str, Iterable], bytes_out: Union[int, str, Iterable]) -> None:
+        """Set the stage's input and output size; texts are sized on exit, outside the timed block."""
+        self.sizes = (bytes_in, bytes_out)
+
+    def count_code_blocks(self, languages: Iterable[str]) -> None:
+        """Count the code blocks the stage highlighted, by language."""
+        self.languages = languages
+
+
+class _NoStageTiming:
+    """Stand-in for _StageTiming while profiling is off."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> '_NoStageTiming':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+    def measure(self, bytes_in, bytes_out) -> None:
+        pass
+
+    def count_code_blocks(self, languages) -> None:
+        pass
+
+
+_NO_STAGE_TIMING = _NoStageTiming()
+
+
+def _profile_stage(stage: str) -> Union[_StageTiming, _NoStageTiming]:
+    """
+    Time a block as one execution of a pipeline stage for the installed Profiler.
+
+    Use it as ``with _profile_stage('read') as timing:`` and call
+    timing.measure(bytes_in, bytes_out) in the block. While profiling is off,
+    a shared no-op is returned.
+
+    Args:
+        stage: Stage name, normally one of PROFILE_STAGES
+
+    Returns:
+        Context manager whose __enter__ returns the timing
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NO_STAGE_TIMING
+    return _StageTiming(profiler, stage)
+
+
+def _highlight_counted(code: str, language: str, light_mode: bool) -> str:
+    """Highlight one code block of a document, recording it when profiling is enabled."""
+    with _profile_stage('highlight') as timing:
+        highlighted_code = highlight_code(code, language, pygments_style(light_mode))
+        timing.measure(code, highlighted_code)
+        timing.count_code_blocks((language,))
+    return highlighted_code
+
+
+def _highlight_chunk(blocks: List[Tuple[str, str]], style: str) -> List[str]:
+    """Highlight (code, language) pairs in one worker process."""
+    return [highlight_code(code, language, style) for code, language in blocks]
+
+
+def _highlight_pool(jobs: int):
+    """Return the process pool for parallel highlighting, started on first use and kept warm."""
+    pool = _highlight_pools.get(jobs)
+    if pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        pool = _highlight_pools[jobs] = ProcessPoolExecutor(max_workers=jobs)
+    return pool
+
+
+def highlight_blocks(blocks: List[Tuple[str, str]], light_mode: bool = True, highlight_jobs: int = 1) -> List[str]:
+    """
+    Highlight all code blocks of a document.
+
+    Blocks found in the persistent highlight cache (see enable_highlight_cache)
+    are taken from it, and the rest are added to it. With highlight_jobs > 1
+    and at least PARALLEL_HIGHLIGHT_MIN_BLOCKS distinct blocks left to
+    highlight, identical blocks are highlighted once and the distinct ones are
+    split over a pool of worker processes. Results are always returned in
+    input order, and are identical to highlighting the blocks one by one.
+
+    Args:
+        blocks: (code, language) pairs in document order
+        light_mode: Use light theme for syntax highlighting (default: True)
+        highlight_jobs: Worker processes to highlight with; 1 highlights in this process
+
+    Returns:
+        Highlighted HTML spans for each block, in the order of blocks
+    """
+    cache = _highlight_disk_cache
+    if not blocks or (cache is None and highlight_jobs <= 1):
+        return [_highlight_counted(code, language, light_mode) for code, language in blocks]
+    unique_blocks = list(dict.fromkeys(blocks))
+    if cache is None and len(unique_blocks) < PARALLEL_HIGHLIGHT_MIN_BLOCKS:
+        return [_highlight_counted(code, language, light_mode) for code, language in blocks]
+
+    # One 'highlight' call per document: the blocks are timed together
+    with _profile_stage('highlight') as timing:
+        style = pygments_style(light_mode)
+        results = cache.get_many(unique_blocks, style) if cache is not None else {}
+        missing = [block for block in unique_blocks if block not in results]
+        if highlight_jobs > 1 and len(missing) >= PARALLEL_HIGHLIGHT_MIN_BLOCKS:
+            # A few contiguous chunks per worker balance the load without a round trip per block
+            chunk_size = -(-len(missing) // (highlight_jobs * 4))
+            chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+            highlighted = list(itertools.chain.from_iterable(
+                _highlight_pool(highlight_jobs).map(_highlight_chunk, chunks, itertools.repeat(style))))
+        else:
+            highlighted = _highlight_chunk(missing, style)
+        results.update(zip(missing, highlighted))
+        if cache is not None and missing:
+            cache.put_many(zip(missing, highlighted), style)
+        timing.measure((code for code, _ in blocks), (results[block] for block in blocks))
+        timing.count_code_blocks(language for _, language in blocks)
+    return [results[block] for block in blocks]
+
+
+class OutputOptions(NamedTuple):
+    """
+    Settings, beyond mode, CSS and engine, that change the pages the pipeline produces.
+
+    Converter builds one from its keyword arguments and passes it down the
+    pipeline; the tuple is immutable and hashable, so functions such as
+    page_script_lines can cache on it.
+
+    Attributes:
+        heading_anchors: Where heading anchor links are added (see HEADING_ANCHOR_MODES)
+        math_detection: Where pages decide to load MathJax (see MATH_DETECTION_MODES)
+        math_preload: With math_detection='build', add a preload hint for MathJax to pages with math
+        icons: How copy-button icons are written (see ICON_MODES)
+        minify: Minify the generated documents and assets (see minify_html)
+        precompress: Also write compressed siblings of output files (see precompress_file)
+        disabled_stages: Names of PIPELINE_STAGES or registered stages that are turned off
+            (see resolve_disabled_stages)
+    """
+    heading_anchors: str = 'client'
+    math_detection: str = 'client'
+    math_preload: bool = False
+    icons: str = 'inline'
+    minify: bool = False
+    precompress: bool = False
+    disabled_stages: frozenset = frozenset()
+
+    def enabled(self, stage: str) -> bool:
+        """Whether a stage of PIPELINE_STAGES or a registered stage runs."""
+        return stage not in self.disabled_stages
+
+
+def convert_md_to_html(md_text: str, light_mode: bool = True, engine: str = 'soup', highlight_jobs: int = 1,
+                       options: OutputOptions = OutputOptions()) -> str:
     """
     Convert Markdown text to HTML with syntax highlighting.
 
     Args:
         md_text: Markdown content to convert
         light_mode: Use light theme for syntax highlighting (default: True)
+        engine: 'soup' (default) re-parses the markdown output with BeautifulSoup;
+            'tree' rewrites the markdown ElementTree directly and returns only the
+            body fragment, which add_custom_style must then receive with engine='tree'
+        highlight_jobs: Worker processes for highlighting code blocks (default: 1, no pool)
+        options: Output options; of the stages, 'highlight', 'copy_buttons' and 'images'
+            apply here
 
     Returns:
         HTML string with syntax highlighting and copy buttons
@@ -43,11 +713,86 @@ def convert_md_to_html(md_text: str, light_mode: bool = True) -> str:
         The output HTML is not sanitized. Only convert trusted markdown content
         as malicious HTML/JavaScript in the input will be preserved in output.
     """
-    html = markdown.markdown(md_text,
-                             extensions=['fenced_code', 'tables', 'toc', 'footnotes', 'attr_list', 'md_in_html'])
+    md = create_markdown(light_mode=light_mode, engine=engine, highlight_jobs=highlight_jobs, options=options)
+    return render_markdown(md, md_text, light_mode=light_mode, engine=engine, highlight_jobs=highlight_jobs,
+                           options=options)
+
+
+def create_markdown(light_mode: bool = True, engine: str = 'soup', extension_configs: Optional[dict] = None,
+                    extensions: Optional[list] = None, highlight_jobs: int = 1,
+                    options: OutputOptions = OutputOptions()) -> 'markdown.Markdown':
+    """
+    Create a Markdown instance configured for a rendering engine.
+
+    Args:
+        light_mode: Use light theme for syntax highlighting (default: True)
+        engine: Rendering engine ('soup' or 'tree')
+        extension_configs: Optional per-extension settings passed to markdown
+        extensions: Optional extra extensions (names or Extension instances) loaded
+            after MARKDOWN_EXTENSIONS
+        highlight_jobs: Worker processes for highlighting code blocks ('tree' engine)
+        options: Output options whose stages the 'tree' engine applies
+
+    Returns:
+        Markdown instance; call reset() on it before converting another document
+    """
+    import markdown
+    from md2html_markdown import TreeRenderExtension
+    all_extensions = MARKDOWN_EXTENSIONS + list(extensions or [])
+    if engine == 'tree':
+        md = markdown.Markdown(extensions=all_extensions + [TreeRenderExtension(light_mode=light_mode,
+                                                                                  highlight_jobs=highlight_jobs,
+                                                                                  options=options)],
+                               extension_configs=extension_configs or {})
+        md.serializer = serialize_soup_compatible
+        return md
+    return markdown.Markdown(extensions=all_extensions, extension_configs=extension_configs or {})
+
+
+def render_markdown(md: 'markdown.Markdown', md_text: str, light_mode: bool = True, engine: str = 'soup',
+                    highlight_jobs: int = 1, options: OutputOptions = OutputOptions()) -> str:
+    """
+    Convert Markdown text with an instance from create_markdown.
+
+    Args:
+        md: Markdown instance created for the same light_mode and engine
+        md_text: Markdown content to convert
+        light_mode: Use light theme for syntax highlighting (default: True)
+        engine: Rendering engine ('soup' or 'tree')
+        highlight_jobs: Worker processes for highlighting code blocks ('soup' engine;
+            the 'tree' engine takes it from create_markdown)
+        options: Output options whose stages the 'soup' engine applies (the 'tree'
+            engine takes them from create_markdown)
+
+    Returns:
+        HTML string, as returned by convert_md_to_html
+    """
+    with _profile_stage('markdown') as timing:
+        html = md.convert(md_text)
+        timing.measure(md_text, html)
+    if engine == 'tree':
+        if html.startswith(_CODE_HEADER_START):
+            # The soup engine inserts each copy-button header after a newline, which stays
+            # when the document starts with a code block; markdown strips the output's edges
+            html = '\n' + html
+        return html
+    with _profile_stage('soup') as timing:
+        soup_html = _postprocess_with_soup(html, light_mode, highlight_jobs, options)
+        timing.measure(html, soup_html)
+    return soup_html
+
+
+def _postprocess_with_soup(html: str, light_mode: bool, highlight_jobs: int = 1,
+                           options: OutputOptions = OutputOptions()) -> str:
+    """Highlight code blocks, add copy buttons and rewrite images with BeautifulSoup (the 'soup' engine)."""
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'lxml')
+    highlight = options.enabled('highlight')
+    copy_buttons = options.enabled('copy_buttons')
 
-    for pre in soup.find_all('pre'):
+    # Collect every block first so they can be highlighted together
+    code_blocks = []
+    for pre in soup.find_all('pre') if highlight or copy_buttons else ():
         code = pre.find('code')
         if not code:
             continue
@@ -57,22 +802,22 @@ def convert_md_to_html(md_text: str, light_mode: bool = True) -> str:
         if isinstance(classes, str):
             classes = [classes]
 
+        # The first language-* class names the language; later ones are ignored
         language = 'text'
         for class_name in classes:
             if class_name.startswith('language-'):
                 language = class_name.replace('language-', '')
                 break
 
-        try:
-            lexer = get_lexer_by_name(language, stripall=True)
-        except Exception:
-            # Fallback to plain text if lexer not found
-            lexer = get_lexer_by_name('text', stripall=True)
-
-        formatter = HtmlFormatter(style='default' if light_mode else 'monokai', nowrap=True)
         # Use get_text() instead of .string to handle code blocks with children
-        highlighted_code = highlight(code.get_text(), lexer, formatter)
+        code_blocks.append((pre, code.get_text(), language))
 
+    if highlight:
+        highlighted_blocks = highlight_blocks([(code, language) for _, code, language in code_blocks],
+                                              light_mode, highlight_jobs)
+    else:
+        highlighted_blocks = [_escape_text(code) for _, code, _ in code_blocks]
+    for (pre, _, language), highlighted_code in zip(code_blocks, highlighted_blocks):
         new_pre = soup.new_tag('pre')
         new_pre['class'] = ['highlight']
         new_code = soup.new_tag('code')
@@ -87,6 +832,9 @@ def convert_md_to_html(md_text: str, light_mode: bool = True) -> str:
         for child in contents:
             new_code.append(child)
         new_pre.append(new_code)
+        pre.replace_with(new_pre)
+        if not copy_buttons:
+            continue
 
         copy_button_html = f'''
         <div class="code-header">
@@ -100,11 +848,10 @@ def convert_md_to_html(md_text: str, light_mode: bool = True) -> str:
         </div>
         '''
 
-        pre.replace_with(new_pre)
         new_pre.insert_before(BeautifulSoup(copy_button_html, 'html.parser'))
 
     # Add lazy loading to images for performance
-    for img in soup.find_all('img'):
+    for img in soup.find_all('img') if options.enabled('images') else ():
         img['loading'] = 'lazy'
         # Add alt text if missing for accessibility
         if not img.get('alt'):
@@ -113,6 +860,480 @@ def convert_md_to_html(md_text: str, light_mode: bool = True) -> str:
     return str(soup)
 
 
+# Void elements are written as <br/> to match BeautifulSoup's serialization
+_VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'param', 'source', 'track', 'wbr',
+])
+# Tags whose whitespace BeautifulSoup keeps verbatim, and whose text it never escapes
+_PRESERVE_WHITESPACE_TAGS = frozenset(['pre', 'textarea'])
+_RAW_TEXT_TAGS = frozenset(['script', 'style'])
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+# Fenced code blocks as stashed by the fenced_code extension
+_STASHED_CODE_BLOCK_RE = re.compile(r'<pre(?: [^>]*)?><code((?: [^>]*)?)>([^<]*)</code></pre>')
+_CLASS_ATTRIBUTE_RE = re.compile(r'\bclass="([^"]*)"')
+_NUMERIC_CHARREF_RE = re.compile(r'&#(?:[xX][0-9a-fA-F]+|[0-9]+);')
+# Ampersands that do not start an entity, as in markdown.serializers.RE_AMP
+_AMP_RE = re.compile(r'&(?!(?:\#[0-9]+|\#x[0-9a-f]+|[0-9a-z]+);)', re.I)
+_BLOCK_TAG_RE = re.compile(r'<([^ >/]+)')
+# Marks where a code block found in raw HTML goes once it is highlighted, by its number in the snippet
+_CODE_BLOCK_PLACEHOLDER = '\x02md2html-code-block:%d\x03'
+# Whitespace-only text at the edges of a block of raw HTML, next to a tag or a code block placeholder
+_EDGE_WHITESPACE_RE = re.compile(r'^[\x20\x0a\x09\x0c\x0d]+(?=[<\x02])|(?<=[>\x03])[\x20\x0a\x09\x0c\x0d]+$')
+
+# Copy button and highlighted block exactly as the soup engine serializes them
+_CODE_BLOCK_TEMPLATE = (
+    '<div class="code-header">\n'
+    '<span class="language-label">{language}</span>\n'
+    '<button class="copy-button" onclick="copyCode(this)">\n'
+    '<svg aria-hidden="true" class="octicon octicon-copy js-clipboard-copy-icon" data-view-component="true" '
+    'height="16" version="1.1" viewbox="0 0 16 16" width="16">\n'
+    '<path d="M0 6.75C0 5.784.784 5 1.75 5h1.5a.75.75 0 0 1 0 1.5h-1.5a.25.25 0 0 0-.25.25v7.5c0 .138.112.25.25.25h7.5a.25.25 0 0 0 .25-.25v-1.5a.75.75 0 0 1 1.5 0v1.5A1.75 1.75 0 0 1 9.25 16h-7.5A1.75 1.75 0 0 1 0 14.25Z"></path>\n'
+    '<path d="M5 1.75C5 .784 5.784 0 6.75 0h7.5C15.216 0 16 .784 16 1.75v7.5A1.75 1.75 0 0 1 14.25 11h-7.5A1.75 1.75 0 0 1 5 9.25Zm1.75-.25a.25.25 0 0 0-.25.25v7.5c0 .138.112.25.25.25h7.5a.25.25 0 0 0 .25-.25v-7.5a.25.25 0 0 0-.25-.25Z"></path>\n'
+    '</svg>\n'
+    '</button>\n'
+    '</div>\n'
+    '<pre class="highlight"><code class="language-{language}">{code}</code></pre>'
+)
+_CODE_HEADER_START = _CODE_BLOCK_TEMPLATE[:_CODE_BLOCK_TEMPLATE.index('\n')]
+# The same block without the copy-button header (copy_buttons stage disabled)
+_BARE_CODE_BLOCK_TEMPLATE = _CODE_BLOCK_TEMPLATE[_CODE_BLOCK_TEMPLATE.index('<pre '):]
+
+
+def _escape_text(text: str) -> str:
+    """Escape character data the way BeautifulSoup's minimal formatter does."""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _format_attribute(name: str, value: Optional[str]) -> str:
+    """Format one attribute the way BeautifulSoup does, including its quote selection."""
+    value = _escape_text(value or '')
+    if '"' in value:
+        if "'" in value:
+            return f' {name}="{value.replace(chr(34), "&quot;")}"'
+        return f" {name}='{value}'"
+    return f' {name}="{value}"'
+
+
+def _collapse_whitespace(text: str) -> str:
+    """Replace whitespace-only text with a single newline or space, as BeautifulSoup does outside <pre>."""
+    if text.strip(_ASCII_SPACES):
+        return text
+    return '\n' if '\n' in text else ' '
+
+
+def serialize_soup_compatible(element: etree.Element) -> str:
+    """
+    Serialize a markdown ElementTree the way the soup engine's output reads.
+
+    Used as the markdown serializer by the tree engine so that it produces the
+    same bytes as parsing the markdown output with BeautifulSoup/lxml and
+    writing it back out: attributes sorted, entities decoded, void elements
+    self-closed and whitespace-only text collapsed outside <pre>.
+
+    Args:
+        element: Root element to serialize
+
+    Returns:
+        HTML string
+    """
+    parts = []
+    _serialize_element(parts.append, element, False)
+    return ''.join(parts)
+
+
+def _serialize_text(text: str, preserve_whitespace: bool) -> str:
+    """Serialize text or tail content; markdown trees may hold already-escaped entities."""
+    if '&' in text:
+        # Decode entities as an HTML parser would, then re-escape
+        text = unescape(_AMP_RE.sub('&amp;', text))
+    if not preserve_whitespace:
+        text = _collapse_whitespace(text)
+    return _escape_text(text)
+
+
+def _serialize_element(write, element: etree.Element, preserve_whitespace: bool) -> None:
+    """Recursively write one element, its children and its tail."""
+    tag = element.tag
+    if tag is etree.Comment:
+        write(f'<!--{element.text}-->')
+    elif tag is None:
+        if element.text:
+            write(_serialize_text(element.text, preserve_whitespace))
+        for child in element:
+            _serialize_element(write, child, preserve_whitespace)
+    else:
+        tag = tag.lower()
+        write('<' + tag)
+        for name, value in sorted(element.items()):
+            if '&' in value:
+                value = unescape(_AMP_RE.sub('&amp;', value))
+            write(_format_attribute(name, value))
+        if tag in _VOID_ELEMENTS:
+            write('/>')
+        else:
+            write('>')
+            child_preserve = preserve_whitespace or tag in _PRESERVE_WHITESPACE_TAGS
+            if element.text:
+                if tag in _RAW_TEXT_TAGS:
+                    write(element.text)
+                else:
+                    write(_serialize_text(element.text, child_preserve))
+            for child in element:
+                _serialize_element(write, child, child_preserve)
+            write(f'</{tag}>')
+    if element.tail:
+        write(_serialize_text(element.tail, preserve_whitespace))
+
+
+class _RawHtmlNormalizer(HTMLParser):
+    """
+    Rewrite raw HTML snippets from the markdown stash into soup-engine form.
+
+    Applies the same serialization rules as serialize_soup_compatible, plus
+    the lazy-loading/alt rewrite for <img> tags unless rewrite_images is False.
+    With rewrite_code_blocks, every <pre> holding a <code> element is replaced
+    by a _CODE_BLOCK_PLACEHOLDER, and its code and language are collected in
+    code_blocks for the caller to highlight, as the soup engine does.
+    """
+
+    def __init__(self, rewrite_images: bool = True, rewrite_code_blocks: bool = False,
+                 copy_buttons: bool = True) -> None:
+        super().__init__(convert_charrefs=True)
+        self.rewrite_images = rewrite_images
+        self.rewrite_code_blocks = rewrite_code_blocks
+        self.copy_buttons = copy_buttons
+        self.parts = []
+        self.open_tags = []
+        # (code, language) of the code blocks found by the last normalize()
+        self.code_blocks = []
+        self._reset_code_block()
+
+    def _reset_code_block(self) -> None:
+        # Index in parts where the <pre> being read started, and how many <pre>s are open
+        self.pre_start = None
+        self.pre_depth = 0
+        # Language of the first <code> in the <pre> (None until one is found), its open
+        # <code> elements and its text
+        self.code_language = None
+        self.code_depth = 0
+        self.code_text = []
+
+    def normalize(self, raw_html: str) -> str:
+        """Return the normalized form of a raw HTML snippet."""
+        self.parts = []
+        self.code_blocks = []
+        self.feed(raw_html)
+        self.close()
+        if self.pre_start is not None:
+            # An unclosed <pre> ends with the snippet, as the HTML parser would close it
+            self._end_code_block()
+        self.reset()
+        return ''.join(self.parts)
+
+    def _end_code_block(self) -> None:
+        """Replace the <pre> just read with a placeholder if it holds a <code> element."""
+        start, code, language = self.pre_start, ''.join(self.code_text), self.code_language
+        self._reset_code_block()
+        if language is None:
+            # Like the soup engine, leave a <pre> without <code> as it is
+            return
+        del self.parts[start:]
+        if self.copy_buttons:
+            # The soup engine inserts the header after a newline that joins the text before
+            # the block; whitespace-only text then collapses to that newline
+            text_start = start
+            while text_start and not self.parts[text_start - 1].endswith('>'):
+                text_start -= 1
+            text = ''.join(self.parts[text_start:]) + '\n'
+            self.parts[text_start:] = [text if text.strip(_ASCII_SPACES) else '\n']
+        self.parts.append(_CODE_BLOCK_PLACEHOLDER % len(self.code_blocks))
+        self.code_blocks.append((code, language))
+
+    def handle_starttag(self, tag, attrs):
+        attributes = {}
+        for name, value in attrs:
+            attributes.setdefault(name, value)
+        if tag == 'pre' and self.rewrite_code_blocks:
+            if self.pre_start is None:
+                self.pre_start = len(self.parts)
+            self.pre_depth += 1
+        elif tag == 'code' and self.pre_start is not None:
+            if self.code_language is None:
+                self.code_language = _language_from_classes(attributes.get('class'))
+                self.code_depth = 1
+            elif self.code_depth:
+                self.code_depth += 1
+        if tag == 'img' and self.rewrite_images:
+            _rewrite_image_attributes(attributes)
+        self.parts.append('<' + tag)
+        for name, value in sorted(attributes.items()):
+            self.parts.append(_format_attribute(name, value))
+        if tag in _VOID_ELEMENTS:
+            self.parts.append('/>')
+        else:
+            self.parts.append('>')
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_ELEMENTS:
+            return
+        if tag in self.open_tags:
+            del self.open_tags[len(self.open_tags) - 1 - self.open_tags[::-1].index(tag):]
+        self.parts.append(f'</{tag}>')
+        if self.pre_start is None:
+            return
+        if tag == 'code' and self.code_depth:
+            self.code_depth -= 1
+        elif tag == 'pre':
+            self.pre_depth -= 1
+            if not self.pre_depth:
+                self._end_code_block()
+
+    def handle_data(self, data):
+        if self.code_depth:
+            self.code_text.append(data)
+        current_tag = self.open_tags[-1] if self.open_tags else None
+        if current_tag in _RAW_TEXT_TAGS:
+            self.parts.append(data)
+        elif any(tag in _PRESERVE_WHITESPACE_TAGS for tag in self.open_tags):
+            self.parts.append(_escape_text(data))
+        else:
+            self.parts.append(_escape_text(_collapse_whitespace(data)))
+
+    def handle_comment(self, data):
+        self.parts.append(f'<!--{data}-->')
+
+    def handle_decl(self, decl):
+        self.parts.append(f'<!{decl}>')
+
+    def handle_pi(self, data):
+        self.parts.append(f'<?{data}>')
+
+    def unknown_decl(self, data):
+        self.parts.append(f'<![{data}]>')
+
+
+def _rewrite_image_attributes(attributes: dict) -> None:
+    """Add lazy loading to an image, and placeholder alt text if it has none."""
+    attributes['loading'] = 'lazy'
+    if not attributes.get('alt'):
+        attributes['alt'] = 'Image'
+
+
+def _code_block_html(highlighted_code: str, language: str, copy_button: bool = True) -> str:
+    """
+    Render a highlighted code block with its copy-button header for the tree engine.
+
+    Args:
+        highlighted_code: Highlighted spans from highlight_code, or escaped code text
+        language: Language name taken from the block's language-* class
+        copy_button: Include the header with the language label and copy button
+
+    Returns:
+        HTML for the header and highlighted <pre> block
+    """
+    # Pygments escapes quotes as entities; the soup engine writes them back out as plain characters
+    highlighted_code = highlighted_code.replace('&quot;', '"').replace('&#39;', "'")
+    template = _CODE_BLOCK_TEMPLATE if copy_button else _BARE_CODE_BLOCK_TEMPLATE
+    return template.format(language=_escape_text(language), code=highlighted_code)
+
+
+def _language_from_classes(class_value: Optional[str]) -> str:
+    """Return the language named by the first language-* class, or 'text', as the soup engine does."""
+    for class_name in (class_value or '').split():
+        if class_name.startswith('language-'):
+            return class_name.replace('language-', '')
+    return 'text'
+
+
+# Characters of Markdown rendered per chunk by the streaming converter
+STREAM_CHUNK_SIZE = 1 << 20
+
+_FENCE_RE = re.compile(r'^[ ]{0,3}(`{3,}|~{3,})')
+_ATX_HEADING_RE = re.compile(r'^#{1,6}(?:[ \t]|$)')
+
+
+def _update_fence(line: str, fence: Optional[str]) -> Optional[str]:
+    """
+    Track fenced code blocks line by line.
+
+    Args:
+        line: Next Markdown line
+        fence: Opening fence of the block the previous line was in, or None
+
+    Returns:
+        Opening fence of the block this line leaves us in, or None outside fences
+    """
+    if fence is None:
+        match = _FENCE_RE.match(line)
+        return match.group(1) if match else None
+    stripped = line.strip()
+    if stripped.startswith(fence) and not stripped.strip(fence[0]):
+        return None
+    return fence
+
+
+def iter_markdown_chunks(lines: Iterable[str], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Split Markdown into independently renderable chunks at top-level block boundaries.
+
+    A new chunk starts at an ATX heading outside fenced code once the current
+    chunk holds at least chunk_size characters. Documents without headings
+    fall back to splitting before an unindented paragraph once the chunk holds
+    four times that.
+
+    Args:
+        lines: Markdown lines, e.g. an open text file
+        chunk_size: Target number of characters per chunk
+
+    Returns:
+        Iterator over chunk strings
+    """
+    chunk = []
+    size = 0
+    fence = None
+    previous_blank = False
+    for line in lines:
+        if fence is None and size >= chunk_size and (
+                _ATX_HEADING_RE.match(line)
+                or (previous_blank and size >= 4 * chunk_size and line[:1].isalpha())):
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+        fence = _update_fence(line, fence)
+        chunk.append(line)
+        size += len(line)
+        previous_blank = not line.strip()
+    if chunk:
+        yield ''.join(chunk)
+
+
+def scan_markdown_file(md_path: str, encoding: str = 'utf-8') -> Tuple[str, dict]:
+    """
+    Read a Markdown file once, line by line, without keeping it in memory.
+
+    Args:
+        md_path: Path to Markdown file
+        encoding: Codec of the file (see stream_encoding)
+
+    Returns:
+        Tuple of (content hash as computed by hash_content, reference-style
+        link definitions in markdown's references format)
+    """
+    from markdown.blockprocessors import ReferenceProcessor
+
+    digest = hashlib.sha256()
+    references = {}
+    fence = None
+    with open(md_path, 'r', encoding=encoding) as md_file:
+        for line in md_file:
+            digest.update(line.encode('utf-8'))
+            fence = _update_fence(line, fence)
+            if fence is None and '[' in line:
+                match = ReferenceProcessor.RE.match(line)
+                if match and not match.group(1).startswith('^'):
+                    # Same normalization as markdown's ReferenceProcessor
+                    references[match.group(1).strip().lower()] = (
+                        match.group(2).lstrip('<').rstrip('>'), match.group(5) or match.group(6))
+    return digest.hexdigest(), references
+
+
+def convert_stream(md_lines: Iterable[str], out_file: TextIO, css_content: Optional[str] = None,
+                   light_mode: bool = True, engine: str = 'tree', asset_refs: Optional[dict] = None,
+                   references: Optional[dict] = None, chunk_size: int = STREAM_CHUNK_SIZE,
+                   highlight_jobs: int = 1, options: OutputOptions = OutputOptions()) -> None:
+    """
+    Convert Markdown to a complete HTML5 document chunk by chunk.
+
+    Only one chunk of input and output is held in memory at a time: the
+    document head, each rendered chunk and the document tail are written
+    straight to out_file. A document that fits in one chunk comes out exactly
+    as add_custom_style(convert_md_to_html(...)) would produce it.
+
+    Limitations for multi-chunk documents: a [TOC] marker lists only the
+    headings of its own chunk, footnotes are rendered at the end of the chunk
+    that defines them (with chunk-unique IDs), and reference-style links only
+    resolve across chunks when their definitions are passed in references
+    (see scan_markdown_file).
+
+    Args:
+        md_lines: Markdown lines, e.g. an open text file
+        out_file: Text file to write the HTML document to
+        css_content: Optional CSS string to include in style tag
+        light_mode: Use light theme for syntax highlighting (default: True)
+        engine: Rendering engine ('soup' or 'tree'); 'tree' avoids re-parsing every chunk
+        asset_refs: Optional shared asset references from get_asset_refs
+        references: Optional reference-style link definitions for the whole document
+        chunk_size: Target number of Markdown characters per chunk
+        highlight_jobs: Worker processes for highlighting each chunk's code blocks
+        options: Output options, applied per chunk: build-time heading IDs are unique
+            across chunks; when build-time math detection first finds math after the
+            first chunk, the MathJax loader is written into the body there; the icon
+            sprite goes before the first code block; minify works on the head, each
+            chunk and the tail, without moving repeated SVGs into a sprite, as that
+            needs the whole document; registered stages run on each chunk's body
+    """
+    # Pieces are minified separately; the newlines between them are kept
+    finish = functools.partial(minify_html, dedupe_svgs=False) if options.minify else str
+    chunks = iter_markdown_chunks(md_lines, chunk_size)
+    first_chunk = next(chunks, '')
+    second_chunk = next(chunks, None)
+    extension_configs = None
+    if second_chunk is not None:
+        # Footnote IDs get a per-chunk prefix so chunks cannot collide
+        extension_configs = {'footnotes': {'UNIQUE_IDS': True}}
+        chunks = itertools.chain([first_chunk, second_chunk], chunks)
+    else:
+        chunks = iter([first_chunk])
+
+    md = create_markdown(light_mode=light_mode, engine=engine, extension_configs=extension_configs,
+                         highlight_jobs=highlight_jobs, options=options)
+    from md2html_markdown import UniqueHeadingIdTreeprocessor
+    # After toc (5) has assigned the IDs
+    md.treeprocessors.register(UniqueHeadingIdTreeprocessor(md, set()), 'md2html_unique_ids', 4)
+
+    # Disabled stages do no build-time work either; the head leaves out their client-side parts
+    build_anchors = options.heading_anchors == 'build' and options.enabled('heading_anchors')
+    detect_math = options.math_detection == 'build' and options.enabled('math')
+    sprite = options.icons == 'sprite' and options.enabled('copy_buttons')
+    stages = custom_stage_functions(options.disabled_stages)
+    used_ids = {}
+    head_written = False
+    math_found = False
+    sprite_written = False
+    for chunk in chunks:
+        md.reset()
+        if references:
+            md.references.update(references)
+        body = extract_body_content(render_markdown(md, chunk, light_mode, engine, highlight_jobs, options), engine)
+        if build_anchors:
+            body = add_heading_anchors(body, used_ids)
+        if sprite:
+            body = use_icon_sprite(body, include_sprite=not sprite_written)
+            sprite_written = sprite_written or _COPY_ICON_USE in body
+        for stage in stages:
+            body = stage(body)
+        if not head_written:
+            # The first chunk is rendered before the head is written, so its math can be detected
+            math = math_found = contains_math(body) if detect_math else None
+            head = build_document_head(css_content, asset_refs, options, math)
+            out_file.write(finish(head))
+            head_written = True
+        elif detect_math and not math_found and contains_math(body):
+            # Too late for the head; the async loader works from the body just as well
+            math_found = True
+            out_file.write('\n' + MATHJAX_SCRIPT_TAG)
+        out_file.write('\n')
+        out_file.write(finish(body))
+    out_file.write('\n')
+    out_file.write(finish(DOCUMENT_TAIL))
+
+
 def load_css_file(css_path: str) -> str:
     """
     Load CSS content from a file.
@@ -132,59 +1353,380 @@ def load_css_file(css_path: str) -> str:
     return ""
 
 
-def load_markdown_file(md_path: str) -> Optional[str]:
+# --input_file/--output_file value that stands for standard input/output
+STDIO_PATH = '-'
+
+
+# Default input encoding: a byte order mark if there is one, else UTF-8, else LEGACY_INPUT_ENCODING
+INPUT_ENCODING_AUTO = 'auto'
+LEGACY_INPUT_ENCODING = 'cp1252'
+# Byte order marks and the codecs that decode (and drop) them, longest first
+_BOM_ENCODINGS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'), (codecs.BOM_UTF8, 'utf-8-sig'),
+                  (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+# Files at least this large are decoded straight from a memory map instead of being read into a copy
+MMAP_MIN_BYTES = 1 << 20
+# Files read ahead of the caller by read_markdown_files, and the threads reading them
+BULK_READ_PREFETCH = 16
+BULK_READ_THREADS = 4
+
+
+def sniff_encoding(head: bytes) -> Optional[str]:
+    """
+    Recognize a byte order mark.
+
+    Args:
+        head: First four (or more) bytes of the input
+
+    Returns:
+        Codec that decodes the input and drops the mark, or None without a mark
+    """
+    for bom, encoding in _BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+    return None
+
+
+def decode_markdown(data, encoding: str = INPUT_ENCODING_AUTO) -> str:
+    """
+    Decode Markdown input, normalizing line endings to \\n as text-mode reads do.
+
+    Args:
+        data: Raw input as bytes or any buffer, such as a memoryview or an mmap
+        encoding: Codec name, or INPUT_ENCODING_AUTO to sniff a byte order mark and
+            fall back from UTF-8 to LEGACY_INPUT_ENCODING
+
+    Returns:
+        Markdown content as string
+
+    Raises:
+        UnicodeDecodeError: If the input cannot be decoded (for auto, the UTF-8 error)
+        LookupError: If the encoding is unknown
+    """
+    if encoding == INPUT_ENCODING_AUTO:
+        encoding = sniff_encoding(bytes(data[:4]))
+    if encoding is not None:
+        md_text = str(data, encoding)
+    else:
+        try:
+            md_text = str(data, 'utf-8')
+        except UnicodeDecodeError as e:
+            try:
+                md_text = str(data, LEGACY_INPUT_ENCODING)
+            except UnicodeDecodeError:
+                raise e from None
+    if '\r' in md_text:
+        md_text = md_text.replace('\r\n', '\n').replace('\r', '\n')
+    return md_text
+
+
+def stream_encoding(md_path: str, encoding: str = INPUT_ENCODING_AUTO) -> str:
+    """
+    Pick the codec for reading a Markdown file line by line.
+
+    Args:
+        md_path: Path to Markdown file
+        encoding: Input encoding (see decode_markdown); auto becomes the codec of a
+            byte order mark, or UTF-8 without falling back, which would need the whole file
+
+    Returns:
+        Codec name for open()
+    """
+    if encoding != INPUT_ENCODING_AUTO:
+        return encoding
+    with open(md_path, 'rb') as md_file:
+        return sniff_encoding(md_file.read(4)) or 'utf-8'
+
+
+def load_markdown_file(md_path: str, encoding: str = INPUT_ENCODING_AUTO) -> Optional[str]:
     """
     Load Markdown content from a file.
 
     Args:
         md_path: Path to Markdown file
+        encoding: Input encoding (see decode_markdown)
 
     Returns:
         Markdown content as string, or None if file cannot be read
     """
     try:
-        with open(md_path, 'r', encoding='utf-8') as md_file:
-            return md_file.read()
+        return read_markdown_file(md_path, encoding)
     except FileNotFoundError:
         print(f"Error: File '{md_path}' not found.")
         return None
     except Exception as e:
-        print(f"Error: Could not read file '{md_path}': {e}")
+        source = 'standard input' if md_path == STDIO_PATH else f"file '{md_path}'"
+        print(f"Error: Could not read {source}: {e}")
         return None
 
 
-def add_custom_style(html_content: str, css_content: Optional[str] = None, light_mode: bool = True) -> str:
+def read_markdown_file(md_path: str, encoding: str = INPUT_ENCODING_AUTO) -> str:
     """
-    Create a complete, well-formed HTML5 document from converted markdown.
+    Read a Markdown file, raising on errors (see load_markdown_file for the printing variant).
+
+    Files of MMAP_MIN_BYTES or more are decoded straight from a memory map,
+    so the only copy made is the decoded text.
 
     Args:
-        html_content: HTML body content from converted markdown
-        css_content: Optional CSS string to include in style tag
+        md_path: Path to Markdown file, or STDIO_PATH to read standard input
+        encoding: Input encoding (see decode_markdown)
 
     Returns:
-        Complete HTML5 document with:
-        - Proper DOCTYPE and structure (html, head, body)
-        - Meta tags for charset and viewport
-        - Embedded CSS styling
-        - Copy button functionality for code blocks
-        - MathJax for mathematical notation
+        Markdown content as string
+
+    Raises:
+        OSError: If the file cannot be read
+        UnicodeDecodeError: If the file cannot be decoded
+        LookupError: If the encoding is unknown
+    """
+    with _profile_stage('read') as timing:
+        if md_path == STDIO_PATH:
+            data = sys.stdin.buffer.read()
+            size = len(data)
+            md_text = decode_markdown(data, encoding)
+        else:
+            with open(md_path, 'rb', buffering=0) as md_file:
+                size = os.fstat(md_file.fileno()).st_size
+                if size >= MMAP_MIN_BYTES:
+                    import mmap
+                    with mmap.mmap(md_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        md_text = decode_markdown(data, encoding)
+                else:
+                    md_text = decode_markdown(md_file.readall(), encoding)
+        timing.measure(size, md_text)
+    return md_text
+
+
+def _read_markdown_or_error(md_path: str, encoding: str) -> Union[str, Exception]:
+    """Read a Markdown file for read_markdown_files, returning the error instead of raising it."""
+    try:
+        return read_markdown_file(md_path, encoding)
+    except Exception as e:
+        return e
+
+
+def read_markdown_files(md_paths: Iterable[str], encoding: str = INPUT_ENCODING_AUTO,
+                        prefetch: int = BULK_READ_PREFETCH) -> Iterator[Tuple[str, Union[str, Exception]]]:
+    """
+    Read many Markdown files, keeping up to `prefetch` reads running ahead of the caller.
+
+    The files are read by a few threads, which wait on the disk without holding the
+    GIL, so for batches of small files the reads overlap with the caller's work.
+
+    Args:
+        md_paths: Paths of Markdown files
+        encoding: Input encoding (see decode_markdown)
+        prefetch: Most files read ahead of the one being consumed
+
+    Returns:
+        Iterator of (path, Markdown text or the exception that reading it raised), in input order
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=BULK_READ_THREADS) as pool:
+        pending = deque()
+        try:
+            for md_path in md_paths:
+                pending.append((md_path, pool.submit(_read_markdown_or_error, md_path, encoding)))
+                if len(pending) > prefetch:
+                    md_path, future = pending.popleft()
+                    yield md_path, future.result()
+            while pending:
+                md_path, future = pending.popleft()
+                yield md_path, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+# Buffer size of output files; also the block size for comparing them with existing files
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def _prepare_output_file(output_path: str) -> str:
+    """
+    Create the parent directories of an output file and name the temporary file it is
+    written to before it is renamed into place.
+    """
+    output_parent = os.path.dirname(output_path)
+    if output_parent:
+        os.makedirs(output_parent, exist_ok=True)
+    return f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _output_has_content(output_path: str, size: int, blocks: Iterable[bytes]) -> bool:
+    """
+    Check whether an output file exists and holds exactly the given content.
+
+    Args:
+        output_path: Path of the existing output, if any
+        size: Length of the content, compared with the file's size first
+        blocks: The content in WRITE_BUFFER_SIZE blocks, compared only while they match
+
+    Returns:
+        True if the file holds the content; False if it differs or cannot be read
+    """
+    try:
+        with open(output_path, 'rb') as existing:
+            if os.fstat(existing.fileno()).st_size != size:
+                return False
+            return all(block == existing.read(WRITE_BUFFER_SIZE) for block in blocks)
+    except OSError:
+        return False
+
+
+def commit_output_file(temp_path: str, output_path: str) -> bool:
+    """
+    Move a finished temporary file into place, unless the output already has its content.
+
+    Args:
+        temp_path: Completely written temporary file (see write_html_file)
+        output_path: Final path; replaced atomically, so readers see the old or the new file
+
+    Returns:
+        True if the output was replaced, False if it was unchanged (its mtime is kept
+        and the temporary file is removed)
+
+    Raises:
+        OSError: If the file cannot be renamed
+    """
+    with open(temp_path, 'rb') as new:
+        unchanged = _output_has_content(output_path, os.fstat(new.fileno()).st_size,
+                                        iter(functools.partial(new.read, WRITE_BUFFER_SIZE), b''))
+    if unchanged:
+        os.unlink(temp_path)
+        return False
+    os.replace(temp_path, output_path)
+    return True
+
+
+def write_html_file(output_path: str, html: str, precompress: bool = False) -> bool:
+    """
+    Write a generated document atomically, creating parent directories as needed.
+
+    The document is written to a temporary file next to the output and renamed
+    over it, so an interrupted run never leaves a truncated file behind. An
+    output that already holds exactly these bytes is not touched at all, which
+    keeps its mtime (and downstream rsync and CDN caches) intact.
+
+    Args:
+        output_path: Path of the output file
+        html: Document to write
+        precompress: Also write compressed siblings (see precompress_file) when the
+            document changed or they are missing
+
+    Returns:
+        True if the file was written, False if it was already up to date
+
+    Raises:
+        OSError: If the file cannot be written
+    """
+    with _profile_stage('write') as timing:
+        temp_path = _prepare_output_file(output_path)
+        data = html.encode('utf-8')
+        view = memoryview(data)
+        blocks = (view[start:start + WRITE_BUFFER_SIZE] for start in range(0, len(data), WRITE_BUFFER_SIZE))
+        written = not _output_has_content(output_path, len(data), blocks)
+        if written:
+            try:
+                with open(temp_path, 'wb', buffering=WRITE_BUFFER_SIZE) as html_file:
+                    html_file.write(data)
+                os.replace(temp_path, output_path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(temp_path)
+                raise
+        timing.measure(len(data), len(data) if written else 0)
+    if precompress and (written or not os.path.exists(output_path + '.gz')):
+        precompress_file(output_path)
+    return written
+
+
+# Block size for compressing files in precompress_file
+PRECOMPRESS_BLOCK_SIZE = 1 << 20
+
+
+def _brotli_module():
+    """Return the brotli (or brotlicffi) module, or None if neither is installed."""
+    try:
+        import brotli
+    except ImportError:
+        try:
+            import brotlicffi as brotli
+        except ImportError:
+            return None
+    return brotli
+
+
+def precompress_file(path: str) -> List[str]:
+    """
+    Write gzip and, when the brotli package is installed, Brotli siblings of a file for static hosting.
+
+    The siblings (path + '.gz', path + '.br') are compressed at the highest
+    level and written via a temporary file and rename, so a server never
+    serves a partial file. The gzip header carries no timestamp, so unchanged
+    input gives byte-identical output.
+
+    Args:
+        path: File to compress
+
+    Returns:
+        Paths of the compressed files written
+
+    Raises:
+        OSError: If the file cannot be read or a sibling cannot be written
+    """
+    import gzip
+    with _profile_stage('precompress') as timing:
+        written = []
+        temp_path = f"{path}.gz.{os.getpid()}.tmp"
+        with open(path, 'rb') as source, open(temp_path, 'wb') as raw_target, \
+                gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=raw_target, mtime=0) as target:
+            for block in iter(lambda: source.read(PRECOMPRESS_BLOCK_SIZE), b''):
+                target.write(block)
+        os.replace(temp_path, path + '.gz')
+        written.append(path + '.gz')
+
+        brotli = _brotli_module()
+        if brotli is not None:
+            temp_path = f"{path}.br.{os.getpid()}.tmp"
+            compressor = brotli.Compressor(quality=11)
+            with open(path, 'rb') as source, open(temp_path, 'wb') as target:
+                for block in iter(lambda: source.read(PRECOMPRESS_BLOCK_SIZE), b''):
+                    target.write(compressor.process(block))
+                target.write(compressor.finish())
+            os.replace(temp_path, path + '.br')
+            written.append(path + '.br')
+
+        timing.measure(os.path.getsize(path), (os.path.getsize(compressed) for compressed in written))
+    return written
+
+
+# In-memory theme CSS bundles, least recently used first: (light style, dark style,
+# hash of the custom CSS) -> combined CSS. Bounded because the server takes CSS per request.
+THEME_CSS_CACHE_SIZE = 32
+_theme_css_cache = OrderedDict()
+_theme_css_lock = threading.Lock()
+
+
+def build_theme_css(css_content: Optional[str] = None, light_style: str = PYGMENTS_LIGHT_STYLE,
+                    dark_style: str = PYGMENTS_DARK_STYLE) -> str:
+    """
+    Build the stylesheet embedded in every document: light and dark Pygments CSS plus page CSS.
+
+    This does the full Pygments style generation; use get_theme_css for the cached version.
+
+    Args:
+        css_content: Optional page CSS appended after the syntax highlighting rules
+        light_style: Pygments style for light mode
+        dark_style: Pygments style for dark mode, scoped to [data-theme="dark"]
+
+    Returns:
+        Combined CSS string
     """
-    # Build the complete HTML5 document
-    html_parts = [
-        '<!DOCTYPE html>',
-        '<html lang="en">',
-        '<head>',
-        '    <meta charset="UTF-8">',
-        '    <meta name="viewport" content="width=device-width, initial-scale=1.0">',
-        '    <meta name="generator" content="MD2HTML">',
-        '    <title>Converted Markdown</title>',
-    ]
+    from pygments.formatters import HtmlFormatter
 
     # Generate BOTH light and dark Pygments CSS for dynamic theme switching
-    # Light mode Pygments (default theme)
-    pygments_light = HtmlFormatter(style='default').get_style_defs('.highlight')
-    # Dark mode Pygments (monokai theme) - scope to [data-theme="dark"]
-    pygments_dark_raw = HtmlFormatter(style='monokai').get_style_defs('.highlight')
+    pygments_light = HtmlFormatter(style=light_style).get_style_defs('.highlight')
+    pygments_dark_raw = HtmlFormatter(style=dark_style).get_style_defs('.highlight')
     # Wrap dark mode Pygments CSS in [data-theme="dark"] selector
     pygments_dark = '\n'.join(
         f'[data-theme="dark"] {line}' if line.strip() and not line.strip().startswith('/*') else line
@@ -194,132 +1736,735 @@ def add_custom_style(html_content: str, css_content: Optional[str] = None, light
     combined_css = f"{pygments_light}\n\n/* Dark mode syntax highlighting */\n{pygments_dark}"
     if css_content:
         combined_css = f"{combined_css}\n{css_content}"
+    return combined_css
+
+
+def get_theme_css(css_content: Optional[str] = None, light_style: str = PYGMENTS_LIGHT_STYLE,
+                  dark_style: str = PYGMENTS_DARK_STYLE, cache_dir: Optional[str] = None) -> str:
+    """
+    Get the combined theme CSS, building it at most once per process.
+
+    Args:
+        css_content: Optional page CSS appended after the syntax highlighting rules
+        light_style: Pygments style for light mode
+        dark_style: Pygments style for dark mode
+        cache_dir: Optional directory for a persistent copy of the bundle, so
+            later processes can skip the Pygments style generation entirely
+
+    Returns:
+        Combined CSS string (see build_theme_css)
+    """
+    css_hash = hash_content(css_content or '')
+    key = (light_style, dark_style, css_hash)
+    with _theme_css_lock:
+        combined_css = _theme_css_cache.get(key)
+        if combined_css is not None:
+            _theme_css_cache.move_to_end(key)
+            return combined_css
+
+    with _profile_stage('theme_css') as timing:
+        cache_path = None
+        if cache_dir:
+            from pygments import __version__ as pygments_version
+            bundle_id = hash_content('\0'.join([light_style, dark_style, css_hash,
+                                                pygments_version, __version__]))
+            cache_path = os.path.join(cache_dir, f'theme-{bundle_id[:16]}.css')
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as cache_file:
+                    combined_css = cache_file.read()
+            except OSError:
+                pass
+
+        if combined_css is None:
+            combined_css = build_theme_css(css_content, light_style, dark_style)
+            if cache_path:
+                _write_cache_file(cache_path, combined_css)
+
+        with _theme_css_lock:
+            _theme_css_cache[key] = combined_css
+            if len(_theme_css_cache) > THEME_CSS_CACHE_SIZE:
+                _theme_css_cache.popitem(last=False)
+        timing.measure(css_content or '', combined_css)
+    return combined_css
+
+
+def warm_theme_css(css_contents: Iterable[Optional[str]] = (None,), cache_dir: Optional[str] = None) -> None:
+    """
+    Pre-build the theme CSS bundles a process is going to need.
+
+    Call this once at startup (e.g. in a worker initializer) so the first
+    document does not pay for Pygments style generation.
+
+    Args:
+        css_contents: Page CSS variants that will be passed to add_custom_style
+        cache_dir: Optional directory for persistent copies of the bundles
+    """
+    for css_content in css_contents:
+        get_theme_css(css_content, cache_dir=cache_dir)
+
+
+def _write_cache_file(cache_path: str, content: str) -> None:
+    """Write a cache file via a temporary file and rename, so concurrent readers never see partial content."""
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as cache_file:
+            cache_file.write(content)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"Warning: Could not write cache file '{cache_path}': {e}")
+
+
+def write_shared_assets(asset_dir: str, css_content: Optional[str] = None, integrity: bool = False,
+                        options: OutputOptions = OutputOptions()) -> dict:
+    """
+    Write the theme CSS and page JavaScript once as content-hashed files.
+
+    Files are named after a hash of their content, so unchanged assets keep
+    their URL (and browser/CDN cache entries) across builds, and existing
+    files are not rewritten.
+
+    Args:
+        asset_dir: Directory to write the assets into
+        css_content: Optional page CSS included in the theme stylesheet
+        integrity: Compute Subresource Integrity hashes for the assets
+        options: Output options of the pages; minify and precompress apply to the
+            assets themselves (see minify_css, minify_js and precompress_file)
+
+    Returns:
+        Mapping of 'css' and 'js' to {'path': file path, 'integrity': SRI value or None};
+        an asset that would be empty is left out
+    """
+    css = get_theme_css(css_content) if options.enabled('highlight') else css_content or ''
+    script_lines = page_script_lines(options)
+    contents = {
+        'css': css + '\n',
+        'js': textwrap.dedent('\n'.join(script_lines)).strip() + '\n',
+    }
+    if options.minify:
+        contents = {'css': minify_css(contents['css']) + '\n', 'js': minify_js(contents['js']) + '\n'}
+    assets = {}
+    for kind, content in contents.items():
+        if not content.strip():
+            # Nothing for the pages to link, e.g. the script with every stage disabled
+            continue
+        data = content.encode('utf-8')
+        path = os.path.join(asset_dir, f'md2html-{hashlib.sha256(data).hexdigest()[:16]}.{kind}')
+        if not os.path.isfile(path):
+            _write_cache_file(path, content)
+        if options.precompress and not os.path.isfile(path + '.gz'):
+            precompress_file(path)
+        sri = None
+        if integrity:
+            sri = 'sha384-' + base64.b64encode(hashlib.sha384(data).digest()).decode('ascii')
+        assets[kind] = {'path': path, 'integrity': sri}
+    return assets
+
+
+def get_asset_refs(assets: dict, document_path: str) -> dict:
+    """
+    Resolve shared assets into references usable from one output document.
+
+    Args:
+        assets: Result of write_shared_assets
+        document_path: Path of the HTML file that will reference the assets
+
+    Returns:
+        Mapping of 'css' and 'js' to {'href': relative URL, 'integrity': SRI value or None}
+    """
+    document_dir = os.path.dirname(os.path.abspath(document_path))
+    return {
+        kind: {
+            'href': os.path.relpath(os.path.abspath(asset['path']), document_dir).replace(os.sep, '/'),
+            'integrity': asset['integrity'],
+        }
+        for kind, asset in assets.items()
+    }
+
+
+def _asset_tag(kind: str, asset_ref: dict) -> str:
+    """Build the <link> or <script> tag referencing a shared asset."""
+    integrity = f' integrity="{asset_ref["integrity"]}"' if asset_ref['integrity'] else ''
+    if kind == 'css':
+        return f'    <link rel="stylesheet" href="{asset_ref["href"]}"{integrity}>'
+    return f'    <script src="{asset_ref["href"]}"{integrity} defer></script>'
+
+
+# Client-side behaviour of every page: copy buttons, theme toggle, heading anchors, MathJax loading
+PAGE_SCRIPT_LINES = [
+    '        // Copy code functionality',
+    '        function copyCode(button) {',
+    '            const header = button.closest(\'.code-header\');',
+    '            let pre = header ? header.nextElementSibling : null;',
+    '            if (!pre || pre.tagName !== \'PRE\') {',
+    '                pre = header ? header.parentElement.querySelector(\'pre\') : null;',
+    '            }',
+    '            const code = pre ? pre.innerText : \'\';',
+    '            navigator.clipboard.writeText(code).then(() => {',
+    '                button.innerHTML = \'<svg aria-hidden="true" height="16" viewBox="0 0 16 16" version="1.1" width="16" data-view-component="true" class="octicon octicon-check"><path fill-rule="evenodd" d="M13.78 3.22a.75.75 0 0 1 0 1.06l-7.5 7.5a.75.75 0 0 1-1.06 0l-3.5-3.5a.75.75 0 0 1 1.06-1.06L6 10.44l7.22-7.22a.75.75 0 0 1 1.06 0z"></path></svg>\';',
+    '                setTimeout(() => {',
+    '                    button.innerHTML = \'<svg aria-hidden="true" height="16" viewBox="0 0 16 16" version="1.1" width="16" data-view-component="true" class="octicon octicon-copy js-clipboard-copy-icon"><path d="M0 6.75C0 5.784.784 5 1.75 5h1.5a.75.75 0 0 1 0 1.5h-1.5a.25.25 0 0 0-.25.25v7.5c0 .138.112.25.25.25h7.5a.25.25 0 0 0 .25-.25v-1.5a.75.75 0 0 1 1.5 0v1.5A1.75 1.75 0 0 1 9.25 16h-7.5A1.75 1.75 0 0 1 0 14.25Z"></path><path d="M5 1.75C5 .784 5.784 0 6.75 0h7.5C15.216 0 16 .784 16 1.75v7.5A1.75 1.75 0 0 1 14.25 11h-7.5A1.75 1.75 0 0 1 5 9.25Zm1.75-.25a.25.25 0 0 0-.25.25v7.5c0 .138.112.25.25.25h7.5a.25.25 0 0 0 .25-.25v-7.5a.25.25 0 0 0-.25-.25Z"></path></svg>\';',
+    '                }, 2000);',
+    '            });',
+    '        }',
+    '',
+    '        // Dark mode toggle functionality',
+    '        function toggleTheme() {',
+    '            const root = document.documentElement;',
+    '            const currentTheme = root.getAttribute(\'data-theme\');',
+    '            const newTheme = currentTheme === \'dark\' ? \'light\' : \'dark\';',
+    '            root.setAttribute(\'data-theme\', newTheme);',
+    '            localStorage.setItem(\'theme\', newTheme);',
+    '        }',
+    '',
+    '        // Initialize theme from localStorage or system preference',
+    '        function initTheme() {',
+    '            const savedTheme = localStorage.getItem(\'theme\');',
+    '            if (savedTheme) {',
+    '                document.documentElement.setAttribute(\'data-theme\', savedTheme);',
+    '            } else if (window.matchMedia && window.matchMedia(\'(prefers-color-scheme: dark)\').matches) {',
+    '                document.documentElement.setAttribute(\'data-theme\', \'dark\');',
+    '            }',
+    '        }',
+    '',
+    '        // Add heading anchor links',
+    '        function addHeadingAnchors() {',
+    '            const headings = document.querySelectorAll(\'h1, h2, h3, h4, h5, h6\');',
+    '            const usedIds = new Map();',
+    '            headings.forEach(heading => {',
+    '                let baseId = heading.id;',
+    '                if (!baseId) {',
+    '                    baseId = heading.textContent.toLowerCase().replace(/[^a-z0-9]+/g, \'-\').replace(/^-+|-+$/g, \'\');',
+    '                }',
+    '                if (!baseId) {',
+    '                    baseId = \'heading\';',
+    '                }',
+    '                const count = usedIds.get(baseId) || 0;',
+    '                usedIds.set(baseId, count + 1);',
+    '                const uniqueId = count === 0 ? baseId : baseId + \'-\' + count;',
+    '                heading.id = uniqueId;',
+    '                const anchor = document.createElement(\'a\');',
+    '                anchor.className = \'heading-anchor\';',
+    '                anchor.href = \'#\' + heading.id;',
+    '                anchor.innerHTML = \'#\';',
+    '                anchor.setAttribute(\'aria-label\', \'Link to this heading\');',
+    '                heading.appendChild(anchor);',
+    '            });',
+    '        }',
+    '',
+    '        // Conditionally load MathJax if math content detected',
+    '        function loadMathJaxIfNeeded() {',
+    '            const hasMath = document.body.innerHTML.match(/\\$\\$|\\\\\\[|\\\\\\(/);',
+    '            if (hasMath) {',
+    '                const script = document.createElement(\'script\');',
+    '                script.src = \'https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js\';',
+    '                script.async = true;',
+    '                document.head.appendChild(script);',
+    '            }',
+    '        }',
+    '',
+    '        // Initialize on DOM ready',
+    '        document.addEventListener(\'DOMContentLoaded\', function() {',
+    '            initTheme();',
+    '            addHeadingAnchors();',
+    '            loadMathJaxIfNeeded();',
+    '        });',
+]
+
+# Where heading IDs and anchor links are added: in every reader's browser by the
+# page script ('client'), or once at conversion time by add_heading_anchors ('build')
+HEADING_ANCHOR_MODES = ('client', 'build')
+
+# Where pages decide whether to load MathJax: in the browser by scanning the page
+# ('client'), or at conversion time with contains_math ('build')
+MATH_DETECTION_MODES = ('client', 'build')
+MATHJAX_URL = 'https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js'
+# MathJax loader for pages found to contain math, and the optional preload hint that
+# goes before the stylesheet so the download starts while the CSS is still being parsed
+MATHJAX_SCRIPT_TAG = f'    <script src="{MATHJAX_URL}" async></script>'
+MATHJAX_PRELOAD_TAG = f'    <link rel="preload" href="{MATHJAX_URL}" as="script">'
+
+
+def _without_script_function(lines: List[str], comment: str, call: Optional[str] = None) -> List[str]:
+    """Drop the page script function that starts at a comment line, and its call on DOM ready."""
+    start = lines.index(comment)
+    # Every function is followed by a blank line
+    end = lines.index('', start) + 1
+    return [line for line in lines[:start] + lines[end:] if line != call]
+
+
+@functools.lru_cache(maxsize=None)
+def page_script_lines(options: OutputOptions = OutputOptions()) -> List[str]:
+    """
+    Get the page script, without the parts that were done at conversion time.
+
+    Args:
+        options: Output options of the page: heading_anchors='build' drops
+            addHeadingAnchors(), math_detection='build' drops loadMathJaxIfNeeded(),
+            icons='sprite' makes copyCode() swap icons by reference to ICON_SPRITE,
+            and the functions of disabled stages are dropped
+
+    Returns:
+        Lines of PAGE_SCRIPT_LINES that the page still needs; empty if it needs none
+    """
+    lines = PAGE_SCRIPT_LINES
+    if not options.enabled('copy_buttons'):
+        lines = _without_script_function(lines, '        // Copy code functionality')
+    elif options.icons == 'sprite':
+        lines = [_script_icon_references(line) if 'button.innerHTML' in line else line for line in lines]
+    if not options.enabled('theme_toggle'):
+        lines = _without_script_function(lines, '        // Dark mode toggle functionality')
+        lines = _without_script_function(lines, '        // Initialize theme from localStorage or system preference',
+                                         '            initTheme();')
+    if options.heading_anchors == 'build' or not options.enabled('heading_anchors'):
+        lines = _without_script_function(lines, '        // Add heading anchor links',
+                                         '            addHeadingAnchors();')
+    if options.math_detection == 'build' or not options.enabled('math'):
+        lines = _without_script_function(lines, '        // Conditionally load MathJax if math content detected',
+                                         '            loadMathJaxIfNeeded();')
+    if lines[-2].endswith('function() {'):
+        # Nothing is left to run on DOM ready; drop the listener and the blank line before it
+        lines = lines[:max(lines.index('        // Initialize on DOM ready') - 1, 0)]
+    return lines
+
+
+# Math delimiters, and the regions MathJax skips (comments and code or raw-text elements)
+_MATH_SCAN_RE = re.compile(r'<!--.*?-->|<(pre|code|script|style|textarea)\b.*?</\1>|(\$\$|\\\[|\\\()', re.S)
+
+
+def contains_math(body: str) -> bool:
+    """
+    Check a body fragment for the math delimiters that loadMathJaxIfNeeded() looks for.
+
+    Unlike the page script, delimiters inside code blocks, inline code,
+    comments and raw-text elements are ignored, as MathJax ignores them too.
+
+    Args:
+        body: Body HTML fragment, as returned by extract_body_content
+
+    Returns:
+        True if the page needs MathJax
+    """
+    return any(match.group(2) for match in _MATH_SCAN_RE.finditer(body))
+
+
+# How copy-button icons are written: as full SVG markup in every code block ('inline'),
+# or once per page as <symbol>s in a sprite that every button references with <use> ('sprite')
+ICON_MODES = ('inline', 'sprite')
+# Copy icon of every code block header, exactly as both engines serialize it
+_COPY_ICON_SVG = _CODE_BLOCK_TEMPLATE[_CODE_BLOCK_TEMPLATE.index('<svg'):_CODE_BLOCK_TEMPLATE.index('</svg>') + 6]
+_COPY_ICON_USE = ('<svg aria-hidden="true" class="octicon octicon-copy js-clipboard-copy-icon" height="16" '
+                  'viewbox="0 0 16 16" width="16"><use href="#md2html-icon-copy"></use></svg>')
+_SVG_CONTENT_RE = re.compile(r'(<svg\b[^>]*>)(.*?)(</svg>)', re.S)
+# The copy icon and the check icon copyCode() shows after copying, defined once for <use>
+ICON_SPRITE = (
+    '<svg aria-hidden="true" style="position:absolute;width:0;height:0;overflow:hidden">'
+    '<symbol id="md2html-icon-copy" viewBox="0 0 16 16">'
+    + _SVG_CONTENT_RE.match(_COPY_ICON_SVG).group(2).replace('\n', '') + '</symbol>'
+    '<symbol id="md2html-icon-check" viewBox="0 0 16 16">'
+    '<path fill-rule="evenodd" d="M13.78 3.22a.75.75 0 0 1 0 1.06l-7.5 7.5a.75.75 0 0 1-1.06 0l-3.5-3.5'
+    'a.75.75 0 0 1 1.06-1.06L6 10.44l7.22-7.22a.75.75 0 0 1 1.06 0z"></path></symbol>'
+    '</svg>'
+)
+
+
+def use_icon_sprite(body: str, include_sprite: bool = True) -> str:
+    """
+    Replace the copy icon of every code block with a <use> reference to ICON_SPRITE.
+
+    Args:
+        body: Body HTML fragment, as returned by extract_body_content
+        include_sprite: Insert ICON_SPRITE before the first code block; pass False for
+            later fragments of a page that already has it
+
+    Returns:
+        Body with referenced icons; unchanged if it has no code blocks
+    """
+    first = body.find(_COPY_ICON_SVG)
+    if first < 0:
+        return body
+    if include_sprite:
+        header = body.rfind('<div class="code-header">', 0, first)
+        body = body[:header] + ICON_SPRITE + body[header:]
+    return body.replace(_COPY_ICON_SVG, _COPY_ICON_USE)
+
+
+def _script_icon_references(line: str) -> str:
+    """Point the SVG icons that a page script line writes at ICON_SPRITE."""
+    icon = 'check' if 'octicon-check' in line else 'copy'
+    return _SVG_CONTENT_RE.sub(rf'\1<use href="#md2html-icon-{icon}"></use>\3', line)
+
+
+# Regions --minify treats specially: content kept verbatim (1-2), and scripts and styles (3-5)
+_MINIFY_REGION_RE = re.compile(r'(<(pre|textarea|code)\b.*?</\2>)|<(script|style)\b([^>]*)>(.*?)</\3>', re.S)
+_HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+_HTML_WHITESPACE_RE = re.compile(r'[\x20\x0a\x09\x0c\x0d]+')
+# Whitespace next to these tags never renders, so --minify drops it
+_BLOCK_TAG_GAP_RE = re.compile(
+    r' ?(<!DOCTYPE[^>]*>|</?(?:html|head|body|main|header|footer|nav|section|article|aside|div|p|h[1-6]|ul|ol|li'
+    r'|dl|dt|dd|table|thead|tbody|tfoot|tr|th|td|caption|blockquote|hr|br|figure|figcaption|details|summary'
+    r'|meta|link|title|noscript|template)\b[^>]*>) ?', re.I)
+_SVG_ELEMENT_RE = re.compile(r'<svg\b([^>]*)>(.*?)</svg>', re.S)
+_VIEWBOX_ATTRIBUTE_RE = re.compile(r"""\sviewbox=(?:"[^"]*"|'[^']*')""", re.I)
+_SCRIPT_TYPE_RE = re.compile(r"""\stype=["']?(?!text/javascript|module|application/javascript)""", re.I)
+_CSS_STRING_OR_COMMENT_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|(/\*.*?\*/)', re.S)
+_CSS_STRING_RE = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')')
+_CSS_PUNCTUATION_RE = re.compile(r' ?([{};,>]) ?')
+# SVGs repeated at least this often, with at least this much markup inside, are moved into a sprite
+MINIFY_SVG_MIN_REPEATS = 2
+MINIFY_SVG_MIN_LENGTH = 64
+
+
+def minify_css(css: str) -> str:
+    """
+    Minify CSS without changing what it means.
+
+    Comments are dropped, whitespace is collapsed and removed around braces,
+    semicolons, commas, '>' and after colons, and the last semicolon of each
+    block is dropped. Strings are left alone.
+
+    Args:
+        css: Stylesheet text
+
+    Returns:
+        Minified stylesheet
+    """
+    css = _CSS_STRING_OR_COMMENT_RE.sub(lambda match: ' ' if match.group(1) else match.group(0), css)
+    parts = _CSS_STRING_RE.split(css)
+    for index in range(0, len(parts), 2):
+        code = _HTML_WHITESPACE_RE.sub(' ', parts[index])
+        code = _CSS_PUNCTUATION_RE.sub(r'\1', code).replace(': ', ':').replace(';}', '}')
+        parts[index] = code
+    return ''.join(parts).strip()
+
+
+def minify_js(js: str) -> str:
+    """
+    Minify JavaScript conservatively.
+
+    Drops indentation, blank lines and whole-line // comments but keeps every
+    line break, so automatic semicolon insertion still sees the same code.
+    Scripts with template literals or line continuations, whose whitespace
+    may be part of a string, are returned unchanged.
+
+    Args:
+        js: Script text
+
+    Returns:
+        Minified script
+    """
+    if '`' in js or '\\\n' in js:
+        return js
+    lines = (line.strip() for line in js.split('\n'))
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def _minify_markup(markup: str) -> str:
+    """Drop comments and collapse whitespace in markup outside any verbatim region."""
+    markup = _HTML_WHITESPACE_RE.sub(' ', _HTML_COMMENT_RE.sub('', markup))
+    return _BLOCK_TAG_GAP_RE.sub(r'\1', markup)
+
+
+def minify_html(html: str, dedupe_svgs: bool = True) -> str:
+    """
+    Minify a generated HTML document (the --minify option).
+
+    Outside <pre>, <textarea> and <code> (kept verbatim), comments are
+    removed, whitespace runs are collapsed to one space and whitespace next
+    to block-level tags is dropped. Embedded stylesheets go through
+    minify_css and JavaScript through minify_js. SVGs that repeat, like the
+    copy button icons, are moved into one hidden sprite of <symbol>s and each
+    copy is replaced by a <use> reference.
+
+    Args:
+        html: Document or fragment to minify
+        dedupe_svgs: Move repeated SVGs into a sprite; the sprite is inserted after
+            <body>, or at the start of a fragment without one
+
+    Returns:
+        Minified HTML
+    """
+    with _profile_stage('minify') as timing:
+        # Markup at even indexes, verbatim regions and minified scripts and styles at odd ones
+        pieces = []
+        position = 0
+        for match in _MINIFY_REGION_RE.finditer(html):
+            pieces.append(_minify_markup(html[position:match.start()]))
+            if match.group(1):
+                pieces.append(match.group(1))
+            else:
+                tag, attributes, content = match.group(3), match.group(4), match.group(5)
+                if tag == 'style':
+                    content = minify_css(content)
+                elif not _SCRIPT_TYPE_RE.search(attributes):
+                    content = minify_js(content)
+                pieces.append(f'<{tag}{attributes}>{content}</{tag}>')
+            position = match.end()
+        pieces.append(_minify_markup(html[position:]))
+        # Whitespace next to a <pre> block, a script or a style never renders
+        for index in range(1, len(pieces), 2):
+            if pieces[index].startswith(('<pre', '<script', '<style')):
+                pieces[index - 1] = pieces[index - 1].rstrip(' ')
+                pieces[index + 1] = pieces[index + 1].lstrip(' ')
+
+        if dedupe_svgs:
+            _dedupe_svgs(pieces)
+        minified = ''.join(pieces).strip()
+        timing.measure(html, minified)
+    return minified
+
+
+def _dedupe_svgs(pieces: List[str]) -> None:
+    """Replace repeated SVGs in the markup pieces of minify_html with <use> references to a sprite."""
+    counts = {}
+    for markup in pieces[::2]:
+        for match in _SVG_ELEMENT_RE.finditer(markup):
+            # Icons that already reference a sprite (see use_icon_sprite) gain nothing from another level
+            if match.group(2).startswith('<use'):
+                continue
+            counts[match.group(0)] = counts.get(match.group(0), 0) + 1
+    symbol_ids = {}
+    symbols = []
+    for match in (_SVG_ELEMENT_RE.match(svg) for svg, count in counts.items()
+                  if count >= MINIFY_SVG_MIN_REPEATS and len(svg) >= MINIFY_SVG_MIN_LENGTH):
+        symbol_id = f'md2html-svg-{len(symbols)}'
+        symbol_ids[match.group(0)] = symbol_id
+        viewbox = _VIEWBOX_ATTRIBUTE_RE.search(match.group(1))
+        symbols.append(f'<symbol id="{symbol_id}"{viewbox.group(0) if viewbox else ""}>{match.group(2)}</symbol>')
+    if not symbols:
+        return
+
+    def reference(match: re.Match) -> str:
+        symbol_id = symbol_ids.get(match.group(0))
+        if symbol_id is None:
+            return match.group(0)
+        return f'<svg{match.group(1)}><use href="#{symbol_id}"></use></svg>'
+
+    for index in range(0, len(pieces), 2):
+        pieces[index] = _SVG_ELEMENT_RE.sub(reference, pieces[index])
+    sprite = ('<svg aria-hidden="true" style="position:absolute;width:0;height:0;overflow:hidden">'
+              + ''.join(symbols) + '</svg>')
+    for index in range(0, len(pieces), 2):
+        body_match = re.search(r'<body\b[^>]*>', pieces[index])
+        if body_match:
+            pieces[index] = pieces[index][:body_match.end()] + sprite + pieces[index][body_match.end():]
+            return
+    pieces[0] = sprite + pieces[0]
+
+
+# Headings of a body fragment; comments and raw-text elements are matched only to be skipped
+_HEADING_SCAN_RE = re.compile(
+    r'<!--.*?-->|<(script|style|textarea)\b.*?</\1>|<(h[1-6])\b([^>]*)>(.*?)</\2>', re.S)
+_ID_ATTRIBUTE_RE = re.compile(r"""\sid=(?:"([^"]*)"|'([^']*)')""")
+_TAG_OR_COMMENT_RE = re.compile(r'<!--.*?-->|<[^>]*>', re.S)
+_SLUG_SEPARATOR_RE = re.compile(r'[^a-z0-9]+')
+
+
+def add_heading_anchors(body: str, used_ids: Optional[dict] = None) -> str:
+    """
+    Give every heading a unique ID and a trailing heading-anchor link, as the page script would.
+
+    Follows addHeadingAnchors() exactly: a heading keeps its ID (from the toc
+    extension or raw HTML) as the base, otherwise its lowercased text with
+    runs of other characters than a-z and 0-9 turned into '-' is used, or
+    'heading' if that is empty. The n-th repeat of a base gets '-n' appended.
+
+    Args:
+        body: Body HTML fragment, as returned by extract_body_content
+        used_ids: Base ID use counts to continue from, updated in place; pass
+            the same dictionary for fragments that end up in one page
+
+    Returns:
+        Body with heading IDs set and anchor links appended
+    """
+    if used_ids is None:
+        used_ids = {}
+
+    def rewrite(match: re.Match) -> str:
+        tag = match.group(2)
+        if tag is None:
+            return match.group(0)
+        attributes, content = match.group(3), match.group(4)
+        id_match = _ID_ATTRIBUTE_RE.search(attributes)
+        base_id = unescape(id_match.group(1) if id_match.group(1) is not None else id_match.group(2)) \
+            if id_match else ''
+        if not base_id:
+            text = unescape(_TAG_OR_COMMENT_RE.sub('', content))
+            base_id = _SLUG_SEPARATOR_RE.sub('-', text.lower()).strip('-') or 'heading'
+        count = used_ids.get(base_id, 0)
+        used_ids[base_id] = count + 1
+        unique_id = base_id if count == 0 else f'{base_id}-{count}'
+        id_attribute = _format_attribute('id', unique_id)
+        if id_match:
+            attributes = attributes[:id_match.start()] + id_attribute + attributes[id_match.end():]
+        else:
+            attributes += id_attribute
+        anchor = (f'<a aria-label="Link to this heading" class="heading-anchor"'
+                  f'{_format_attribute("href", "#" + unique_id)}>#</a>')
+        return f'<{tag}{attributes}>{content}{anchor}</{tag}>'
 
-    # Add CSS if provided
-    if combined_css:
+    return _HEADING_SCAN_RE.sub(rewrite, body)
+
+
+def add_custom_style(html_content: str, css_content: Optional[str] = None, light_mode: bool = True,
+                     engine: str = 'soup', asset_refs: Optional[dict] = None,
+                     options: OutputOptions = OutputOptions()) -> str:
+    """
+    Create a complete, well-formed HTML5 document from converted markdown.
+
+    Args:
+        html_content: HTML body content from converted markdown
+        css_content: Optional CSS string to include in style tag
+        engine: Engine that produced html_content; 'tree' output is already a
+            normalized body fragment and is inserted without re-parsing
+        asset_refs: Optional shared asset references from get_asset_refs; when
+            given, the CSS and JavaScript are linked instead of embedded
+        options: Output options; the page leaves out the parts of disabled stages
+
+    Returns:
+        Complete HTML5 document with:
+        - Proper DOCTYPE and structure (html, head, body)
+        - Meta tags for charset and viewport
+        - Embedded CSS styling
+        - Copy button functionality for code blocks
+        - MathJax for mathematical notation
+    """
+    return _join_document(build_document_head(css_content, asset_refs, options),
+                          extract_body_content(html_content, engine))
+
+
+def _join_document(head: str, body: str) -> str:
+    """Assemble a complete document from build_document_head output and body content."""
+    with _profile_stage('join') as timing:
+        document = '\n'.join([head, body, DOCUMENT_TAIL])
+        timing.measure((head, body), document)
+    return document
+
+
+# Dark mode toggle button at the top of the body (theme_toggle stage)
+THEME_TOGGLE_LINES = [
+    '    <!-- Dark mode toggle button -->',
+    '    <button class="theme-toggle" onclick="toggleTheme()" aria-label="Toggle dark mode">',
+    '        <svg class="sun-icon" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24">',
+    '            <path d="M12 18a6 6 0 1 1 0-12 6 6 0 0 1 0 12zm0-2a4 4 0 1 0 0-8 4 4 0 0 0 0 8zM11 1h2v3h-2V1zm0 19h2v3h-2v-3zM3.515 4.929l1.414-1.414L7.05 5.636 5.636 7.05 3.515 4.93zM16.95 18.364l1.414-1.414 2.121 2.121-1.414 1.414-2.121-2.121zm2.121-14.85l1.414 1.415-2.121 2.121-1.414-1.414 2.121-2.121zM5.636 16.95l1.414 1.414-2.121 2.121-1.414-1.414 2.121-2.121zM23 11v2h-3v-2h3zM4 11v2H1v-2h3z"/>',
+    '        </svg>',
+    '        <svg class="moon-icon" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24">',
+    '            <path d="M10 7a7 7 0 0 0 12 4.9v.1c0 5.523-4.477 10-10 10S2 17.523 2 12 6.477 2 12 2h.1A6.977 6.977 0 0 0 10 7zm-6 5a8 8 0 0 0 15.062 3.762A9 9 0 0 1 8.238 4.938 7.999 7.999 0 0 0 4 12z"/>',
+    '        </svg>',
+    '    </button>',
+    '',
+]
+
+# Closes the main content wrapper and body opened by build_document_head
+DOCUMENT_TAIL = '\n'.join([
+    '    </main>',
+    '</body>',
+    '</html>',
+])
+
+
+def build_document_head(css_content: Optional[str] = None, asset_refs: Optional[dict] = None,
+                        options: OutputOptions = OutputOptions(), math: Optional[bool] = None,
+                        site_nav: Optional[dict] = None) -> str:
+    """
+    Build everything in the HTML5 document before the converted content.
+
+    Args:
+        css_content: Optional CSS string to include in style tag
+        asset_refs: Optional shared asset references from get_asset_refs
+        options: Output options of the body (see page_script_lines); with math=True,
+            math_preload also adds a preload hint for MathJax; disabling 'highlight'
+            drops the Pygments CSS and disabling 'math' implies math=False
+        math: None leaves MathJax loading to the page script; True adds the MathJax
+            loader (see contains_math) and False leaves math out of the page entirely
+        site_nav: Optional {'href', 'integrity'} reference to the site navigation script
+            written by write_site_index
+
+    Returns:
+        Document text from the DOCTYPE up to and including the opening <main> tag
+    """
+    if not options.enabled('math'):
+        math = False
+    with _profile_stage('head') as timing:
+        html_parts = [
+            '<!DOCTYPE html>',
+            '<html lang="en">',
+            '<head>',
+            '    <meta charset="UTF-8">',
+            '    <meta name="viewport" content="width=device-width, initial-scale=1.0">',
+            '    <meta name="generator" content="MD2HTML">',
+            '    <title>Converted Markdown</title>',
+        ]
+        if math and options.math_preload:
+            html_parts.append(MATHJAX_PRELOAD_TAG)
+
+        # Light and dark Pygments CSS plus the page CSS, computed once per process
+        combined_css = get_theme_css(css_content) if options.enabled('highlight') else css_content
+
+        # Add CSS if provided
+        if asset_refs:
+            if 'css' in asset_refs:
+                html_parts.append(_asset_tag('css', asset_refs['css']))
+        elif combined_css:
+            html_parts.extend([
+                '    <style>',
+                combined_css,
+                '    </style>',
+            ])
+
+        # Add comprehensive JavaScript in head
+        if asset_refs:
+            if 'js' in asset_refs:
+                html_parts.append(_asset_tag('js', asset_refs['js']))
+        else:
+            # The page script decides on MathJax only when the head did not
+            script_lines = page_script_lines(options._replace(math_detection='client' if math is None else 'build'))
+            if script_lines:
+                html_parts.append('    <script>')
+                html_parts.extend(script_lines)
+                html_parts.append('    </script>')
+        if site_nav:
+            html_parts.append(_asset_tag('js', site_nav))
+        if math:
+            html_parts.append(MATHJAX_SCRIPT_TAG)
+        html_parts.extend([
+            '</head>',
+            '<body>',
+            '    <!-- Skip to content link for accessibility -->',
+            '    <a href="#main-content" class="skip-to-content">Skip to content</a>',
+            '',
+        ])
+        if options.enabled('theme_toggle'):
+            html_parts.extend(THEME_TOGGLE_LINES)
         html_parts.extend([
-            '    <style>',
-            combined_css,
-            '    </style>',
+            '    <!-- Main content wrapper -->',
+            '    <main id="main-content">',
         ])
+        head = '\n'.join(html_parts)
+        timing.measure(css_content or '', head)
+    return head
 
-    # Add comprehensive JavaScript in head
-    html_parts.extend([
-        '    <script>',
-        '        // Copy code functionality',
-        '        function copyCode(button) {',
-        '            const header = button.closest(\'.code-header\');',
-        '            let pre = header ? header.nextElementSibling : null;',
-        '            if (!pre || pre.tagName !== \'PRE\') {',
-        '                pre = header ? header.parentElement.querySelector(\'pre\') : null;',
-        '            }',
-        '            const code = pre ? pre.innerText : \'\';',
-        '            navigator.clipboard.writeText(code).then(() => {',
-        '                button.innerHTML = \'<svg aria-hidden="true" height="16" viewBox="0 0 16 16" version="1.1" width="16" data-view-component="true" class="octicon octicon-check"><path fill-rule="evenodd" d="M13.78 3.22a.75.75 0 0 1 0 1.06l-7.5 7.5a.75.75 0 0 1-1.06 0l-3.5-3.5a.75.75 0 0 1 1.06-1.06L6 10.44l7.22-7.22a.75.75 0 0 1 1.06 0z"></path></svg>\';',
-        '                setTimeout(() => {',
-        '                    button.innerHTML = \'<svg aria-hidden="true" height="16" viewBox="0 0 16 16" version="1.1" width="16" data-view-component="true" class="octicon octicon-copy js-clipboard-copy-icon"><path d="M0 6.75C0 5.784.784 5 1.75 5h1.5a.75.75 0 0 1 0 1.5h-1.5a.25.25 0 0 0-.25.25v7.5c0 .138.112.25.25.25h7.5a.25.25 0 0 0 .25-.25v-1.5a.75.75 0 0 1 1.5 0v1.5A1.75 1.75 0 0 1 9.25 16h-7.5A1.75 1.75 0 0 1 0 14.25Z"></path><path d="M5 1.75C5 .784 5.784 0 6.75 0h7.5C15.216 0 16 .784 16 1.75v7.5A1.75 1.75 0 0 1 14.25 11h-7.5A1.75 1.75 0 0 1 5 9.25Zm1.75-.25a.25.25 0 0 0-.25.25v7.5c0 .138.112.25.25.25h7.5a.25.25 0 0 0 .25-.25v-7.5a.25.25 0 0 0-.25-.25Z"></path></svg>\';',
-        '                }, 2000);',
-        '            });',
-        '        }',
-        '',
-        '        // Dark mode toggle functionality',
-        '        function toggleTheme() {',
-        '            const root = document.documentElement;',
-        '            const currentTheme = root.getAttribute(\'data-theme\');',
-        '            const newTheme = currentTheme === \'dark\' ? \'light\' : \'dark\';',
-        '            root.setAttribute(\'data-theme\', newTheme);',
-        '            localStorage.setItem(\'theme\', newTheme);',
-        '        }',
-        '',
-        '        // Initialize theme from localStorage or system preference',
-        '        function initTheme() {',
-        '            const savedTheme = localStorage.getItem(\'theme\');',
-        '            if (savedTheme) {',
-        '                document.documentElement.setAttribute(\'data-theme\', savedTheme);',
-        '            } else if (window.matchMedia && window.matchMedia(\'(prefers-color-scheme: dark)\').matches) {',
-        '                document.documentElement.setAttribute(\'data-theme\', \'dark\');',
-        '            }',
-        '        }',
-        '',
-        '        // Add heading anchor links',
-        '        function addHeadingAnchors() {',
-        '            const headings = document.querySelectorAll(\'h1, h2, h3, h4, h5, h6\');',
-        '            const usedIds = new Map();',
-        '            headings.forEach(heading => {',
-        '                let baseId = heading.id;',
-        '                if (!baseId) {',
-        '                    baseId = heading.textContent.toLowerCase().replace(/[^a-z0-9]+/g, \'-\').replace(/^-+|-+$/g, \'\');',
-        '                }',
-        '                if (!baseId) {',
-        '                    baseId = \'heading\';',
-        '                }',
-        '                const count = usedIds.get(baseId) || 0;',
-        '                usedIds.set(baseId, count + 1);',
-        '                const uniqueId = count === 0 ? baseId : baseId + \'-\' + count;',
-        '                heading.id = uniqueId;',
-        '                const anchor = document.createElement(\'a\');',
-        '                anchor.className = \'heading-anchor\';',
-        '                anchor.href = \'#\' + heading.id;',
-        '                anchor.innerHTML = \'#\';',
-        '                anchor.setAttribute(\'aria-label\', \'Link to this heading\');',
-        '                heading.appendChild(anchor);',
-        '            });',
-        '        }',
-        '',
-        '        // Conditionally load MathJax if math content detected',
-        '        function loadMathJaxIfNeeded() {',
-        '            const hasMath = document.body.innerHTML.match(/\\$\\$|\\\\\\[|\\\\\\(/);',
-        '            if (hasMath) {',
-        '                const script = document.createElement(\'script\');',
-        '                script.src = \'https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js\';',
-        '                script.async = true;',
-        '                document.head.appendChild(script);',
-        '            }',
-        '        }',
-        '',
-        '        // Initialize on DOM ready',
-        '        document.addEventListener(\'DOMContentLoaded\', function() {',
-        '            initTheme();',
-        '            addHeadingAnchors();',
-        '            loadMathJaxIfNeeded();',
-        '        });',
-        '    </script>',
-        '</head>',
-        '<body>',
-        '    <!-- Skip to content link for accessibility -->',
-        '    <a href="#main-content" class="skip-to-content">Skip to content</a>',
-        '',
-        '    <!-- Dark mode toggle button -->',
-        '    <button class="theme-toggle" onclick="toggleTheme()" aria-label="Toggle dark mode">',
-        '        <svg class="sun-icon" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24">',
-        '            <path d="M12 18a6 6 0 1 1 0-12 6 6 0 0 1 0 12zm0-2a4 4 0 1 0 0-8 4 4 0 0 0 0 8zM11 1h2v3h-2V1zm0 19h2v3h-2v-3zM3.515 4.929l1.414-1.414L7.05 5.636 5.636 7.05 3.515 4.93zM16.95 18.364l1.414-1.414 2.121 2.121-1.414 1.414-2.121-2.121zm2.121-14.85l1.414 1.415-2.121 2.121-1.414-1.414 2.121-2.121zM5.636 16.95l1.414 1.414-2.121 2.121-1.414-1.414 2.121-2.121zM23 11v2h-3v-2h3zM4 11v2H1v-2h3z"/>',
-        '        </svg>',
-        '        <svg class="moon-icon" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24">',
-        '            <path d="M10 7a7 7 0 0 0 12 4.9v.1c0 5.523-4.477 10-10 10S2 17.523 2 12 6.477 2 12 2h.1A6.977 6.977 0 0 0 10 7zm-6 5a8 8 0 0 0 15.062 3.762A9 9 0 0 1 8.238 4.938 7.999 7.999 0 0 0 4 12z"/>',
-        '        </svg>',
-        '    </button>',
-        '',
-        '    <!-- Main content wrapper -->',
-        '    <main id="main-content">',
-    ])
-
-    # Add the converted markdown content without altering whitespace,
-    # so code blocks preserve spaces and newlines.
-    soup = BeautifulSoup(html_content, 'lxml')
-    body_content = soup.find('body')
-    if body_content:
-        html_parts.append(body_content.decode_contents())
-    else:
-        html_parts.append(html_content)
 
-    # Close main content wrapper and body
-    html_parts.extend([
-        '    </main>',
-        '</body>',
-        '</html>',
-    ])
+def extract_body_content(html_content: str, engine: str = 'soup') -> str:
+    """
+    Get the markup that goes inside <main> from converted markdown.
+
+    Args:
+        html_content: Output of convert_md_to_html
+        engine: Engine that produced html_content
 
-    return '\n'.join(html_parts)
+    Returns:
+        Body content, with whitespace preserved so code blocks keep spaces and newlines
+    """
+    if engine == 'tree':
+        return html_content
+    with _profile_stage('extract') as timing:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html_content, 'lxml')
+        body_content = soup.find('body')
+        body = body_content.decode_contents() if body_content else html_content
+        timing.measure(html_content, body)
+    return body
 
 
 def prompt_based_conversion() -> None:
@@ -349,37 +2494,16 @@ def prompt_based_conversion() -> None:
 
         output_file = input("Enter the name of the output HTML file (default: output.html): ").strip() or 'output.html'
         try:
-            with open(output_file, 'w', encoding='utf-8') as html_file:
-                html_file.write(styled_html)
-            print(f"Markdown converted to HTML successfully! Output saved to {output_file}")
+            written = write_html_file(output_file, styled_html)
+            print(f"Markdown converted to HTML successfully! Output saved to {output_file}"
+                  + ("" if written else " (unchanged)"))
         except Exception as e:
             print(f"Error writing output file: {e}")
         break
 
 
-def arg_based_conversion(args) -> None:
-    """
-    Command-line argument based conversion mode.
-
-    Args:
-        args: Parsed command-line arguments containing:
-            - input_file: Path to input Markdown file
-            - output_file: Name of output HTML file
-            - output_dir: Directory for output file
-            - css_file: Optional custom CSS file path
-            - mode: 'light' or 'dark' theme mode
-    """
-    md_text = load_markdown_file(args.input_file)
-    if md_text is None:
-        return
-
-    light_mode = args.mode.lower() != 'dark'
-
-    # Determine CSS content priority:
-    # 1. Custom CSS file from --css_file argument (highest priority)
-    # 2. Default style_light.css or style_dark.css if they exist
-    # 3. Hardcoded CSS as fallback (lowest priority)
-    css_content = """
+# Fallback stylesheet used when neither --css_file nor style_light.css/style_dark.css is available
+BUILTIN_CSS = """
 /* CSS Variables for theming */
 :root {
     --bg-primary: #ffffff;
@@ -1138,12 +3262,30 @@ hr {
 }
 """
 
+
+def resolve_css_content(css_file: Optional[str], light_mode: bool = True) -> str:
+    """
+    Resolve the stylesheet to embed in converted documents.
+
+    Args:
+        css_file: Optional custom CSS file path from --css_file
+        light_mode: Whether light mode is selected (picks style_light.css or style_dark.css)
+
+    Returns:
+        CSS content as string
+    """
+    # Determine CSS content priority:
+    # 1. Custom CSS file from --css_file argument (highest priority)
+    # 2. Default style_light.css or style_dark.css if they exist
+    # 3. Hardcoded CSS as fallback (lowest priority)
+    css_content = BUILTIN_CSS
+
     # Load CSS with priority: custom CSS file > default CSS file > hardcoded CSS
-    if args.css_file:
-        custom_css = load_css_file(args.css_file)
+    if css_file:
+        custom_css = load_css_file(css_file)
         if custom_css:
             css_content = custom_css
-            print(f"Using custom CSS from: {args.css_file}")
+            print(f"Using custom CSS from: {css_file}")
     else:
         css_path = 'style_light.css' if light_mode else 'style_dark.css'
         default_css = load_css_file(css_path)
@@ -1153,40 +3295,2208 @@ hr {
         else:
             print("Using built-in CSS")
 
-    html = convert_md_to_html(md_text, light_mode=light_mode)
-    styled_html = add_custom_style(html, css_content, light_mode=light_mode)
+    return css_content
 
-    output_path = os.path.join(args.output_dir, args.output_file)
-    try:
-        with open(output_path, 'w', encoding='utf-8') as html_file:
-            html_file.write(styled_html)
-        print(f"Markdown converted to HTML successfully! Output saved to {output_path}")
-    except Exception as e:
-        print(f"Error writing output file: {e}")
 
+# Stages added with register_stage, by name, in the order they run
+_custom_stages = {}
 
-def main() -> None:
+
+def register_stage(name: str, function: Callable[[str], str]) -> None:
     """
-    Main entry point for the MD2HTML converter.
+    Add a named stage to the end of the processing pipeline.
 
-    Parses command-line arguments and routes to either argument-based
-    or interactive prompt-based conversion mode.
+    A stage is a function that takes the body HTML fragment of a document (the
+    markup that goes inside <main>, after every built-in stage) and returns the
+    new fragment. It runs in every Converter created afterwards, once per
+    document, or once per chunk in convert_stream, and can be turned off by name
+    with disabled_stages like the built-in PIPELINE_STAGES. Register stages when
+    your module is imported, so worker processes (batch builds, serve,
+    AsyncConverter) that import it have them too.
+
+    Args:
+        name: Stage name, unique among PIPELINE_STAGES and registered stages
+        function: Callable taking and returning a body HTML fragment
+
+    Raises:
+        ValueError: If the name is already taken
     """
-    print_logo()
+    if name in PIPELINE_STAGES or name in _custom_stages:
+        raise ValueError(f"Stage '{name}' is already registered")
+    _custom_stages[name] = function
 
-    parser = argparse.ArgumentParser(description="Convert Markdown files to HTML.")
-    parser.add_argument("-i", "--input_file", help="Path to the input Markdown file.")
-    parser.add_argument("-o", "--output_file", default="output.html", help="Name of the output HTML file.")
-    parser.add_argument("-d", "--output_dir", default=".", help="Directory where the output HTML file will be saved.")
-    parser.add_argument("-c", "--css_file", help="Path to a custom CSS file.")
-    parser.add_argument("-m", "--mode", default="light", help="Choose mode (light/dark). Default is light.")
 
-    args = parser.parse_args()
+def unregister_stage(name: str) -> None:
+    """
+    Remove a stage added with register_stage; Converters created before keep it.
 
-    if args.input_file:
-        arg_based_conversion(args)
-    else:
-        prompt_based_conversion()
+    Raises:
+        ValueError: If no stage of that name was registered
+    """
+    if _custom_stages.pop(name, None) is None:
+        raise ValueError(f"Unknown stage '{name}'")
+
+
+def resolve_disabled_stages(disabled_stages: Iterable[str]) -> frozenset:
+    """
+    Validate the names of stages to turn off.
+
+    Args:
+        disabled_stages: Names from PIPELINE_STAGES or of registered stages
+
+    Returns:
+        Frozen set of the names, usable as OutputOptions.disabled_stages
+
+    Raises:
+        ValueError: If a name is unknown
+    """
+    disabled_stages = frozenset(disabled_stages)
+    for name in sorted(disabled_stages):
+        if name not in PIPELINE_STAGES and name not in _custom_stages:
+            raise ValueError(f"Unknown stage '{name}', expected one of "
+                             f"{', '.join(PIPELINE_STAGES + tuple(_custom_stages))}")
+    return disabled_stages
+
+
+def custom_stage_functions(disabled_stages: frozenset = frozenset()) -> List[Callable[[str], str]]:
+    """Return the registered stages that are not disabled, in the order they run."""
+    return [function for name, function in _custom_stages.items() if name not in disabled_stages]
+
+
+def check_converter_options(mode: str = 'light', engine: str = 'soup', heading_anchors: str = 'client',
+                            math_detection: str = 'client', icons: str = 'inline',
+                            disabled_stages: Iterable[str] = (), **other) -> frozenset:
+    """
+    Validate Converter options without building anything.
+
+    Args:
+        mode, engine, heading_anchors, math_detection, icons, disabled_stages: As for Converter
+        **other: Other Converter keyword arguments, accepted unchecked
+
+    Returns:
+        The disabled stages, as from resolve_disabled_stages
+
+    Raises:
+        ValueError: If mode, engine, heading_anchors, math_detection, icons or a stage name
+            is unknown
+    """
+    if mode not in ('light', 'dark'):
+        raise ValueError(f"Unknown mode '{mode}', expected 'light' or 'dark'")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {', '.join(ENGINES)}")
+    if heading_anchors not in HEADING_ANCHOR_MODES:
+        raise ValueError(f"Unknown heading anchor mode '{heading_anchors}', "
+                         f"expected one of {', '.join(HEADING_ANCHOR_MODES)}")
+    if math_detection not in MATH_DETECTION_MODES:
+        raise ValueError(f"Unknown math detection mode '{math_detection}', "
+                         f"expected one of {', '.join(MATH_DETECTION_MODES)}")
+    if icons not in ICON_MODES:
+        raise ValueError(f"Unknown icon mode '{icons}', expected one of {', '.join(ICON_MODES)}")
+    return resolve_disabled_stages(disabled_stages)
+
+
+class Converter:
+    """
+    Reusable Markdown to HTML5 converter for use as a library.
+
+    Configure it once, then convert any number of documents. The converter
+    keeps one markdown.Markdown instance and resets it between documents
+    instead of rebuilding the extensions for every call; the highlighting and
+    theme CSS caches are shared process-wide. A Converter is not thread-safe:
+    use one per thread or worker process.
+
+    Example:
+        >>> converter = Converter(mode='dark', engine='tree')
+        >>> html = converter.convert('# Hello')
+        >>> converter.convert_file('README.md', 'site/README.html')
+    """
+
+    def __init__(self, mode: str = 'light', css_content: Optional[str] = BUILTIN_CSS,
+                 css_file: Optional[str] = None, engine: str = 'soup', extensions: Optional[list] = None,
+                 extension_configs: Optional[dict] = None, standalone: bool = True,
+                 assets: Optional[dict] = None, cache_dir: Optional[str] = None, highlight_jobs: int = 1,
+                 heading_anchors: str = 'client', math_detection: str = 'client',
+                 math_preload: bool = False, icons: str = 'inline', minify: bool = False,
+                 precompress: bool = False, site_nav: Optional[str] = None,
+                 disabled_stages: Iterable[str] = ()) -> None:
+        """
+        Args:
+            mode: Theme mode, 'light' or 'dark'
+            css_content: Page CSS embedded in (or linked from) every document; the
+                built-in stylesheet by default, None for syntax highlighting rules only
+            css_file: Path of a CSS file to use instead of css_content
+            engine: Rendering engine ('soup' or 'tree'); 'tree' is several times faster
+            extensions: Extra Python-Markdown extensions loaded after MARKDOWN_EXTENSIONS
+            extension_configs: Per-extension settings passed to markdown
+            standalone: Return complete HTML5 documents (True) or only the body markup (False)
+            assets: Shared assets from write_shared_assets to link instead of embedding CSS/JS
+            cache_dir: Optional directory for a persistent copy of the theme CSS bundle
+            highlight_jobs: Worker processes for highlighting the code blocks of large documents
+            heading_anchors: 'client' leaves heading IDs and anchor links to the page script;
+                'build' adds them during conversion (see add_heading_anchors) and drops the script
+            math_detection: 'client' leaves the decision to load MathJax to the page script;
+                'build' checks each document with contains_math and loads MathJax only where needed
+            math_preload: With math_detection='build', add a preload hint for MathJax to pages with math
+            icons: 'inline' writes the copy-button icons into every code block; 'sprite' defines
+                them once per page and references them (see use_icon_sprite)
+            minify: Minify complete documents (see minify_html)
+            precompress: Make convert_file also write compressed siblings of output files
+                (see precompress_file)
+            site_nav: Path of the site navigation script (see write_site_index) to link from
+                every document; it may be written after the documents
+            disabled_stages: Names of PIPELINE_STAGES or registered stages (see register_stage)
+                to turn off; the stages that remain are resolved once, here
+
+        Raises:
+            ValueError: If mode, engine, heading_anchors, math_detection, icons or a stage name
+                is unknown
+            OSError: If css_file cannot be read
+        """
+        options = OutputOptions(heading_anchors, math_detection, math_preload, icons, minify, precompress,
+                                check_converter_options(mode, engine, heading_anchors, math_detection, icons,
+                                                        disabled_stages))
+        if css_file:
+            with open(css_file, 'r', encoding='utf-8') as f:
+                css_content = f.read()
+
+        self.mode = mode
+        self.light_mode = mode == 'light'
+        self.css_content = css_content
+        self.css_hash = hash_content(css_content or '')
+        self.engine = engine
+        self.standalone = standalone
+        self.assets = assets
+        self.highlight_jobs = highlight_jobs
+        self.site_nav = site_nav
+        # The page-affecting settings travel down the pipeline together (see OutputOptions)
+        self.options = options
+        # Body stages that run after rendering, in order
+        self.body_stages = []
+        if heading_anchors == 'build' and options.enabled('heading_anchors'):
+            self.body_stages.append(add_heading_anchors)
+        if icons == 'sprite' and options.enabled('copy_buttons'):
+            self.body_stages.append(use_icon_sprite)
+        self.body_stages.extend(custom_stage_functions(options.disabled_stages))
+        self.md = create_markdown(self.light_mode, engine, extension_configs, extensions, highlight_jobs, options)
+        if standalone and options.enabled('highlight'):
+            warm_theme_css([css_content], cache_dir=cache_dir)
+
+    def render(self, md_text: str) -> str:
+        """
+        Convert Markdown to the markup that goes inside the document's <main> element.
+
+        Args:
+            md_text: Markdown content to convert
+
+        Returns:
+            Body HTML fragment
+        """
+        self.md.reset()
+        html = render_markdown(self.md, md_text, self.light_mode, self.engine, self.highlight_jobs, self.options)
+        body = extract_body_content(html, self.engine)
+        for stage in self.body_stages:
+            body = stage(body)
+        return body
+
+    def convert(self, md_text: str, document_path: Optional[str] = None) -> str:
+        """
+        Convert Markdown to HTML.
+
+        Args:
+            md_text: Markdown content to convert
+            document_path: Where the document will be saved; shared asset links are
+                made relative to it (default: a file in the current directory)
+
+        Returns:
+            Complete HTML5 document, or the body fragment if standalone is False
+        """
+        body = self.render(md_text)
+        if not self.standalone:
+            return body
+        return self.document(body, document_path)
+
+    def document(self, body: str, document_path: Optional[str] = None) -> str:
+        """
+        Wrap markup from render() in a complete HTML5 document.
+
+        Rendered bodies do not depend on the CSS, so callers that keep them
+        can rebuild documents for a new stylesheet without converting again.
+
+        Args:
+            body: Body HTML fragment from render()
+            document_path: Where the document will be saved (see convert)
+
+        Returns:
+            Complete HTML5 document
+        """
+        document_path = document_path or 'index.html'
+        asset_refs = get_asset_refs(self.assets, document_path) if self.assets else None
+        site_nav = (get_asset_refs({'nav': {'path': self.site_nav, 'integrity': None}}, document_path)['nav']
+                    if self.site_nav else None)
+        options = self.options
+        math = contains_math(body) if options.math_detection == 'build' and options.enabled('math') else None
+        document = _join_document(build_document_head(self.css_content, asset_refs, options, math, site_nav), body)
+        if options.minify:
+            return minify_html(document)
+        return document
+
+    def outline(self) -> dict:
+        """
+        Describe the document converted last by its title and headings (see page_outline).
+
+        Returns:
+            Dictionary with 'title' and 'headings'
+        """
+        return page_outline(getattr(self.md, 'toc_tokens', []))
+
+    def convert_file(self, md_path: str, out: Union[str, TextIO], encoding: str = INPUT_ENCODING_AUTO) -> None:
+        """
+        Convert a Markdown file.
+
+        Args:
+            md_path: Path of the Markdown input
+            out: Output path (parent directories are created) or an open text file
+            encoding: Input encoding (see decode_markdown)
+
+        Raises:
+            OSError: If the input cannot be read or the output cannot be written
+            UnicodeDecodeError: If the input cannot be decoded
+        """
+        md_text = read_markdown_file(md_path, encoding)
+        if not isinstance(out, str):
+            out.write(self.convert(md_text))
+            return
+        write_html_file(out, self.convert(md_text, document_path=out), self.options.precompress)
+
+
+# Converter options and Converters of the AsyncConverter instances served by this process, by instance key
+_async_options = {}
+_async_converters = {}
+_async_converter_keys = itertools.count()
+
+
+def _init_async_worker(key: int, options: dict) -> None:
+    """Record the Converter options of an AsyncConverter in one of its worker processes."""
+    _async_options[key] = options
+
+
+def _async_converter(key: int) -> Converter:
+    """Return a worker's Converter for an AsyncConverter, building it on first use."""
+    converter = _async_converters.get(key)
+    if converter is None:
+        converter = _async_converters[key] = Converter(**_async_options[key])
+    return converter
+
+
+def _async_convert(key: int, md_text: str) -> str:
+    """Convert one document inside an AsyncConverter worker."""
+    return _async_converter(key).convert(md_text)
+
+
+def _async_convert_file(key: int, md_path: str, output_path: str) -> str:
+    """Convert one file inside an AsyncConverter worker, which also reads and writes it."""
+    _async_converter(key).convert_file(md_path, output_path)
+    return output_path
+
+
+async def _async_items(items: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    """Iterate over a plain or an asynchronous iterable."""
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class AsyncConverter:
+    """
+    asyncio front end to Converter that keeps conversions off the event loop.
+
+    Documents are converted, and files read and written, by a pool of worker
+    processes that each build one Converter on their first document and keep
+    it warm. At most `concurrency`
+    conversions are handed to the pool at a time; further calls wait their
+    turn, and cancelling a call that is still waiting or queued drops its work.
+
+    Example:
+        >>> async with AsyncConverter(mode='dark', engine='tree', jobs=4) as converter:
+        ...     html = await converter.convert('# Hello')
+        ...     async for html in converter.convert_many(documents):
+        ...         store(html)
+    """
+
+    def __init__(self, mode: str = 'light', engine: str = 'soup', jobs: int = 0,
+                 concurrency: Optional[int] = None, **options) -> None:
+        """
+        Args:
+            mode: Theme mode, 'light' or 'dark'
+            engine: Rendering engine ('soup' or 'tree')
+            jobs: Worker processes (0 means one per CPU); 1 converts on a single worker thread
+            concurrency: Most conversions handed to the workers at a time, and most
+                documents a batch iterator reads ahead (default: two per worker)
+            **options: Other Converter keyword arguments, such as css_file or heading_anchors
+
+        Raises:
+            ValueError: If mode, engine or another option checked by check_converter_options
+                is invalid; problems with the other options, such as an unreadable css_file,
+                are raised by the first conversion
+        """
+        import asyncio
+        # Only the cheap checks run on the event loop; the workers build the Converters
+        check_converter_options(mode, engine, **options)
+        options = dict(options, mode=mode, engine=engine)
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.concurrency = concurrency or 2 * self.jobs
+        if self.concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, got {self.concurrency}")
+        self._key = next(_async_converter_keys)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        if self.jobs == 1:
+            from concurrent.futures import ThreadPoolExecutor
+            _async_options[self._key] = options
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_async_worker,
+                                                 initargs=(self._key, options))
+
+    async def __aenter__(self) -> 'AsyncConverter':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _submit(self, function, *args):
+        """Run a worker function once a concurrency slot is free."""
+        import asyncio
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, self._key, *args)
+
+    async def convert(self, md_text: str) -> str:
+        """
+        Convert Markdown to HTML in a worker.
+
+        Args:
+            md_text: Markdown content to convert
+
+        Returns:
+            Complete HTML5 document, or the body fragment for standalone=False
+        """
+        return await self._submit(_async_convert, md_text)
+
+    async def convert_file(self, md_path: str, output_path: str) -> None:
+        """
+        Convert a Markdown file in a worker, which also reads the input and writes the output.
+
+        Args:
+            md_path: Path of the Markdown input
+            output_path: Output path (parent directories are created)
+
+        Raises:
+            OSError: If the input cannot be read or the output cannot be written
+            UnicodeDecodeError: If the input cannot be decoded
+        """
+        await self._submit(_async_convert_file, md_path, output_path)
+
+    def convert_many(self, documents: Union[Iterable[str], AsyncIterable[str]],
+                     return_exceptions: bool = False) -> AsyncIterator[Union[str, Exception]]:
+        """
+        Convert a stream of documents, yielding results in input order.
+
+        Documents are read from the source only as fast as results are consumed:
+        at most `concurrency` of them are converting or waiting to be yielded.
+        Leaving the loop early, or cancelling it, cancels the work still pending.
+
+        Args:
+            documents: Markdown texts, as a plain or asynchronous iterable
+            return_exceptions: Yield the exception of a failed conversion in its place
+                instead of raising it (which ends the iteration)
+
+        Returns:
+            Asynchronous iterator of documents, as returned by convert
+        """
+        return self._map(_async_convert, ((md_text,) async for md_text in _async_items(documents)),
+                         return_exceptions)
+
+    def convert_files(self, paths: Union[Iterable[Tuple[str, str]], AsyncIterable[Tuple[str, str]]],
+                      return_exceptions: bool = False) -> AsyncIterator[Union[str, Exception]]:
+        """
+        Convert a stream of files, yielding each output path in input order once it is written.
+
+        Args:
+            paths: (Markdown path, output path) pairs, as a plain or asynchronous iterable
+            return_exceptions: See convert_many
+
+        Returns:
+            Asynchronous iterator of output paths
+        """
+        return self._map(_async_convert_file, _async_items(paths), return_exceptions)
+
+    async def _map(self, function, arguments: AsyncIterator[tuple],
+                   return_exceptions: bool) -> AsyncIterator[Union[str, Exception]]:
+        """Run a worker function over argument tuples with a bounded read-ahead window."""
+        import asyncio
+
+        async def outcome(task):
+            try:
+                return await task
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        pending = deque()
+        try:
+            async for args in arguments:
+                pending.append(asyncio.ensure_future(self._submit(function, *args)))
+                while pending and (len(pending) >= self.concurrency or pending[0].done()):
+                    yield await outcome(pending.popleft())
+            while pending:
+                yield await outcome(pending.popleft())
+        finally:
+            for task in pending:
+                task.cancel()
+                if task.done() and not task.cancelled():
+                    # Mark the failure as seen; the caller stopped listening for it
+                    task.exception()
+
+    async def close(self) -> None:
+        """Stop the workers, cancelling queued conversions, without blocking the event loop."""
+        import asyncio
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(self._executor.shutdown, wait=True, cancel_futures=True))
+        _async_options.pop(self._key, None)
+        _async_converters.pop(self._key, None)
+
+
+async def convert_async(md_text: str, mode: str = 'light', engine: str = 'soup', **options) -> str:
+    """
+    Convert Markdown to HTML without blocking the event loop.
+
+    Meant for the occasional document: each call builds a Converter on the loop's
+    default thread pool. Keep an AsyncConverter to convert many documents.
+
+    Args:
+        md_text: Markdown content to convert
+        mode: Theme mode, 'light' or 'dark'
+        engine: Rendering engine ('soup' or 'tree')
+        **options: Other Converter keyword arguments
+
+    Returns:
+        Complete HTML5 document, or the body fragment for standalone=False
+
+    Raises:
+        ValueError: If an option is invalid
+    """
+    import asyncio
+    return await asyncio.get_running_loop().run_in_executor(
+        None, lambda: Converter(mode, engine=engine, **options).convert(md_text))
+
+
+def hash_content(content: str) -> str:
+    """
+    Compute the content hash used by the incremental build manifest.
+
+    Args:
+        content: Text to hash
+
+    Returns:
+        Hex SHA-256 digest of the UTF-8 encoded text
+    """
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def build_manifest_entry(md_text: Optional[str], css_hash: str, light_mode: bool, engine: str = 'soup',
+                         options: Optional[dict] = None, input_hash: Optional[str] = None) -> dict:
+    """
+    Describe every input that determines an output file's contents.
+
+    Args:
+        md_text: Markdown source of the document
+        css_hash: Hash of the resolved CSS content (see hash_content)
+        light_mode: Whether light mode is selected
+        engine: Rendering engine used for the conversion
+        options: Other output-affecting settings (JSON-serializable)
+        input_hash: Precomputed hash of the Markdown source, used instead of md_text
+
+    Returns:
+        Manifest entry dictionary; an output is up to date when its stored entry is equal
+    """
+    return {
+        'input': input_hash if input_hash is not None else hash_content(md_text),
+        'css': css_hash,
+        'mode': 'light' if light_mode else 'dark',
+        'engine': engine,
+        'options': options or {},
+        'version': __version__,
+    }
+
+
+def load_manifest(output_dir: str) -> dict:
+    """
+    Load the incremental build manifest stored in an output directory.
+
+    Args:
+        output_dir: Directory containing the manifest
+
+    Returns:
+        Mapping of output path (relative to output_dir) to manifest entry,
+        or an empty dict if the manifest is missing or unreadable
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Warning: Ignoring unreadable manifest '{manifest_path}': {e}")
+        return {}
+    files = manifest.get('files') if isinstance(manifest, dict) else None
+    return files if isinstance(files, dict) else {}
+
+
+def save_manifest(output_dir: str, entries: dict) -> None:
+    """
+    Write the incremental build manifest into an output directory.
+
+    The manifest is written to a temporary file and renamed into place so an
+    interrupted run never leaves a truncated manifest behind.
+
+    Args:
+        output_dir: Directory containing the manifest
+        entries: Mapping of output path (relative to output_dir) to manifest entry
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump({'files': entries}, manifest_file, indent=1, sort_keys=True)
+        os.replace(temp_path, manifest_path)
+    except Exception as e:
+        print(f"Warning: Could not write manifest '{manifest_path}': {e}")
+
+
+def manifest_key(output_path: str, output_dir: str) -> str:
+    """Return the manifest key for an output file: its path relative to output_dir, with forward slashes."""
+    return os.path.relpath(output_path, output_dir).replace(os.sep, '/')
+
+
+def output_options(args) -> dict:
+    """
+    Collect the command-line settings, beyond mode/CSS/engine, that change generated HTML.
+
+    Args:
+        args: Parsed command-line arguments
+
+    Returns:
+        Dictionary recorded in manifest entries
+    """
+    return {'assets': args.assets, 'integrity': args.integrity, 'heading_anchors': args.heading_anchors,
+            'math_detection': args.math_detection, 'math_preload': args.math_preload, 'icons': args.icons,
+            'minify': args.minify, 'precompress': args.precompress, 'site': args.site,
+            'disabled_stages': sorted(set(args.disable_stage))}
+
+
+def _converter_options(options: Optional[dict]) -> dict:
+    """Pick the Converter keyword arguments (the OutputOptions fields) out of an output_options dictionary."""
+    return {name: options[name] for name in OutputOptions._fields if name in (options or {})}
+
+
+def pipeline_options(args) -> OutputOptions:
+    """Build the OutputOptions of a command-line run, for the pipeline functions below Converter."""
+    return OutputOptions(**dict(_converter_options(output_options(args)),
+                                disabled_stages=frozenset(args.disable_stage)))
+
+
+def shared_assets_from_args(args, css_content: Optional[str]) -> dict:
+    """
+    Write the shared assets for a command-line run with --assets external.
+
+    Args:
+        args: Parsed command-line arguments
+        css_content: Page CSS included in the theme stylesheet
+
+    Returns:
+        Result of write_shared_assets for args.output_dir
+    """
+    return write_shared_assets(args.output_dir, css_content, integrity=args.integrity,
+                               options=pipeline_options(args))
+
+
+def arg_based_conversion(args, stdout: Optional[TextIO] = None) -> None:
+    """
+    Command-line argument based conversion mode.
+
+    Args:
+        args: Parsed command-line arguments containing:
+            - input_file: Path to input Markdown file, or '-' for standard input
+            - output_file: Name of output HTML file, or '-' for standard output
+            - output_dir: Directory for output file
+            - css_file: Optional custom CSS file path
+            - mode: 'light' or 'dark' theme mode
+            - engine: Rendering engine ('soup' or 'tree')
+            - cache_dir: Optional directory for persistent caches
+            - assets: 'inline' to embed CSS/JS, 'external' to link shared asset files
+            - integrity: Add Subresource Integrity attributes to external assets
+            - incremental: Skip conversion when the manifest shows nothing changed
+            - stream: Convert chunk by chunk without loading the whole file
+        stdout: Stream for an output_file of '-' (default: sys.stdout)
+    """
+    if args.stream:
+        stream_conversion(args, stdout)
+        return
+
+    md_text = load_markdown_file(args.input_file, args.input_encoding)
+    if md_text is None:
+        return
+
+    light_mode = args.mode.lower() != 'dark'
+    css_content = resolve_css_content(args.css_file, light_mode)
+    to_stdout = args.output_file == STDIO_PATH
+    # A document on standard output links shared assets as if it were in output_dir
+    output_path = os.path.join(args.output_dir, 'index.html' if to_stdout else args.output_file)
+
+    if args.incremental and not to_stdout:
+        manifest = load_manifest(args.output_dir)
+        key = manifest_key(output_path, args.output_dir)
+        entry = build_manifest_entry(md_text, hash_content(css_content), light_mode, args.engine,
+                                     output_options(args))
+        if manifest.get(key) == entry and os.path.isfile(output_path):
+            print(f"Output is up to date: {output_path}")
+            return
+
+    assets = None
+    if args.assets == 'external':
+        assets = shared_assets_from_args(args, css_content)
+    converter = Converter('light' if light_mode else 'dark', css_content, engine=args.engine, assets=assets,
+                          cache_dir=args.cache_dir, highlight_jobs=args.highlight_jobs,
+                          **_converter_options(output_options(args)))
+    styled_html = converter.convert(md_text, document_path=output_path)
+
+    if to_stdout:
+        (stdout or sys.stdout).write(styled_html)
+        return
+    try:
+        written = write_html_file(output_path, styled_html, args.precompress)
+        print(f"Markdown converted to HTML successfully! Output saved to {output_path}"
+              + ("" if written else " (unchanged)"))
+    except Exception as e:
+        print(f"Error writing output file: {e}")
+        return
+
+    if args.incremental:
+        manifest[key] = entry
+        save_manifest(args.output_dir, manifest)
+
+
+def stream_conversion(args, stdout: Optional[TextIO] = None) -> None:
+    """
+    Streaming variant of arg_based_conversion for very large Markdown files.
+
+    The input is read twice line by line (once to hash it and collect link
+    reference definitions, once to convert it) and the HTML is written as
+    each chunk is rendered, so memory use is bounded by the chunk size
+    rather than the document size.
+
+    Args:
+        args: Parsed command-line arguments, as for arg_based_conversion
+        stdout: Stream for an output_file of '-' (default: sys.stdout)
+    """
+    if args.input_file == STDIO_PATH:
+        print("Error: --stream reads its input twice and needs a file, not standard input.")
+        return
+    try:
+        encoding = stream_encoding(args.input_file, args.input_encoding)
+        md_hash, references = scan_markdown_file(args.input_file, encoding)
+    except FileNotFoundError:
+        print(f"Error: Input file '{args.input_file}' not found.")
+        return
+    except Exception as e:
+        print(f"Error reading input file: {e}")
+        return
+
+    light_mode = args.mode.lower() != 'dark'
+    css_content = resolve_css_content(args.css_file, light_mode)
+    to_stdout = args.output_file == STDIO_PATH
+    output_path = os.path.join(args.output_dir, 'index.html' if to_stdout else args.output_file)
+
+    if args.incremental and not to_stdout:
+        manifest = load_manifest(args.output_dir)
+        key = manifest_key(output_path, args.output_dir)
+        entry = build_manifest_entry(None, hash_content(css_content), light_mode, args.engine,
+                                     dict(output_options(args), stream=True), input_hash=md_hash)
+        if manifest.get(key) == entry and os.path.isfile(output_path):
+            print(f"Output is up to date: {output_path}")
+            return
+
+    options = pipeline_options(args)
+    if options.enabled('highlight'):
+        warm_theme_css([css_content], cache_dir=args.cache_dir)
+    asset_refs = None
+    if args.assets == 'external':
+        assets = shared_assets_from_args(args, css_content)
+        asset_refs = get_asset_refs(assets, output_path)
+
+    temp_path = None
+    try:
+        if not to_stdout:
+            # Written next to the output and renamed over it once complete (see write_html_file)
+            temp_path = _prepare_output_file(output_path)
+        with open(args.input_file, 'r', encoding=encoding) as md_file, \
+                (contextlib.nullcontext(stdout or sys.stdout) if to_stdout
+                 else open(temp_path, 'w', encoding='utf-8', buffering=STREAM_CHUNK_SIZE)) as html_file:
+            convert_stream(md_file, html_file, css_content, light_mode=light_mode,
+                           engine=args.engine, asset_refs=asset_refs, references=references,
+                           highlight_jobs=args.highlight_jobs, options=options)
+        if to_stdout:
+            return
+        written = commit_output_file(temp_path, output_path)
+        if args.precompress and (written or not os.path.exists(output_path + '.gz')):
+            precompress_file(output_path)
+        print(f"Markdown converted to HTML successfully! Output saved to {output_path}"
+              + ("" if written else " (unchanged)"))
+    except Exception as e:
+        print(f"Error writing output file: {e}")
+        return
+    finally:
+        # Already renamed away on success; left behind by errors and Ctrl+C otherwise
+        if temp_path:
+            with contextlib.suppress(OSError):
+                os.unlink(temp_path)
+
+    if args.incremental:
+        manifest[key] = entry
+        save_manifest(args.output_dir, manifest)
+
+
+MARKDOWN_SUFFIXES = ('.md', '.markdown')
+_GLOB_MAGIC_RE = re.compile(r'[*?[]')
+
+# Per-process batch settings, populated once per worker by _init_batch_worker
+_batch_settings = {}
+
+
+def is_batch_input(source: str) -> bool:
+    """
+    Check whether an --input_file value refers to a directory or glob pattern.
+
+    Args:
+        source: Value passed to --input_file
+
+    Returns:
+        True if the source should be converted in batch mode
+    """
+    return os.path.isdir(source) or _GLOB_MAGIC_RE.search(source) is not None
+
+
+def find_markdown_files(source: str) -> Tuple[str, List[str]]:
+    """
+    Expand a directory or glob pattern into the Markdown files it contains.
+
+    Only files with a MARKDOWN_SUFFIXES suffix are included, whether found by
+    walking a directory or by matching a pattern.
+
+    Args:
+        source: Directory to walk recursively, or a glob pattern (``**`` is supported)
+
+    Returns:
+        Tuple of (root directory used to mirror the tree, sorted list of file paths)
+    """
+    if os.path.isdir(source):
+        md_files = []
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(MARKDOWN_SUFFIXES):
+                    md_files.append(os.path.join(dirpath, filename))
+        return source, md_files
+
+    # Root is the leading part of the pattern without any wildcards
+    root_parts = []
+    for part in source.replace('\\', '/').split('/'):
+        if _GLOB_MAGIC_RE.search(part):
+            break
+        root_parts.append(part)
+    root = '/'.join(root_parts) or '.'
+    md_files = sorted(path for path in glob.glob(source, recursive=True)
+                      if path.lower().endswith(MARKDOWN_SUFFIXES) and os.path.isfile(path))
+    return root, md_files
+
+
+def batch_output_path(md_path: str, source_root: str, output_dir: str) -> str:
+    """
+    Map an input Markdown file to its output path, mirroring the source tree.
+
+    Args:
+        md_path: Path to the input Markdown file
+        source_root: Root directory of the batch input
+        output_dir: Directory where the mirrored tree is written
+
+    Returns:
+        Path of the output HTML file
+    """
+    relative_path = os.path.relpath(md_path, source_root)
+    return os.path.join(output_dir, os.path.splitext(relative_path)[0] + '.html')
+
+
+def convert_file(md_path: str, output_path: str, css_content: Optional[str] = None,
+                 light_mode: bool = True, previous_entry: Optional[dict] = None,
+                 css_hash: Optional[str] = None, engine: str = 'soup', assets: Optional[dict] = None,
+                 options: Optional[dict] = None, converter: Optional[Converter] = None,
+                 site_nav: Optional[str] = None, md_text: Optional[str] = None) -> Tuple[dict, bool]:
+    """
+    Convert a single Markdown file to a complete HTML5 document on disk.
+
+    Unlike load_markdown_file, errors are raised rather than printed so that
+    callers converting many files can collect and report them.
+
+    Args:
+        md_path: Path to the input Markdown file
+        output_path: Path of the output HTML file (parent directories are created)
+        css_content: Optional CSS string to include in style tag
+        light_mode: Use light theme for syntax highlighting (default: True)
+        previous_entry: Manifest entry recorded for output_path by an earlier run;
+            conversion is skipped when it still matches and the output exists
+        css_hash: Precomputed hash of css_content (computed here if omitted)
+        engine: Rendering engine ('soup' or 'tree')
+        assets: Optional shared assets from write_shared_assets to link instead of embedding
+        options: Other output-affecting settings recorded in the manifest entry
+        converter: Converter to reuse; it must match css_content, light_mode, engine,
+            assets and site_nav (a new one is created from them if omitted)
+        site_nav: Path of the site navigation script to link; the entry then also
+            records the page outline under 'page' (see Converter.outline)
+        md_text: Markdown already read from md_path (see read_markdown_files); the
+            file is read here if omitted
+
+    Returns:
+        Tuple of (manifest entry for the output, True if the file was written)
+    """
+    if md_text is None:
+        md_text = read_markdown_file(md_path)
+
+    if css_hash is None:
+        css_hash = hash_content(css_content or '')
+    entry = build_manifest_entry(md_text, css_hash, light_mode, engine, options)
+    if previous_entry is not None and os.path.isfile(output_path):
+        # The outline only depends on the inputs the rest of the entry covers
+        previous_page = previous_entry.get('page')
+        if dict(previous_entry, page=None) == dict(entry, page=None) and (previous_page or not site_nav):
+            return previous_entry, False
+
+    if converter is None:
+        converter = Converter('light' if light_mode else 'dark', css_content, engine=engine, assets=assets,
+                              site_nav=site_nav, **_converter_options(options))
+    write_html_file(output_path, converter.convert(md_text, document_path=output_path),
+                    converter.options.precompress)
+    if site_nav:
+        entry['page'] = converter.outline()
+    return entry, True
+
+
+def _init_batch_worker(settings: dict) -> None:
+    """
+    Store settings shared by every file a batch worker converts, and create its Converter.
+
+    Args:
+        settings: Dictionary with css_content, light_mode, engine, cache_dir, highlight_cache_bytes,
+            input_encoding, assets, options and site_nav
+    """
+    _batch_settings.update(settings)
+    if settings['cache_dir']:
+        enable_highlight_cache(settings['cache_dir'], settings['highlight_cache_bytes'])
+    # Reused for every file this worker converts; building it also pre-builds the theme CSS
+    _batch_settings['converter'] = converter = Converter(
+        'light' if settings['light_mode'] else 'dark', settings['css_content'], engine=settings['engine'],
+        assets=settings['assets'], cache_dir=settings['cache_dir'], site_nav=settings['site_nav'],
+        **_converter_options(settings['options']))
+    _batch_settings['css_hash'] = converter.css_hash
+
+
+def _convert_batch_item(task: Tuple[str, str, Optional[dict]],
+                        md_text: Union[str, Exception]) -> Tuple[Optional[str], Optional[dict], bool]:
+    """
+    Convert one batch entry inside a worker.
+
+    Args:
+        task: Tuple of (input Markdown path, output HTML path, previous manifest entry or None)
+        md_text: Markdown read from the input path, or the error reading it raised
+
+    Returns:
+        Tuple of (error message or None, manifest entry or None, True if the file was written)
+    """
+    md_path, output_path, previous_entry = task
+    try:
+        if isinstance(md_text, Exception):
+            raise md_text
+        entry, written = convert_file(md_path, output_path, _batch_settings['css_content'],
+                                      _batch_settings['light_mode'], previous_entry,
+                                      _batch_settings['css_hash'], _batch_settings['engine'],
+                                      _batch_settings['assets'], _batch_settings['options'],
+                                      _batch_settings['converter'], _batch_settings['site_nav'], md_text)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}", None, False
+    return None, entry, written
+
+
+def _convert_batch_items(tasks: List[Tuple[str, str, Optional[dict]]]) -> Iterator[tuple]:
+    """Convert batch entries in order inside a worker, reading the next inputs while converting.
+
+    Returns:
+        Iterator of _convert_batch_item results
+    """
+    md_texts = read_markdown_files((md_path for md_path, _, _ in tasks), _batch_settings['input_encoding'])
+    for task, (_, md_text) in zip(tasks, md_texts):
+        yield _convert_batch_item(task, md_text)
+
+
+def _convert_batch_chunk(tasks: List[Tuple[str, str, Optional[dict]]]) -> List[tuple]:
+    """Convert a chunk of batch entries in a pool worker (see _convert_batch_items)."""
+    return list(_convert_batch_items(tasks))
+
+
+def batch_conversion(args) -> int:
+    """
+    Convert every Markdown file under a directory or glob over a process pool.
+
+    The source tree is mirrored into --output_dir. A failing file is reported
+    and skipped; the rest of the batch keeps going.
+
+    Args:
+        args: Parsed command-line arguments containing:
+            - input_file: Directory or glob pattern of Markdown files
+            - output_dir: Directory where the mirrored tree is written
+            - css_file: Optional custom CSS file path
+            - mode: 'light' or 'dark' theme mode
+            - engine: Rendering engine ('soup' or 'tree')
+            - cache_dir: Optional directory for persistent caches
+            - highlight_cache_mb: Size bound of the highlight cache in cache_dir, in MB
+            - assets: 'inline' to embed CSS/JS, 'external' to link shared asset files
+            - integrity: Add Subresource Integrity attributes to external assets
+            - jobs: Number of worker processes (0 means one per CPU)
+            - incremental: Skip files whose manifest entry shows nothing changed
+            - site: Also write a navigation index of all pages and link it from each one
+
+    Returns:
+        Number of files that failed to convert, or 1 if no Markdown files were found
+    """
+    source_root, md_files = find_markdown_files(args.input_file)
+    if not md_files:
+        print(f"Error: No Markdown files found in '{args.input_file}'.")
+        return 1
+
+    light_mode = args.mode.lower() != 'dark'
+    css_content = resolve_css_content(args.css_file, light_mode)
+    manifest = load_manifest(args.output_dir) if args.incremental else {}
+    tasks = []
+    for md_path in md_files:
+        output_path = batch_output_path(md_path, source_root, args.output_dir)
+        tasks.append((md_path, output_path, manifest.get(manifest_key(output_path, args.output_dir))))
+
+    settings = {
+        'css_content': css_content,
+        'light_mode': light_mode,
+        'engine': args.engine,
+        'cache_dir': args.cache_dir,
+        'highlight_cache_bytes': args.highlight_cache_mb << 20,
+        'input_encoding': args.input_encoding,
+        'options': output_options(args),
+        # Shared assets are written once here, before any worker starts
+        'assets': (shared_assets_from_args(args, css_content)
+                   if args.assets == 'external' else None),
+        # Linked now, written once every page's outline is known
+        'site_nav': os.path.join(args.output_dir, SITE_NAV_FILE) if args.site else None,
+    }
+
+    jobs = min(args.jobs or os.cpu_count() or 1, len(tasks))
+    if _profiler is not None and jobs > 1:
+        # Timings are collected per process, so profile the batch in this one
+        print("Profiling: converting in a single process.")
+        jobs = 1
+    print(f"Converting {len(tasks)} files with {jobs} worker(s)...")
+    start_time = time.perf_counter()
+
+    if jobs == 1:
+        _init_batch_worker(settings)
+        results = _convert_batch_items(tasks)
+        failures, skipped = _report_batch_results(tasks, results, manifest, args.output_dir)
+    else:
+        # Hand out work in chunks so per-task IPC overhead stays small for many tiny files,
+        # and each worker reads a chunk's inputs ahead while converting
+        chunksize = max(1, len(tasks) // (jobs * 8))
+        chunks = [tasks[index:index + chunksize] for index in range(0, len(tasks), chunksize)]
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                                 initargs=(settings,)) as executor:
+            results = itertools.chain.from_iterable(executor.map(_convert_batch_chunk, chunks))
+            failures, skipped = _report_batch_results(tasks, results, manifest, args.output_dir)
+
+    if args.site:
+        pages = [(key, manifest[key].get('page')) for key in
+                 (manifest_key(output_path, args.output_dir) for _, output_path, _ in tasks) if key in manifest]
+        write_site_index(args.output_dir, pages, minify=args.minify, precompress=args.precompress)
+    if args.incremental:
+        save_manifest(args.output_dir, manifest)
+
+    elapsed = time.perf_counter() - start_time
+    converted = len(tasks) - failures - skipped
+    print(f"Converted {converted} of {len(tasks)} files in {elapsed:.2f}s "
+          f"({skipped} up to date, {failures} failed). Output saved to {args.output_dir}")
+    return failures
+
+
+def _report_batch_results(tasks: List[Tuple[str, str, Optional[dict]]],
+                          results: Iterable[Tuple[Optional[str], Optional[dict], bool]],
+                          manifest: dict, output_dir: str) -> Tuple[int, int]:
+    """
+    Print an error line for each failed batch entry and record successes in the manifest.
+
+    Returns:
+        Tuple of (failure count, count of files skipped as up to date)
+    """
+    failures = 0
+    skipped = 0
+    for (md_path, output_path, _), (error, entry, written) in zip(tasks, results):
+        key = manifest_key(output_path, output_dir)
+        if error is not None:
+            failures += 1
+            # Forget failed outputs so the next incremental run retries them
+            manifest.pop(key, None)
+            print(f"Error converting '{md_path}': {error}")
+            continue
+        if not written:
+            skipped += 1
+        manifest[key] = entry
+    return failures, skipped
+
+
+# Site build (--site): one navigation index for every page of a batch
+SITE_NAV_FILE = 'site-nav.js'
+SITE_INDEX_FILE = 'site-index.json'
+# Deepest heading level recorded for each page
+SITE_NAV_MAX_LEVEL = 3
+
+# Renders the index as a collapsible, filterable page list at the top of the body.
+# The index data is appended as the argument of the outer function.
+SITE_NAV_SCRIPT_LINES = [
+    '(function (pages) {',
+    '    // Links are relative to this script, which sits at the root of the site',
+    '    var root = new URL(".", document.currentScript.src).href;',
+    '    var here = location.href.split("#")[0];',
+    '',
+    '    function element(tag, className, text) {',
+    '        var node = document.createElement(tag);',
+    '        if (className) node.className = className;',
+    '        if (text) node.textContent = text;',
+    '        return node;',
+    '    }',
+    '',
+    '    function directoryList(lists, directory) {',
+    '        if (lists[directory]) return lists[directory];',
+    '        var parent = directory.slice(0, directory.lastIndexOf("/", directory.length - 2) + 1);',
+    '        var item = element("li", "site-nav-directory", directory.slice(parent.length, -1));',
+    '        var list = element("ul");',
+    '        item.appendChild(list);',
+    '        directoryList(lists, parent).appendChild(item);',
+    '        return lists[directory] = list;',
+    '    }',
+    '',
+    '    function buildSiteNav() {',
+    '        var style = element("style", null, ".site-nav{margin-bottom:2rem;font-size:.9rem}"',
+    '            + ".site-nav ul{list-style:none;margin:.25rem 0;padding-left:1rem}"',
+    '            + ".site-nav input{box-sizing:border-box;width:100%;margin:.5rem 0;padding:.25rem .5rem}"',
+    '            + ".site-nav [aria-current=page]{font-weight:600}"',
+    '            + ".site-nav-directory{color:var(--text-secondary)}");',
+    '        document.head.appendChild(style);',
+    '        var nav = element("nav", "site-nav");',
+    '        nav.setAttribute("aria-label", "Site");',
+    '        var details = element("details");',
+    '        details.appendChild(element("summary", null, "Pages"));',
+    '        var filter = element("input");',
+    '        filter.type = "search";',
+    '        filter.placeholder = "Filter pages";',
+    '        filter.setAttribute("aria-label", "Filter pages");',
+    '        details.appendChild(filter);',
+    '        var lists = {"": element("ul")};',
+    '        details.appendChild(lists[""]);',
+    '        var items = [];',
+    '        pages.forEach(function (page) {',
+    '            var path = page[0], href = root + path;',
+    '            var item = element("li");',
+    '            var link = element("a", null, page[1]);',
+    '            link.href = href;',
+    '            item.appendChild(link);',
+    '            item.dataset.search = (page[1] + " " + page[2].map(function (h) { return h[2]; }).join(" "))',
+    '                .toLowerCase();',
+    '            if (href === here) {',
+    '                link.setAttribute("aria-current", "page");',
+    '                var headings = element("ul");',
+    '                page[2].forEach(function (heading) {',
+    '                    var entry = element("li");',
+    '                    var anchor = element("a", null, heading[2]);',
+    '                    anchor.href = "#" + heading[1];',
+    '                    entry.style.paddingLeft = (heading[0] - 2) + "rem";',
+    '                    entry.appendChild(anchor);',
+    '                    headings.appendChild(entry);',
+    '                });',
+    '                if (page[2].length) item.appendChild(headings);',
+    '            }',
+    '            directoryList(lists, path.slice(0, path.lastIndexOf("/") + 1)).appendChild(item);',
+    '            items.push(item);',
+    '        });',
+    '        filter.addEventListener("input", function () {',
+    '            var query = filter.value.trim().toLowerCase();',
+    '            items.forEach(function (item) {',
+    '                item.hidden = query !== "" && item.dataset.search.indexOf(query) < 0;',
+    '            });',
+    '        });',
+    '        nav.appendChild(details);',
+    '        document.body.insertBefore(nav, document.getElementById("main-content"));',
+    '    }',
+    '',
+    '    if (document.readyState === "loading") {',
+    '        document.addEventListener("DOMContentLoaded", buildSiteNav);',
+    '    } else {',
+    '        buildSiteNav();',
+    '    }',
+]
+
+
+def page_outline(toc_tokens: List[dict]) -> dict:
+    """
+    Flatten the heading tree of the toc extension into a page title and heading list.
+
+    Args:
+        toc_tokens: The toc_tokens attribute of a Markdown instance after a conversion
+
+    Returns:
+        Dictionary with 'title' (text of the first level 1 heading, or of the first
+        heading if there is none; None without headings) and 'headings' (list of
+        [level, id, text] for the other headings up to SITE_NAV_MAX_LEVEL)
+    """
+    headings = []
+    pending = list(reversed(toc_tokens))
+    while pending:
+        token = pending.pop()
+        if token['level'] <= SITE_NAV_MAX_LEVEL:
+            headings.append([token['level'], token['id'], unescape(token['name'])])
+            pending.extend(reversed(token['children']))
+    title_index = next((index for index, heading in enumerate(headings) if heading[0] == 1), 0)
+    title = headings.pop(title_index)[2] if headings else None
+    return {'title': title, 'headings': headings}
+
+
+def build_site_index(pages: Iterable[Tuple[str, Optional[dict]]]) -> List[list]:
+    """
+    Build the compact navigation index of a site.
+
+    Args:
+        pages: (path relative to the site root, outline from page_outline or None)
+            for every page, in navigation order
+
+    Returns:
+        List of [path, title, headings] per page; pages without a title are named
+        after their file
+    """
+    index = []
+    for path, outline in pages:
+        outline = outline or {}
+        title = outline.get('title') or os.path.splitext(path.rsplit('/', 1)[-1])[0]
+        index.append([path, title, outline.get('headings', [])])
+    return index
+
+
+def write_site_index(output_dir: str, pages: Iterable[Tuple[str, Optional[dict]]], minify: bool = False,
+                     precompress: bool = False) -> List[str]:
+    """
+    Write the navigation index of a site as JSON and as the script pages link to.
+
+    Pages only reference SITE_NAV_FILE, so it can be written after all of them
+    and a page whose outline did not change never has to be rewritten.
+
+    Args:
+        output_dir: Root directory of the site
+        pages: Pages in navigation order (see build_site_index)
+        minify: Minify the navigation script
+        precompress: Also write compressed siblings (see precompress_file)
+
+    Returns:
+        Paths of the navigation script and the JSON index
+    """
+    data = json.dumps(build_site_index(pages), ensure_ascii=False, separators=(',', ':'))
+    script = '\n'.join(SITE_NAV_SCRIPT_LINES + [f'}})({data});', ''])
+    nav_path = os.path.join(output_dir, SITE_NAV_FILE)
+    index_path = os.path.join(output_dir, SITE_INDEX_FILE)
+    write_html_file(nav_path, minify_js(script) if minify else script, precompress)
+    write_html_file(index_path, data + '\n', precompress)
+    return [nav_path, index_path]
+
+
+# Quiet period that ends a burst of file events, and the longest a burst may delay a rebuild
+WATCH_DEBOUNCE_SECONDS = 0.03
+WATCH_MAX_DELAY_SECONDS = 0.5
+# mtime polling interval when inotify is unavailable
+WATCH_POLL_INTERVAL_SECONDS = 0.1
+
+# inotify event bits (see inotify(7))
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_INOTIFY_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_INOTIFY_EVENT_HEADER = 16
+
+
+class InotifyWatcher:
+    """
+    Report changed files using Linux inotify (through ctypes, no extra dependency).
+
+    Directories are watched rather than files, so editors that save by
+    writing a temporary file and renaming it over the original are seen too.
+    """
+
+    def __init__(self, directories: Iterable[Tuple[str, bool]], is_relevant) -> None:
+        """
+        Args:
+            directories: (directory, recursive) pairs to watch
+            is_relevant: Callable taking an absolute path and returning True if
+                changes to it should be reported
+
+        Raises:
+            OSError: If inotify is not available on this system
+        """
+        import ctypes
+        import ctypes.util
+
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        # IN_NONBLOCK and IN_CLOEXEC have the values of O_NONBLOCK and O_CLOEXEC
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.is_relevant = is_relevant
+        self.directories = {}
+        self.recursive_roots = []
+        for directory, recursive in directories:
+            if recursive:
+                self.recursive_roots.append(os.path.abspath(directory))
+                self.add_tree(directory)
+            else:
+                self.add_directory(directory)
+
+    def add_directory(self, directory: str) -> None:
+        """Start watching one directory."""
+        import ctypes
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), _INOTIFY_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        self.directories[wd] = os.path.abspath(directory)
+
+    def add_tree(self, root: str) -> List[str]:
+        """Watch a directory and all of its subdirectories; return the files found in them."""
+        files = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            self.add_directory(dirpath)
+            files.extend(os.path.abspath(os.path.join(dirpath, filename)) for filename in filenames)
+        return files
+
+    def wait(self) -> Optional[set]:
+        """
+        Block until relevant files change, then collect the rest of the burst.
+
+        Returns:
+            Set of changed absolute paths, or None if the kernel dropped events
+            and everything must be treated as changed
+        """
+        import select
+
+        changed = set()
+        overflow = False
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.0, min(WATCH_DEBOUNCE_SECONDS, deadline - time.monotonic()))
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if ready:
+                overflow = self.read_events(changed) or overflow
+                if (changed or overflow) and deadline is None:
+                    deadline = time.monotonic() + WATCH_MAX_DELAY_SECONDS
+                if deadline is None or time.monotonic() < deadline:
+                    continue
+            if changed or overflow:
+                return None if overflow else changed
+
+    def read_events(self, changed: set) -> bool:
+        """Add the relevant paths from pending events to changed; return True on queue overflow."""
+        overflow = False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset + _INOTIFY_EVENT_HEADER <= len(data):
+            wd = int.from_bytes(data[offset:offset + 4], sys.byteorder, signed=True)
+            mask = int.from_bytes(data[offset + 4:offset + 8], sys.byteorder)
+            name_length = int.from_bytes(data[offset + 12:offset + 16], sys.byteorder)
+            name = os.fsdecode(data[offset + 16:offset + 16 + name_length].rstrip(b'\0'))
+            offset += _INOTIFY_EVENT_HEADER + name_length
+
+            if mask & _IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            directory = self.directories.get(wd)
+            if mask & _IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & _IN_ISDIR:
+                # A directory created or moved into a watched tree may already contain files
+                if mask & (_IN_CREATE | _IN_MOVED_TO) and self.in_recursive_root(path):
+                    try:
+                        changed.update(p for p in self.add_tree(path) if self.is_relevant(p))
+                    except OSError:
+                        pass
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM) and self.in_recursive_root(path):
+                    # Files moved away with their directory produce no events of their own
+                    changed.add(path)
+                continue
+            if self.is_relevant(path):
+                changed.add(path)
+        return overflow
+
+    def in_recursive_root(self, path: str) -> bool:
+        """Return True if path lies in a tree that is watched recursively."""
+        return any(path == root or path.startswith(root + os.sep) for root in self.recursive_roots)
+
+    def close(self) -> None:
+        """Stop watching and release the inotify descriptor."""
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Report changed files by polling modification times; works on every platform."""
+
+    def __init__(self, list_paths, interval: float = WATCH_POLL_INTERVAL_SECONDS) -> None:
+        """
+        Args:
+            list_paths: Callable returning the paths to check, called on every poll
+                so that new files are picked up
+            interval: Seconds between polls
+        """
+        self.list_paths = list_paths
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self) -> dict:
+        """Map each watched path that exists to its (mtime_ns, size)."""
+        snapshot = {}
+        for path in self.list_paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[os.path.abspath(path)] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self) -> Optional[set]:
+        """
+        Block until watched files change and stop changing.
+
+        Returns:
+            Set of changed (including added and removed) absolute paths
+        """
+        changed = set()
+        deadline = None
+        while True:
+            time.sleep(self.interval)
+            snapshot = self.take_snapshot()
+            difference = {path for path in snapshot.keys() | self.snapshot.keys()
+                          if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            changed |= difference
+            if changed and deadline is None:
+                deadline = time.monotonic() + WATCH_MAX_DELAY_SECONDS
+            # A poll without further changes ends the burst
+            if changed and (not difference or time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+def watch_conversion(args) -> None:
+    """
+    Convert the input, then keep outputs up to date as sources change.
+
+    Each Markdown change re-renders only its own output. Rendered bodies are
+    kept in memory, so a stylesheet change rebuilds the theme CSS bundle and
+    rewrites the pages around the cached bodies without converting or
+    highlighting anything again. With --site, page outlines are kept too and
+    the navigation index is rewritten after every rebuild.
+
+    Args:
+        args: Parsed command-line arguments, as for arg_based_conversion and batch_conversion
+    """
+    light_mode = args.mode.lower() != 'dark'
+    batch = is_batch_input(args.input_file)
+    site_nav = os.path.join(args.output_dir, SITE_NAV_FILE) if batch and args.site else None
+    css_path = os.path.abspath(args.css_file or ('style_light.css' if light_mode else 'style_dark.css'))
+
+    def find_targets() -> dict:
+        if batch:
+            source_root, md_files = find_markdown_files(args.input_file)
+            return {os.path.abspath(md_path): batch_output_path(md_path, source_root, args.output_dir)
+                    for md_path in md_files}
+        return {os.path.abspath(args.input_file): os.path.join(args.output_dir, args.output_file)}
+
+    def create_converter() -> Converter:
+        css_content = resolve_css_content(args.css_file, light_mode)
+        assets = None
+        if args.assets == 'external':
+            assets = shared_assets_from_args(args, css_content)
+        return Converter('light' if light_mode else 'dark', css_content, engine=args.engine, assets=assets,
+                         cache_dir=args.cache_dir, highlight_jobs=args.highlight_jobs, site_nav=site_nav,
+                         **_converter_options(output_options(args)))
+
+    def render(md_path: str) -> bool:
+        try:
+            bodies[md_path] = converter.render(read_markdown_file(md_path, args.input_encoding))
+        except Exception as e:
+            bodies.pop(md_path, None)
+            print(f"Error converting '{md_path}': {e}")
+            return False
+        if site_nav:
+            outlines[md_path] = converter.outline()
+        return True
+
+    def write(md_path: str) -> None:
+        output_path = targets[md_path]
+        try:
+            write_html_file(output_path, converter.document(bodies[md_path], output_path),
+                           converter.options.precompress)
+        except Exception as e:
+            print(f"Error writing output file: {e}")
+
+    def write_index() -> None:
+        pages = [(manifest_key(output_path, args.output_dir), outlines[md_path])
+                 for md_path, output_path in targets.items() if md_path in bodies]
+        try:
+            write_site_index(args.output_dir, pages, minify=args.minify, precompress=args.precompress)
+        except Exception as e:
+            print(f"Error writing site index: {e}")
+
+    def is_relevant(path: str) -> bool:
+        if path == css_path or path in targets:
+            return True
+        return batch and path.endswith(MARKDOWN_SUFFIXES)
+
+    def list_watched_paths() -> List[str]:
+        return list(find_targets()) + [css_path]
+
+    start_time = time.perf_counter()
+    converter = create_converter()
+    targets = find_targets()
+    bodies = {}
+    outlines = {}
+    for md_path in targets:
+        if render(md_path):
+            write(md_path)
+    if site_nav:
+        write_index()
+    print(f"Converted {len(bodies)} of {len(targets)} file(s) in {time.perf_counter() - start_time:.2f}s. "
+          f"Output saved to {args.output_dir}")
+
+    if batch:
+        watch_root = args.input_file if os.path.isdir(args.input_file) else find_markdown_files(args.input_file)[0]
+        directories = [(watch_root, True)]
+    else:
+        directories = [(os.path.dirname(os.path.abspath(args.input_file)), False)]
+    css_directory = os.path.dirname(css_path)
+    if not any(os.path.abspath(directory) == css_directory for directory, _ in directories):
+        directories.append((css_directory, False))
+    try:
+        watcher = InotifyWatcher(directories, is_relevant)
+        method = 'inotify'
+    except (OSError, AttributeError):
+        watcher = PollingWatcher(list_watched_paths)
+        method = 'polling'
+    print(f"Watching for changes ({method}). Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            changed = watcher.wait()
+            start_time = time.perf_counter()
+            previous_targets = targets
+            targets = find_targets()
+            for md_path in list(bodies):
+                if md_path not in targets:
+                    del bodies[md_path]
+                    outlines.pop(md_path, None)
+            stale = [md_path for md_path in targets
+                     if changed is None or md_path in changed or md_path not in previous_targets]
+            rendered = [md_path for md_path in stale if render(md_path)]
+
+            if changed is None or css_path in changed:
+                # A new converter rebuilds the theme CSS bundle; every page is rewritten
+                # around its cached body without converting it again
+                converter = create_converter()
+                for md_path in bodies:
+                    write(md_path)
+                print(f"Rebuilt stylesheet and {len(bodies)} page(s), {len(rendered)} re-rendered, "
+                      f"in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+            elif stale:
+                for md_path in rendered:
+                    write(md_path)
+                print(f"Rebuilt {len(rendered)} of {len(stale)} page(s) "
+                      f"in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+            if site_nav and (stale or targets.keys() != previous_targets.keys()):
+                write_index()
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        watcher.close()
+
+
+# Languages whose lexers serve workers load up front
+SERVE_PRELOAD_LANGUAGES = ('text', 'python', 'javascript', 'typescript', 'bash', 'shell', 'json', 'yaml',
+                           'html', 'css', 'sql', 'java', 'c', 'cpp', 'go', 'rust')
+
+# Largest request body the conversion server accepts
+SERVE_MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+# Per-process serve settings, populated once per worker by _init_serve_worker
+_serve_settings = {}
+
+
+class LatencyStats:
+    """Thread-safe record of recent request latencies with percentile reporting."""
+
+    def __init__(self, window: int = 10000) -> None:
+        """
+        Args:
+            window: Number of most recent samples the percentiles are computed over
+        """
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float, error: bool = False) -> None:
+        """Record the latency of one request."""
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+            if error:
+                self.errors += 1
+
+    def summary(self) -> dict:
+        """
+        Summarize the recorded latencies.
+
+        Returns:
+            Dictionary with request and error counts, and p50/p90/p99/max
+            latencies in milliseconds over the sample window
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+            summary = {'requests': self.count, 'errors': self.errors, 'window': len(samples)}
+        for name, fraction in (('p50', 0.50), ('p90', 0.90), ('p99', 0.99), ('max', 1.0)):
+            # Nearest-rank percentile
+            index = max(0, int(-(-fraction * len(samples) // 1)) - 1)
+            summary[f'{name}_ms'] = round(samples[index] * 1000, 3) if samples else None
+        return summary
+
+
+def _init_serve_worker(settings: dict) -> None:
+    """
+    Warm a serve worker: pre-build the theme CSS for both modes and load common lexers.
+
+    Args:
+        settings: Dictionary with css (per-mode default CSS content), engine, cache_dir,
+            highlight_cache_bytes, options (see output_options) and worker_process
+            (True in pool processes, which leave Ctrl+C to the server)
+    """
+    if settings.get('worker_process'):
+        import signal
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _serve_settings.update(settings)
+    if settings['cache_dir']:
+        enable_highlight_cache(settings['cache_dir'], settings['highlight_cache_bytes'])
+    warm_theme_css(settings['css'].values(), cache_dir=settings['cache_dir'])
+    for language in SERVE_PRELOAD_LANGUAGES:
+        get_lexer(language)
+    # Create the default converters and run them once before the first request
+    for mode in ('light', 'dark'):
+        _serve_convert('# warm-up\n\n```python\npass\n```\n', mode, None, None)
+
+
+@functools.lru_cache(maxsize=32)
+def _serve_converter(mode: str, css_content: str, engine: str) -> Converter:
+    """Get this worker's Converter for one combination of request options."""
+    # Only the server's own stylesheets go to the disk cache; request CSS would pile up there
+    cache_dir = _serve_settings['cache_dir'] if css_content in _serve_settings['css'].values() else None
+    return Converter(mode, css_content, engine=engine, cache_dir=cache_dir,
+                     **_converter_options(_serve_settings['options']))
+
+
+def _serve_convert(md_text: str, mode: str, css_content: Optional[str], engine: Optional[str]) -> str:
+    """
+    Convert one server request to a complete HTML5 document inside a worker.
+
+    Args:
+        md_text: Markdown content to convert
+        mode: 'light' or 'dark'
+        css_content: Page CSS for this request, or None for the server default of the mode
+        engine: Rendering engine, or None for the server default
+
+    Returns:
+        Document as returned by add_custom_style
+    """
+    if css_content is None:
+        css_content = _serve_settings['css'][mode]
+    return _serve_converter(mode, css_content, engine or _serve_settings['engine']).convert(md_text)
+
+
+def parse_serve_request(body: bytes, content_type: str, query: dict, default_mode: str) -> dict:
+    """
+    Validate a conversion request.
+
+    A JSON body ({"markdown": ..., "mode": ..., "css": ..., "engine": ...})
+    carries the options itself; any other body is taken as the Markdown text
+    with options in the query string.
+
+    Args:
+        body: Raw request body
+        content_type: Content-Type header value
+        query: Parsed query string (name -> list of values)
+        default_mode: Mode used when the request does not name one
+
+    Returns:
+        Dictionary with markdown, mode, css and engine
+
+    Raises:
+        ValueError: If the request is malformed or names an unknown mode or engine
+    """
+    if content_type.split(';')[0].strip().lower() == 'application/json':
+        try:
+            request = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"invalid JSON body: {e}") from e
+        if not isinstance(request, dict) or not isinstance(request.get('markdown'), str):
+            raise ValueError("JSON body must be an object with a 'markdown' string")
+    else:
+        try:
+            request = {'markdown': body.decode('utf-8')}
+        except UnicodeDecodeError as e:
+            raise ValueError(f"body is not valid UTF-8: {e}") from e
+        for name in ('mode', 'css', 'engine'):
+            if name in query:
+                request[name] = query[name][-1]
+    return validate_conversion_request(request, default_mode)
+
+
+def validate_conversion_request(request: dict, default_mode: str) -> dict:
+    """
+    Validate the options of a decoded conversion request (see parse_serve_request).
+
+    Args:
+        request: Request object with a 'markdown' string and optional mode, css and engine
+        default_mode: Mode used when the request does not name one
+
+    Returns:
+        Dictionary with markdown, mode, css and engine
+
+    Raises:
+        ValueError: If markdown is missing or the request names an unknown mode or engine
+    """
+    if not isinstance(request.get('markdown'), str):
+        raise ValueError("request must have a 'markdown' string")
+    mode = (request.get('mode') or default_mode).lower()
+    if mode not in ('light', 'dark'):
+        raise ValueError(f"unknown mode '{mode}'")
+    engine = request.get('engine')
+    if engine is not None and engine not in ENGINES:
+        raise ValueError(f"unknown engine '{engine}'")
+    css_content = request.get('css')
+    if css_content is not None and not isinstance(css_content, str):
+        raise ValueError("'css' must be a string")
+    return {'markdown': request['markdown'], 'mode': mode, 'css': css_content, 'engine': engine}
+
+
+def create_server(executor, stats: LatencyStats, default_mode: str = 'light', host: str = '127.0.0.1',
+                  port: int = 8000, unix_socket: Optional[str] = None):
+    """
+    Create the HTTP conversion server.
+
+    Endpoints:
+        POST /convert  Markdown in, complete HTML5 document out
+        GET /stats     Request counts and latency percentiles as JSON
+        GET /health    Liveness check
+
+    Args:
+        executor: Executor whose workers were initialized with _init_serve_worker
+        stats: Latency recorder shared with the caller
+        default_mode: Mode used when a request does not name one
+        host: Interface to listen on (ignored with unix_socket)
+        port: TCP port to listen on; 0 picks a free port (ignored with unix_socket)
+        unix_socket: Optional path of a Unix domain socket to listen on instead of TCP
+
+    Returns:
+        Server instance; call serve_forever() to run it and shutdown() from another thread to stop it
+
+    Raises:
+        FileExistsError: If unix_socket names an existing file that is not a socket
+        OSError: If the address cannot be bound
+    """
+    import socket
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlsplit
+
+    class ConversionRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self) -> None:
+            path = urlsplit(self.path).path
+            if path == '/stats':
+                summary = stats.summary()
+                if _highlight_disk_cache is not None:
+                    summary['highlight_cache'] = _highlight_disk_cache.stats()
+                self.send_body(200, json.dumps(summary).encode('utf-8'), 'application/json')
+            elif path == '/health':
+                self.send_body(200, b'ok\n', 'text/plain; charset=utf-8')
+            else:
+                self.send_body(404, b'not found\n', 'text/plain; charset=utf-8')
+
+        def do_POST(self) -> None:
+            start_time = time.perf_counter()
+            url = urlsplit(self.path)
+            if url.path != '/convert':
+                self.send_body(404, b'not found\n', 'text/plain; charset=utf-8')
+                return
+            status, body, content_type = self.convert(url.query)
+            elapsed = time.perf_counter() - start_time
+            stats.record(elapsed, error=status != 200)
+            self.send_body(status, body, content_type, {'Server-Timing': f'convert;dur={elapsed * 1000:.3f}'})
+
+        def convert(self, query: str) -> Tuple[int, bytes, str]:
+            """Run one conversion and return (status, body, content type)."""
+            try:
+                length = int(self.headers.get('Content-Length', ''))
+            except ValueError:
+                return 411, b'Content-Length required\n', 'text/plain; charset=utf-8'
+            if length < 0:
+                # The body cannot be delimited, so the connection cannot be reused
+                self.close_connection = True
+                return 400, b'invalid Content-Length\n', 'text/plain; charset=utf-8'
+            if length > SERVE_MAX_REQUEST_BYTES:
+                self.close_connection = True
+                return 413, b'request body too large\n', 'text/plain; charset=utf-8'
+            try:
+                request = parse_serve_request(self.rfile.read(length), self.headers.get('Content-Type', ''),
+                                              parse_qs(query), default_mode)
+            except ValueError as e:
+                return 400, f"{e}\n".encode('utf-8'), 'text/plain; charset=utf-8'
+            try:
+                document = executor.submit(_serve_convert, request['markdown'], request['mode'],
+                                           request['css'], request['engine']).result()
+            except Exception as e:
+                return 500, f"{type(e).__name__}: {e}\n".encode('utf-8'), 'text/plain; charset=utf-8'
+            return 200, document.encode('utf-8'), 'text/html; charset=utf-8'
+
+        def send_body(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None) -> None:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def address_string(self) -> str:
+            # Unix socket peers have no address
+            return self.client_address[0] if self.client_address else unix_socket
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    class ConversionServer(ThreadingHTTPServer):
+        daemon_threads = True
+
+    if unix_socket is None:
+        return ConversionServer((host, port), ConversionRequestHandler)
+
+    class UnixConversionServer(ConversionServer):
+        address_family = socket.AF_UNIX
+
+        def server_bind(self) -> None:
+            # HTTPServer.server_bind expects a (host, port) address
+            socketserver.TCPServer.server_bind(self)
+            self.server_name = 'localhost'
+            self.server_port = 0
+
+    try:
+        mode = os.lstat(unix_socket).st_mode
+    except FileNotFoundError:
+        pass
+    else:
+        # Replace a socket left behind by an earlier server, but never another kind of file
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f"'{unix_socket}' exists and is not a socket")
+        os.unlink(unix_socket)
+    return UnixConversionServer(unix_socket, ConversionRequestHandler)
+
+
+def request_conversion(md_text: str, mode: Optional[str] = None, css_content: Optional[str] = None,
+                       host: str = '127.0.0.1', port: int = 8000, unix_socket: Optional[str] = None,
+                       timeout: float = 60.0) -> str:
+    """
+    Convert Markdown through a running conversion server (see create_server).
+
+    Args:
+        md_text: Markdown content to convert
+        mode: 'light' or 'dark', or None for the server default
+        css_content: Optional page CSS overriding the server default
+        host: Server host
+        port: Server TCP port
+        unix_socket: Optional Unix domain socket path to connect to instead of TCP
+        timeout: Socket timeout in seconds
+
+    Returns:
+        Complete HTML5 document
+
+    Raises:
+        RuntimeError: If the server answers with an error status
+    """
+    import http.client
+    import socket
+
+    if unix_socket is None:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    else:
+        connection = http.client.HTTPConnection('localhost', timeout=timeout)
+        connection.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.sock.settimeout(timeout)
+        connection.sock.connect(unix_socket)
+
+    request = {'markdown': md_text, 'mode': mode, 'css': css_content}
+    try:
+        connection.request('POST', '/convert', body=json.dumps(request).encode('utf-8'),
+                           headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        body = response.read().decode('utf-8')
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"Server returned {response.status}: {body.strip()}")
+    return body
+
+
+def serve_settings(args) -> dict:
+    """
+    Collect the settings of conversion workers (see _init_serve_worker) from command-line arguments.
+
+    Args:
+        args: Parsed command-line arguments (see serve)
+
+    Returns:
+        Settings dictionary for _init_serve_worker
+    """
+    return {
+        'css': {'light': resolve_css_content(args.css_file, True),
+                'dark': resolve_css_content(args.css_file, False)},
+        'engine': args.engine,
+        'cache_dir': args.cache_dir,
+        'highlight_cache_bytes': args.highlight_cache_mb << 20,
+        # Responses are never written to disk, so there is nothing to precompress
+        'options': dict(output_options(args), precompress=False),
+    }
+
+
+def serve(args) -> int:
+    """
+    Run the conversion server until interrupted.
+
+    Args:
+        args: Parsed command-line arguments containing:
+            - host, port: TCP address to listen on
+            - socket: Optional Unix domain socket path to listen on instead
+            - jobs: Number of worker processes (0 = one per CPU)
+            - mode: Default theme mode for requests that do not name one
+            - css_file: Optional custom CSS file path used as the default stylesheet
+            - engine: Default rendering engine
+            - cache_dir: Optional directory for persistent caches
+            - highlight_cache_mb: Size bound of the highlight cache in cache_dir, in MB
+
+    Returns:
+        1 if the server could not listen on its address, else 0
+    """
+    settings = serve_settings(args)
+    jobs = max(1, args.jobs or os.cpu_count() or 1)
+    default_mode = 'dark' if args.mode.lower() == 'dark' else 'light'
+    stats = LatencyStats()
+
+    if jobs == 1:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=1, initializer=_init_serve_worker, initargs=(settings,))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_serve_worker,
+                                       initargs=(dict(settings, worker_process=True),))
+    # Start and warm every worker before accepting requests
+    list(executor.map(time.sleep, [0] * jobs))
+
+    try:
+        server = create_server(executor, stats, default_mode, args.host, args.port, args.socket)
+    except OSError as e:
+        print(f"Error: Cannot listen on {args.socket or f'{args.host}:{args.port}'}: {e}")
+        executor.shutdown(cancel_futures=True)
+        return 1
+
+    def stop_on_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    # Shut down cleanly under service managers too, which stop servers with SIGTERM
+    import signal
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
+    address = args.socket or f"http://{server.server_address[0]}:{server.server_address[1]}"
+    print(f"Serving conversions on {address} with {jobs} worker(s). Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        executor.shutdown(cancel_futures=True)
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+        print(f"Server stopped. Latency: {json.dumps(stats.summary())}")
+    return 0
+
+
+def stdio_conversion(args, stdin: TextIO, stdout: TextIO) -> None:
+    """
+    Answer newline-delimited JSON conversion requests until standard input closes.
+
+    Every input line is a JSON object like a --serve JSON request plus an id:
+    {"id": ..., "markdown": ..., "mode": ..., "css": ..., "engine": ...}.
+    Every request gets one output line, in request order and flushed at once:
+    {"id": ..., "html": ...} on success or {"id": ..., "error": ...} on failure.
+    Blank lines are ignored.
+
+    Args:
+        args: Parsed command-line arguments (see serve); mode is the default theme mode
+        stdin: Stream the requests are read from
+        stdout: Stream the responses are written to
+    """
+    _init_serve_worker(serve_settings(args))
+    default_mode = 'dark' if args.mode.lower() == 'dark' else 'light'
+    for line in stdin:
+        if not line.strip():
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            request_id = request.get('id')
+            request = validate_conversion_request(request, default_mode)
+            response = {'id': request_id, 'html': _serve_convert(request['markdown'], request['mode'],
+                                                                 request['css'], request['engine'])}
+        except Exception as e:
+            response = {'id': request_id, 'error': f"{type(e).__name__}: {e}"}
+        stdout.write(json.dumps(response, ensure_ascii=False) + '\n')
+        stdout.flush()
+
+
+def main() -> None:
+    """
+    Main entry point for the MD2HTML converter.
+
+    Parses command-line arguments and routes to either argument-based
+    or interactive prompt-based conversion mode.
+    """
+    parser = argparse.ArgumentParser(description="Convert Markdown files to HTML.")
+    parser.add_argument("-i", "--input_file",
+                        help="Path to the input Markdown file, or a directory/glob pattern for batch mode. "
+                             "Use - to read standard input.")
+    parser.add_argument("-o", "--output_file", default="output.html",
+                        help="Name of the output HTML file. Use - to write to standard output.")
+    parser.add_argument("-d", "--output_dir", default=".", help="Directory where the output HTML file will be saved.")
+    parser.add_argument("-c", "--css_file", help="Path to a custom CSS file.")
+    parser.add_argument("--input_encoding", default=INPUT_ENCODING_AUTO,
+                        help="Encoding of the Markdown input. Default is auto: a byte order mark if there is one, "
+                             f"else UTF-8, else {LEGACY_INPUT_ENCODING}.")
+    parser.add_argument("-m", "--mode", default="light", help="Choose mode (light/dark). Default is light.")
+    parser.add_argument("-e", "--engine", choices=ENGINES, default="soup",
+                        help="Rendering engine: 'soup' re-parses output with BeautifulSoup, 'tree' renders "
+                             "in a single pass on the markdown ElementTree. Default is soup.")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="Number of worker processes for batch mode. Default is one per CPU.")
+    parser.add_argument("--highlight_jobs", type=int, default=1,
+                        help="Worker processes for highlighting the code blocks of a single large document. "
+                             "Default is 1 (no pool); batch mode already converts files in parallel.")
+    parser.add_argument("--assets", choices=("inline", "external"), default="inline",
+                        help="Embed CSS/JS in every page (inline) or write them once as content-hashed files "
+                             "in the output directory and link them (external). Default is inline.")
+    parser.add_argument("--integrity", action="store_true",
+                        help="Add Subresource Integrity (sha384) attributes to external asset references.")
+    parser.add_argument("--cache_dir",
+                        help="Directory for persistent caches shared across runs (e.g. the theme CSS bundle).")
+    parser.add_argument("--highlight_cache_mb", type=int, default=HIGHLIGHT_DISK_CACHE_BYTES >> 20,
+                        help="Size bound of the highlighted code cache kept in --cache_dir, in MB. "
+                             f"Default is {HIGHLIGHT_DISK_CACHE_BYTES >> 20}.")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"Skip outputs whose Markdown, CSS, mode and converter version are unchanged "
+                             f"(tracked in {MANIFEST_FILENAME} in the output directory).")
+    parser.add_argument("--heading_anchors", choices=HEADING_ANCHOR_MODES, default="client",
+                        help="Add heading IDs and anchor links in the browser (client) or at conversion "
+                             "time, leaving the anchor script out of the page (build). Default is client.")
+    parser.add_argument("--math_detection", choices=MATH_DETECTION_MODES, default="client",
+                        help="Decide whether to load MathJax in the browser (client) or at conversion time, "
+                             "so pages without math carry no math script (build). Default is client.")
+    parser.add_argument("--math_preload", action="store_true",
+                        help="With --math_detection build, add a preload hint for MathJax to pages with math.")
+    parser.add_argument("--icons", choices=ICON_MODES, default="inline",
+                        help="Write the copy-button icons into every code block (inline) or define them once "
+                             "per page and reference them with <use> (sprite). Default is inline.")
+    parser.add_argument("--minify", action="store_true",
+                        help="Collapse whitespace outside <pre>, minify the embedded CSS and JavaScript and "
+                             "replace repeated SVG icons with references to one copy.")
+    parser.add_argument("--precompress", action="store_true",
+                        help="Also write .gz (and, if the brotli package is installed, .br) copies of every "
+                             "output file for static hosting.")
+    parser.add_argument("--disable_stage", action="append", choices=PIPELINE_STAGES, default=[],
+                        help="Turn off a processing stage, leaving its markup, script and CSS out of the output; "
+                             "repeat to turn off several.")
+    parser.add_argument("--site", action="store_true",
+                        help=f"In batch mode, also write a navigation index of every page's title and headings "
+                             f"({SITE_NAV_FILE} and {SITE_INDEX_FILE}) and link it from every page.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Convert a single large file chunk by chunk, writing HTML as it goes instead of "
+                             "holding the whole document in memory.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Convert, then re-render outputs whenever the input or CSS files change.")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="JSON_FILE",
+                        help="Report per-stage timings, call counts, bytes and code blocks per language: "
+                             "as a table, or as JSON if a file name is given.")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run a local HTTP conversion server with a warm worker pool instead of converting files.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface for --serve. Default is 127.0.0.1.")
+    parser.add_argument("--port", type=int, default=8000, help="TCP port for --serve. Default is 8000.")
+    parser.add_argument("--socket", help="Serve on this Unix domain socket path instead of TCP.")
+    parser.add_argument("--stdio", action="store_true",
+                        help="Read newline-delimited JSON requests ({id, markdown, mode}) from standard input "
+                             "and write one JSON response per line to standard output until input ends.")
+
+    args = parser.parse_args()
+    if args.input_encoding != INPUT_ENCODING_AUTO:
+        try:
+            codecs.lookup(args.input_encoding)
+        except LookupError:
+            parser.error(f"unknown input encoding '{args.input_encoding}'")
+
+    # When standard output carries documents, messages go to standard error instead
+    data_output = sys.stdout
+    pipe_output = args.stdio or args.output_file == STDIO_PATH
+    if pipe_output:
+        for stream in (sys.stdin, sys.stdout):
+            if hasattr(stream, 'reconfigure'):
+                stream.reconfigure(encoding='utf-8')
+        with contextlib.redirect_stdout(sys.stderr):
+            run_conversion(args, data_output)
+    else:
+        print_logo()
+        run_conversion(args, data_output)
+
+
+def run_conversion(args, data_output: TextIO) -> None:
+    """
+    Run the conversion mode selected by parsed command-line arguments (see main).
+
+    Args:
+        args: Parsed command-line arguments
+        data_output: Standard output stream for --stdio responses and an output_file of '-'
+    """
+    profiler = enable_profiling() if args.profile else None
+    highlight_cache = None
+    if args.cache_dir:
+        highlight_cache = enable_highlight_cache(args.cache_dir, args.highlight_cache_mb << 20)
+        cache_stats = highlight_cache.stats()
+        # Worker processes open their own connections
+        highlight_cache.close()
+    failures = 0
+    if args.serve:
+        failures = serve(args)
+    elif args.stdio:
+        stdio_conversion(args, sys.stdin, data_output)
+    elif args.watch and STDIO_PATH in (args.input_file, args.output_file):
+        print("Error: --watch needs an input and an output file, not standard input or output.")
+    elif args.watch and args.input_file:
+        watch_conversion(args)
+    elif args.input_file and is_batch_input(args.input_file):
+        failures = batch_conversion(args)
+    elif args.input_file:
+        arg_based_conversion(args, data_output)
+    else:
+        prompt_based_conversion()
+
+    if highlight_cache is not None:
+        print(format_highlight_cache_stats(cache_stats, highlight_cache.stats()))
+    if profiler is not None:
+        write_profile_report(profiler, args.profile)
+    if failures:
+        sys.exit(1)
+
+
+def format_highlight_cache_stats(before: dict, after: dict) -> str:
+    """
+    Summarize highlight cache use between two HighlightCache.stats() snapshots.
+
+    Args:
+        before: Stats taken before the run
+        after: Stats taken after the run
+
+    Returns:
+        One-line summary of hits, misses and evictions during the run, and the cache size
+    """
+    hits = after['hits'] - before['hits']
+    misses = after['misses'] - before['misses']
+    hit_rate = 100.0 * hits / (hits + misses) if hits + misses else 0.0
+    return (f"Highlight cache: {hits} hits, {misses} misses ({hit_rate:.0f}% hit rate), "
+            f"{after['evictions'] - before['evictions']} evicted; "
+            f"{after['entries']} entries, {after['bytes'] / (1 << 20):.1f} MB")
+
+
+def write_profile_report(profiler: Profiler, destination: str) -> None:
+    """
+    Print a profile as a table, or save it as JSON.
+
+    Args:
+        profiler: Profiler that recorded the run
+        destination: '-' to print a table, otherwise the path of a JSON file to write
+    """
+    if destination == '-':
+        print(profiler.format_table())
+        return
+    try:
+        with open(destination, 'w', encoding='utf-8') as profile_file:
+            json.dump(profiler.report(), profile_file, indent=2)
+        print(f"Profile saved to {destination}")
+    except OSError as e:
+        print(f"Error writing profile: {e}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,149 @@
+"""
+Python-Markdown processors and extension used by md2html's 'tree' engine and streaming converter.
+
+This module imports markdown at load time, so md2html imports it only when it
+creates its first Markdown instance (see md2html.create_markdown); printing
+help or reporting a missing input never loads it.
+"""
+import re
+import xml.etree.ElementTree as etree
+from html import unescape
+
+import markdown
+from markdown.extensions import Extension
+from markdown.extensions.toc import unique
+from markdown.postprocessors import Postprocessor
+from markdown.treeprocessors import Treeprocessor
+
+from md2html import (_BLOCK_TAG_RE, _CLASS_ATTRIBUTE_RE, _CODE_BLOCK_PLACEHOLDER, _EDGE_WHITESPACE_RE,
+                     _NUMERIC_CHARREF_RE, _STASHED_CODE_BLOCK_RE, OutputOptions, _RawHtmlNormalizer,
+                     _code_block_html, _escape_text, _language_from_classes, _rewrite_image_attributes,
+                     highlight_blocks)
+
+
+class CodeBlockTreeprocessor(Treeprocessor):
+    """
+    Highlight code blocks, add copy buttons and rewrite images on the ElementTree.
+
+    Indented code blocks and images live in the tree; fenced code blocks and
+    raw HTML live in the markdown stash and are rewritten there, including the
+    <pre><code> blocks written as raw HTML.
+    """
+
+    def __init__(self, md: markdown.Markdown, light_mode: bool = True, highlight_jobs: int = 1,
+                 options: OutputOptions = OutputOptions()) -> None:
+        super().__init__(md)
+        self.light_mode = light_mode
+        self.highlight_jobs = highlight_jobs
+        self.highlight = options.enabled('highlight')
+        self.copy_buttons = options.enabled('copy_buttons')
+        self.images = options.enabled('images')
+        # With neither code block stage, fenced blocks are normalized like any other raw HTML
+        self.code_blocks = self.highlight or self.copy_buttons
+
+    def run(self, root: etree.Element) -> None:
+        stash = self.md.htmlStash.rawHtmlBlocks
+        normalizer = _RawHtmlNormalizer(self.images, self.code_blocks, self.copy_buttons)
+        # (stash index, code, language, placeholder) of every code block, highlighted together at the
+        # end; the block replaces its placeholder in the stashed HTML, or the whole entry if it has none
+        code_blocks = []
+        # Snapshot the stash length: blocks stored below are already in final form
+        for index in range(len(stash)):
+            block = stash[index]
+            if isinstance(block, etree.Element):
+                self.rewrite_tree(block, code_blocks)
+                continue
+            match = _STASHED_CODE_BLOCK_RE.fullmatch(block) if self.code_blocks else None
+            if match:
+                class_match = _CLASS_ATTRIBUTE_RE.search(match.group(1))
+                language = _language_from_classes(unescape(class_match.group(1)) if class_match else None)
+                code_blocks.append((index, unescape(match.group(2)), language, None))
+            else:
+                normalized = normalizer.normalize(block)
+                tag_match = _BLOCK_TAG_RE.match(block)
+                # Same test as markdown's raw_html postprocessor: comments and the like count as blocks
+                if tag_match and (tag_match.group(1)[0] in '!?@%' or self.md.is_block_level(tag_match.group(1))):
+                    # Block-level HTML sits between newlines in the markdown output;
+                    # its edge whitespace would merge into those and collapse away
+                    normalized = _EDGE_WHITESPACE_RE.sub('', normalized)
+                stash[index] = normalized
+                code_blocks.extend((index, code, language, _CODE_BLOCK_PLACEHOLDER % number)
+                                   for number, (code, language) in enumerate(normalizer.code_blocks))
+        self.rewrite_tree(root, code_blocks)
+
+        if self.highlight:
+            highlighted_blocks = highlight_blocks([(code, language) for _, code, language, _ in code_blocks],
+                                                  self.light_mode, self.highlight_jobs)
+        else:
+            highlighted_blocks = [_escape_text(code) for _, code, _, _ in code_blocks]
+        for (index, _, language, placeholder), highlighted_code in zip(code_blocks, highlighted_blocks):
+            block_html = _code_block_html(highlighted_code, language, self.copy_buttons)
+            stash[index] = block_html if placeholder is None else stash[index].replace(placeholder, block_html, 1)
+
+    def rewrite_tree(self, root: etree.Element, code_blocks: list) -> None:
+        """Rewrite the images found under an element, and stash its code blocks in code_blocks."""
+        for image in root.iter('img') if self.images else ():
+            attributes = dict(image.attrib)
+            _rewrite_image_attributes(attributes)
+            image.attrib.update(attributes)
+        for pre in list(root.iter('pre')) if self.code_blocks else ():
+            code = pre.find('code')
+            if code is None:
+                continue
+            language = _language_from_classes(code.get('class'))
+            code_text = unescape(''.join(code.itertext()))
+            # Reserve the stash slot now; run() fills it once the block is highlighted
+            placeholder = self.md.htmlStash.store('')
+            code_blocks.append((len(self.md.htmlStash.rawHtmlBlocks) - 1, code_text, language, None))
+            # Same trick as markdown's codehilite: a <p> holding only a placeholder is
+            # replaced by the stashed block-level HTML in the raw_html postprocessor
+            tail = pre.tail
+            pre.clear()
+            pre.tag = 'p'
+            pre.text = placeholder
+            pre.tail = tail
+
+
+class CharacterReferencePostprocessor(Postprocessor):
+    """Decode numeric character references emitted by markdown postprocessors (footnote arrows, obfuscated emails)."""
+
+    def run(self, text: str) -> str:
+        return _NUMERIC_CHARREF_RE.sub(self._decode, text)
+
+    @staticmethod
+    def _decode(match: re.Match) -> str:
+        character = unescape(match.group(0))
+        if character == '"':
+            return '&quot;'
+        return _escape_text(character)
+
+
+class TreeRenderExtension(Extension):
+    """Markdown extension implementing the 'tree' rendering engine."""
+
+    def __init__(self, light_mode: bool = True, highlight_jobs: int = 1,
+                 options: OutputOptions = OutputOptions(), **kwargs) -> None:
+        self.light_mode = light_mode
+        self.highlight_jobs = highlight_jobs
+        self.options = options
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md: markdown.Markdown) -> None:
+        # After inline (20), attr_list (8) and toc (5), before unescape (0)
+        md.treeprocessors.register(CodeBlockTreeprocessor(md, self.light_mode, self.highlight_jobs,
+                                                          self.options), 'md2html_code_blocks', 1)
+        # After footnote (25) and amp_substitute (20) have written their character references
+        md.postprocessors.register(CharacterReferencePostprocessor(md), 'md2html_charrefs', 10)
+
+
+class UniqueHeadingIdTreeprocessor(Treeprocessor):
+    """Keep heading IDs unique across documents converted with one Markdown instance."""
+
+    def __init__(self, md: markdown.Markdown, used_ids: set) -> None:
+        super().__init__(md)
+        self.used_ids = used_ids
+
+    def run(self, root: etree.Element) -> None:
+        for element in root.iter():
+            if element.tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6') and element.get('id'):
+                element.set('id', unique(element.get('id'), self.used_ids))